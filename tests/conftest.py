@@ -0,0 +1,46 @@
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(autouse=True)
+def in_tmp_dir(tmp_path, monkeypatch):
+    """
+    Run every test in its own directory, the scrapers write their state files to the working directory
+    """
+    monkeypatch.chdir(tmp_path)
+
+@pytest.fixture
+def http_server():
+    """
+    Serve routes mapping a path (without query string) to (status, body) from a local HTTP server,
+    yields a function that starts it and returns its base URL
+    """
+    servers = []
+
+    def serve(routes):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, body = routes.get(self.path.split('?')[0], (404, b''))
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
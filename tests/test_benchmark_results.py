@@ -0,0 +1,21 @@
+import json
+import os
+import subprocess
+
+from yad2_benchmark import git_commit, load_results, main
+
+def test_results_note_synthetic_fixtures_and_go_to_the_given_path(monkeypatch):
+    monkeypatch.setattr('yad2_benchmark.git_commit', lambda: 'abc1234')
+    main(['cars_search_parsing'], path='results.jsonl')
+
+    with open('results.jsonl', encoding='utf-8') as f:
+        run = json.loads(f.readline())
+    assert run['commit'] == 'abc1234'
+    assert run['synthetic_fixtures'] == ['cars_feed.html']
+    assert not load_results('results.jsonl').empty
+
+def test_commit_is_read_from_the_repo_not_the_working_directory():
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    head = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                          cwd=repo).stdout.strip()
+    assert git_commit().split('-')[0] == head
@@ -0,0 +1,70 @@
+import os
+import shutil
+
+import pytest
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+
+from yad2_benchmark import make_collection_html
+from yad2_card_parsers import EXTRACT_CARDS_JS, extract_cards_in_browser, parse_cards_bs4
+from test_card_parsers import EDGE_CASE_CARDS
+
+CHROME_BINARIES = ['google-chrome', 'google-chrome-stable', 'chromium', 'chromium-browser', 'chrome']
+
+@pytest.fixture(scope='module')
+def chrome():
+    """
+    A headless Chrome, the test is skipped where none is installed
+    """
+    if not any(shutil.which(binary) for binary in CHROME_BINARIES):
+        pytest.skip("Chrome is not installed")
+    options = Options()
+    options.add_argument('--headless=new')
+    options.add_argument('--no-sandbox')
+    try:
+        driver = webdriver.Chrome(options=options)
+    except Exception as e:
+        pytest.skip(f"Chrome could not be started: {e}")
+    yield driver
+    driver.quit()
+
+def test_script_in_chrome_matches_bs4(chrome, tmp_path):
+    html = make_collection_html(60).replace('</body>', f'{EDGE_CASE_CARDS}</body>')
+    page = tmp_path / 'feed.html'
+    page.write_text(html, encoding='utf-8')
+    chrome.get(f"file://{os.path.abspath(page)}")
+    cards = extract_cards_in_browser(chrome)
+    assert cards == parse_cards_bs4(html)
+    assert len(cards) == 59
+
+class FakeDriver:
+    """
+    Answers EXTRACT_CARDS_JS with a fixed raw result, to check the Python side of extract_cards_in_browser
+    """
+    def __init__(self, raw_cards):
+        self.raw_cards = raw_cards
+        self.calls = []
+
+    def execute_script(self, script, *selectors):
+        self.calls.append((script, selectors))
+        return self.raw_cards
+
+def test_raw_script_result_is_cleaned_up_like_bs4():
+    driver = FakeDriver([
+        {'href': '/market/item/42', 'image_url': 'https://cdn.shopify.com/y2_42.jpg', 'price': '\n  ₪1,200 ',
+         'location': ' חיפה\n', 'title': '\n  כיסא משרדי  ', 'tags': [' חדש ', 'איסוף עצמי']},
+        {'href': None, 'image_url': '', 'price': '', 'location': '', 'title': 'ספה', 'tags': []},
+    ])
+    assert extract_cards_in_browser(driver) == [
+        {'product_id': '42', 'title': 'כיסא משרדי', 'current_price': '1,200', 'location': 'חיפה',
+         'image_url': 'https://cdn.shopify.com/y2_42.jpg', 'product_url': 'https://www.yad2.co.il/market/item/42',
+         'tags': 'חדש, איסוף עצמי'},
+        {'product_id': '', 'title': 'ספה', 'current_price': '', 'location': '', 'image_url': '',
+         'product_url': '', 'tags': ''},
+    ]
+    [(script, selectors)] = driver.calls
+    assert script == EXTRACT_CARDS_JS
+    assert selectors[0] == 'article.item-grid_grid__P3tKb'
+
+def test_empty_script_result_gives_no_cards():
+    assert extract_cards_in_browser(FakeDriver(None)) == []
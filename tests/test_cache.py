@@ -0,0 +1,58 @@
+import os
+
+import requests
+
+from yad2_benchmark import serve_fixtures
+from yad2_cache import HttpCache
+
+BASE_PATH = '/market/item/'
+
+def test_running_total_tracks_stores_and_evicts_least_recently_used(http_server):
+    base_url = http_server({f"{BASE_PATH}{i}": (200, bytes([i]) * 1000) for i in range(5)})
+    cache = HttpCache('http_cache', max_bytes=3000)
+    with requests.Session() as session:
+        for i in range(3):
+            cache.get(session, f"{base_url}{BASE_PATH}{i}")
+        assert cache.total_bytes == 3000
+        # Replacing an entry counts its new size only once
+        cache.store(f"{base_url}{BASE_PATH}0", session.get(f"{base_url}{BASE_PATH}0"))
+        assert cache.total_bytes == 3000
+
+        cache.get(session, f"{base_url}{BASE_PATH}3")
+        assert cache.total_bytes == 3000
+        urls = {url for url, in cache.conn.execute('SELECT url FROM entries')}
+        assert urls == {f"{base_url}{BASE_PATH}{i}" for i in (0, 2, 3)}
+    cache.close()
+
+    # The total is read back from the index
+    assert HttpCache('http_cache', max_bytes=3000).total_bytes == 3000
+    assert sum(len(files) for _, _, files in os.walk(os.path.join('http_cache', 'bodies'))) == 3
+
+def test_captcha_pages_are_not_cached(http_server):
+    captcha_page = b'<html><body><div class="captcha-wrapper"><iframe></iframe></div></body></html>'
+    base_url = http_server({'/market/item/1': (200, captcha_page)})
+    cache = HttpCache('http_cache')
+    with requests.Session() as session:
+        for _ in range(2):
+            assert cache.get(session, f"{base_url}/market/item/1").content == captcha_page
+    assert cache.stats['hits'] == 0 and cache.stats['misses'] == 2
+    assert cache.total_bytes == 0
+    cache.close()
+
+def test_entries_are_keyed_by_query_parameters():
+    cache = HttpCache('http_cache')
+    with serve_fixtures({'/api/feed': lambda path: path.encode()}) as base_url, requests.Session() as session:
+        first = cache.get(session, f"{base_url}/api/feed", params={'a': 1}).content
+        second = cache.get(session, f"{base_url}/api/feed", params={'a': 2}).content
+        assert (first, second) == (b'/api/feed?a=1', b'/api/feed?a=2')
+        assert cache.get(session, f"{base_url}/api/feed", params={'a': 1}).content == first
+        assert cache.is_fresh(f"{base_url}/api/feed", params={'a': 2})
+    assert cache.stats['hits'] == 1
+    cache.close()
+
+def test_cache_dir_survives_a_chdir(tmp_path, monkeypatch):
+    cache = HttpCache('http_cache')
+    monkeypatch.chdir(tmp_path.parent)
+    assert cache.cache_dir == str(tmp_path / 'http_cache')
+    assert cache._body_path('ab' * 32).startswith(str(tmp_path))
+    cache.close()
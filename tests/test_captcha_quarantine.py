@@ -0,0 +1,44 @@
+import json
+import os
+
+import pytest
+
+import yad2_scraper_collections
+from yad2_scraper_collections import QUARANTINE_FILE, CaptchaQuarantine, Yad2CollectionsScraper, solve_quarantined_queries
+
+def test_backoff_retries_three_times_before_surfacing():
+    quarantine = CaptchaQuarantine()
+    query = [{'category_key': 'furniture', 'filters': {}}]
+    for attempts, delay in ((1, 300), (2, 600), (3, 1200)):
+        quarantine.park(query, attempts)
+        assert quarantine.next_retry_in() == pytest.approx(delay, abs=5)
+        quarantine.parked.clear()
+    assert not os.path.exists(QUARANTINE_FILE)
+    quarantine.park(query, 4)
+    assert len(quarantine) == 0
+    with open(QUARANTINE_FILE, encoding='utf-8') as f:
+        assert [entry['category_key'] for entry in json.load(f)] == ['furniture']
+
+def test_solver_removes_only_solved_queries(monkeypatch):
+    quarantined = [{'category_key': key, 'filters': {}, 'attempts': 4, 'parked_date': '2025-05-20 10:00'}
+                   for key in ('furniture', 'electronics_earphones', 'bikes_and_scooters')]
+    with open(QUARANTINE_FILE, 'w', encoding='utf-8') as f:
+        json.dump(quarantined, f)
+    profiles = []
+
+    def scrape_category(self, category_key, filters=None):
+        profiles.append(self.profile_dir)
+        if category_key == 'bikes_and_scooters':
+            raise KeyboardInterrupt
+        self.captcha_blocked = category_key == 'furniture'
+        return 0
+
+    monkeypatch.setattr(Yad2CollectionsScraper, 'scrape_category', scrape_category)
+    monkeypatch.setattr(yad2_scraper_collections, 'log_captcha_stats', lambda category_keys: None)
+    with pytest.raises(KeyboardInterrupt):
+        solve_quarantined_queries()
+
+    # The blocked query and the interrupted one stay, the solved one is gone
+    with open(QUARANTINE_FILE, encoding='utf-8') as f:
+        assert [entry['category_key'] for entry in json.load(f)] == ['furniture', 'bikes_and_scooters']
+    assert set(profiles) == {os.path.abspath(os.path.join('chrome_profiles', 'solver'))}
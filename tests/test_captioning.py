@@ -0,0 +1,77 @@
+import pandas as pd
+import pytest
+
+import yad2_image_caption_gpt as captioning
+from yad2_benchmark import serve_mock_openai
+from yad2_utils import JsonlJournal
+
+def make_deep_dive_csv(n_rows: int) -> str:
+    pd.DataFrame({
+        'product_id': [str(7_375_102_279_740 + i) for i in range(n_rows)],
+        'image_url': [f"https://cdn.shopify.com/s/files/{i}.jpg" for i in range(n_rows)],
+        'description': ['ספה תלת מושבית במצב מצוין'] * n_rows,
+        'current_price': ['1,200'] * n_rows,
+    }).to_csv('deep_dive.csv', index=False)
+    return 'deep_dive.csv'
+
+def test_cached_rerun_needs_no_api_key(monkeypatch):
+    csv_path = make_deep_dive_csv(5)
+    monkeypatch.setenv('OPENAI_API_KEY', 'mock-key')
+    with serve_mock_openai() as (base_url, stats):
+        captioning.main(csv_path, 'images', base_url=base_url, prompt_template='{description}\n{price}')
+    assert stats['requests'] == 5
+
+    monkeypatch.delenv('OPENAI_API_KEY')
+    captioning.main(csv_path, 'images', prompt_template='{description}\n{price}')
+    assert (pd.read_csv('captioned_deep_dive.csv', dtype=str)['offer_price'] == '800').all()
+
+    # A row that needs the API still asks for the key
+    with pytest.raises(ValueError, match='OPENAI_API_KEY'):
+        captioning.main(csv_path, 'images', prompt_template='{description}\n{price} NIS')
+
+def test_captions_every_row_through_rate_limits_and_caches_them(monkeypatch):
+    csv_path = make_deep_dive_csv(20)
+    monkeypatch.setenv('OPENAI_API_KEY', 'mock-key')
+    with serve_mock_openai(rate_limit_every=4) as (base_url, stats):
+        # Every 4th request is a 429, retried after its Retry-After (one worker, so a retry is never the 4th again)
+        captioning.main(csv_path, 'images', max_workers=1, base_url=base_url, prompt_template='{description}\n{price}')
+        assert stats['rate_limited'] > 0
+        assert stats['requests'] == 20 + stats['rate_limited']
+        output = pd.read_csv('captioned_deep_dive.csv', dtype=str)
+        assert len(output) == 20
+        assert (output['offer_price'] == '800').all()
+        assert (output['issues'] == 'ugly repair on the handlebar, torn saddle').all()
+
+        n_requests = stats['requests']
+        captioning.main(csv_path, 'images', max_workers=4, base_url=base_url, prompt_template='{description}\n{price}')
+        assert stats['requests'] == n_requests
+        captioning.main(csv_path, 'images', max_workers=4, base_url=base_url,
+                        prompt_template='{description}\n{price} NIS')
+        assert stats['requests'] - n_requests >= 20
+
+def test_resumes_from_the_journal(monkeypatch):
+    csv_path = make_deep_dive_csv(6)
+    monkeypatch.setenv('OPENAI_API_KEY', 'mock-key')
+    journal = JsonlJournal('captioned_deep_dive.csv.jsonl')
+    for i in range(4):
+        journal.append({'row_key': str(7_375_102_279_740 + i), **captioning.parse_caption_to_columns('1\n2\n3'),
+                        'full_caption': '1\n2\n3'})
+    journal.close()
+    with serve_mock_openai() as (base_url, stats):
+        captioning.main(csv_path, 'images', base_url=base_url, prompt_template='{description}\n{price}')
+    assert stats['requests'] == 2
+    output = pd.read_csv('captioned_deep_dive.csv', dtype=str)
+    assert output['state'].tolist() == ['1'] * 4 + ['7'] * 2
+
+def test_cache_hits_are_journaled_in_one_write(monkeypatch):
+    csv_path = make_deep_dive_csv(10)
+    monkeypatch.setenv('OPENAI_API_KEY', 'mock-key')
+    with serve_mock_openai() as (base_url, stats):
+        captioning.main(csv_path, 'images', base_url=base_url, prompt_template='{description}\n{price}')
+
+    writes = []
+    append_many = JsonlJournal.append_many
+    monkeypatch.setattr(JsonlJournal, 'append_many', lambda self, records: (writes.append(len(records)),
+                                                                             append_many(self, records)))
+    captioning.main(csv_path, 'images', prompt_template='{description}\n{price}')
+    assert writes == [10]
@@ -0,0 +1,52 @@
+import pytest
+from bs4 import BeautifulSoup
+
+from yad2_benchmark import make_collection_html
+from yad2_card_parsers import CARD_CLASS, PARSER_BACKENDS, extract_card_fields, get_card_parser
+
+# Cards the templates don't cover: missing fields, extra classes, comments and padded text
+EDGE_CASE_CARDS = '''
+<article class="item-grid_grid__P3tKb extra">
+  <!-- no link or image -->
+  <h2 class="item-title_title__2tG20">
+     כיסא <b>משרדי</b>
+  </h2>
+  <p class="item-price_price__HMXoj">₪ 150 </p>
+</article>
+<article class="item-grid_grid__P3tKb">
+  <a class="item-grid_imageContainer__U2drL" href="/market/item/42"><img class="shopify-image_image__KPxpT"></a>
+  <p class="item-location_location__E96ST">חיפה</p>
+  <p class="item-location_location__E96ST">not the first location</p>
+  <div class="item-tags_tags__GdgQO"><p class="tag_tag__Zaq8_"> חדש </p><p class="other">skip</p></div>
+</article>
+<article class="not-a-card"><h2 class="item-title_title__2tG20">skip</h2></article>
+'''
+
+def reference_cards(html: str):
+    """
+    The per-card BeautifulSoup path the backends replaced
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    return [fields for fields in map(extract_card_fields, soup.find_all('article', class_=CARD_CLASS)) if fields]
+
+@pytest.mark.parametrize('backend', list(PARSER_BACKENDS))
+def test_backend_matches_reference(backend):
+    html = make_collection_html(60)
+    cards = PARSER_BACKENDS[backend](html)
+    assert cards == reference_cards(html)
+    # Every 25th card is a new business listing
+    assert len(cards) == 57
+
+@pytest.mark.parametrize('backend', list(PARSER_BACKENDS))
+def test_backend_matches_reference_on_edge_cases(backend):
+    html = f'<html><body>{EDGE_CASE_CARDS}</body></html>'
+    cards = PARSER_BACKENDS[backend](html)
+    assert cards == reference_cards(html)
+    assert [card['product_id'] for card in cards] == ['', '42']
+    assert cards[0]['title'] == 'כיסא משרדי'
+    assert cards[1]['tags'] == 'חדש'
+
+def test_auto_picks_an_installed_backend():
+    assert get_card_parser() in PARSER_BACKENDS.values()
+    with pytest.raises(ValueError):
+        get_card_parser('regex')
@@ -0,0 +1,24 @@
+import json
+
+import pandas as pd
+
+from yad2_scraper_cars import Yad2Scraper
+
+def test_checkpoint_of_a_crashed_crawl_is_recovered_into_the_csv():
+    with open('yad2_listings.csv.partial.jsonl', 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'id': '1', 'price': '1000'}) + '\n')
+        f.write(json.dumps({'id': '2', 'price': '2000'}) + '\n')
+        f.write('{"id": "3", "pri')  # Torn last line
+
+    assert Yad2Scraper().stream_to_csv(iter([])) == 0
+    df = pd.read_csv('yad2_listings.csv', dtype=str)
+    assert df['id'].tolist() == ['1', '2']
+
+def test_completed_crawl_replaces_the_recovered_listings():
+    with open('yad2_listings.csv.partial.jsonl', 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'id': '1', 'price': '1000'}) + '\n')
+
+    pages = iter([(1, [{'id': '1', 'price': '900'}, {'id': '4', 'price': '4000'}])])
+    assert Yad2Scraper().stream_to_csv(pages) == 2
+    df = pd.read_csv('yad2_listings.csv', dtype=str)
+    assert df.to_dict('records') == [{'id': '1', 'price': '900'}, {'id': '4', 'price': '4000'}]
@@ -0,0 +1,38 @@
+import time
+
+import pytest
+
+from yad2_scraper_cars import Yad2Scraper
+
+@pytest.mark.parametrize('prefetch', [0, 1, 3])
+def test_crawl_yields_pages_in_order_until_an_empty_page(prefetch):
+    scraper = Yad2Scraper()
+    scraper.cookies_warmed = True
+    scraper.fetch_search_page = lambda params: str(params['page'])
+    scraper.parse_search_page = lambda html: [{'id': f"{html}-{i}"} for i in range(2)] if int(html) <= 4 else []
+
+    pages = list(scraper.crawl(prefetch=prefetch))
+    assert [page for page, _ in pages] == [1, 2, 3, 4]
+    assert pages[0][1] == [{'id': '1-0'}, {'id': '1-1'}]
+
+@pytest.mark.parametrize('prefetch, fetched_before_parsing', [(0, 1), (1, 2), (3, 4)])
+def test_prefetch_pages_are_in_flight_while_a_page_is_parsed(prefetch, fetched_before_parsing):
+    scraper = Yad2Scraper()
+    scraper.cookies_warmed = True
+    fetched = []
+    n_fetched_at_first_parse = []
+
+    def fetch_search_page(params):
+        fetched.append(params['page'])
+        return str(params['page'])
+
+    def parse_search_page(html):
+        if not n_fetched_at_first_parse:
+            time.sleep(0.1)  # Let the submitted fetches start
+            n_fetched_at_first_parse.append(len(fetched))
+        return [{'id': html}] if int(html) <= 4 else []
+
+    scraper.fetch_search_page = fetch_search_page
+    scraper.parse_search_page = parse_search_page
+    assert [page for page, _ in scraper.crawl(prefetch=prefetch)] == [1, 2, 3, 4]
+    assert n_fetched_at_first_parse == [fetched_before_parsing]
@@ -0,0 +1,144 @@
+
+import pandas as pd
+import pytest
+
+import yad2_scraper_collections
+from yad2_benchmark import CARD_TEMPLATE
+from yad2_scraper_collections import (FEED_IDS_JS, FEED_STATE_JS, Yad2CollectionsScraper, get_output_file,
+                                      load_crawl_state)
+
+FIRST_ID = 7_375_102_279_740
+
+def make_existing_csv(n_listings: int) -> str:
+    output_file = get_output_file('furniture', {})
+    ids = [str(FIRST_ID + i) for i in range(n_listings)]
+    pd.DataFrame({
+        'product_id': ids,
+        'title': 'ספה',
+        'current_price': '500',
+        'location': 'תל אביב',
+        'image_url': '',
+        'product_url': [f"https://www.yad2.co.il/market/item/{product_id}" for product_id in ids],
+        'tags': '',
+        'first_seen_date': '2025-05-20',
+        'last_seen_date': '2025-05-20',
+        'closing_date': None,
+    }).to_csv(output_file, index=False)
+    return output_file
+
+def serve_feed(scraper: Yad2CollectionsScraper, n_live: int, per_page: int = 10):
+    """
+    Answer the HTTP path from an embedded-data feed of n_live listings, per_page per page
+    """
+    items = [{'id': str(FIRST_ID + i), 'title': f'ספה {i}', 'price': 500, 'url': f'/market/item/{FIRST_ID + i}'}
+             for i in range(n_live)]
+
+    def fetch_embedded_data(url, params=None, timeout=15):
+        page = int((params or {}).get('pageNumber', 1))
+        return {'props': {'pageProps': {'feed': {'items': items[(page - 1) * per_page:page * per_page]}}}}
+
+    scraper.fetch_embedded_data = fetch_embedded_data
+
+def closed_ids(output_file: str) -> set:
+    df = pd.read_csv(output_file, dtype=str)
+    return set(df.loc[df['closing_date'].notna(), 'product_id'])
+
+def test_page_cap_does_not_close_unseen_listings():
+    output_file = make_existing_csv(100)
+    scraper = Yad2CollectionsScraper(fetch_mode='http', max_http_pages=3)
+    serve_feed(scraper, n_live=100)
+    assert scraper.scrape_category('furniture', {}) == 30
+    assert scraper.crawl_truncated
+    assert closed_ids(output_file) == set()
+    scraper.close()
+
+def test_complete_crawl_closes_missing_listings():
+    output_file = make_existing_csv(100)
+    scraper = Yad2CollectionsScraper(fetch_mode='http', max_http_pages=20)
+    serve_feed(scraper, n_live=90)
+    assert scraper.scrape_category('furniture', {}) == 90
+    assert not scraper.crawl_truncated
+    assert closed_ids(output_file) == {str(FIRST_ID + i) for i in range(90, 100)}
+    scraper.close()
+
+class FakeFeedDriver:
+    """
+    Stands in for Chrome on an infinite-scroll feed of n_live cards that loads per_scroll more per scroll
+    """
+    def __init__(self, n_live: int, per_scroll: int = 30):
+        self.n_live = n_live
+        self.per_scroll = per_scroll
+        self.loaded = min(per_scroll, n_live)
+
+    def product_ids(self):
+        return [str(FIRST_ID + i) for i in range(self.loaded)]
+
+    def execute_script(self, script, *args):
+        if script == FEED_STATE_JS:
+            return [self.loaded, False]
+        if script == FEED_IDS_JS:
+            return self.product_ids()
+        if 'scrollTo' in script:
+            self.loaded = min(self.loaded + self.per_scroll, self.n_live)
+        return None
+
+    def find_elements(self, by, selector):
+        return [None] * self.loaded
+
+    @property
+    def page_source(self):
+        cards = ''.join(CARD_TEMPLATE.format(product_id=product_id, price=500, business_tag='')
+                        for product_id in self.product_ids())
+        return f'<html><body><div class="feed_feedContainer__Abipd">{cards}</div></body></html>'
+
+    def get_log(self, log_type):
+        return []
+
+    def quit(self):
+        pass
+
+def run_selenium_crawl(n_live: int, **kwargs) -> Yad2CollectionsScraper:
+    scraper = Yad2CollectionsScraper(**kwargs)
+    scraper.driver = FakeFeedDriver(n_live)
+    scraper.load_page = lambda url: (0.1, False)
+    scraper.wait_for_products = lambda: True
+    scraper.get_scroll_timeout = lambda: 0.01
+    scraper.scrape_category('furniture', {})
+    scraper.close()
+    return scraper
+
+@pytest.mark.parametrize('scroll_mode', ['event', 'sleep'])
+def test_scrolling_to_the_end_of_the_feed_is_a_full_sweep(monkeypatch, scroll_mode):
+    monkeypatch.setattr(yad2_scraper_collections.time, 'sleep', lambda seconds: None)
+    output_file = make_existing_csv(100)
+    scraper = run_selenium_crawl(90, scroll_mode=scroll_mode, stop_after_known=30)
+    assert scraper.feed_ended and not scraper.crawl_truncated
+    assert closed_ids(output_file) == {str(FIRST_ID + i) for i in range(90, 100)}
+    assert load_crawl_state()[output_file]['last_full_sweep']
+
+    # With a recent full sweep the next crawl is incremental and stops on the known listings
+    scraper = run_selenium_crawl(90, scroll_mode=scroll_mode, stop_after_known=30)
+    assert scraper.incremental and scraper.crawl_reached_known
+    assert closed_ids(output_file) == {str(FIRST_ID + i) for i in range(90, 100)}
+
+def test_scroll_error_does_not_close_unseen_listings():
+    output_file = make_existing_csv(100)
+    scraper = Yad2CollectionsScraper()
+    driver = FakeFeedDriver(100)
+    execute_script = driver.execute_script
+
+    def failing_execute_script(script, *args):
+        if 'scrollTo' in script and driver.loaded >= 60:
+            raise RuntimeError("renderer crashed")
+        return execute_script(script, *args)
+
+    driver.execute_script = failing_execute_script
+    scraper.driver = driver
+    scraper.load_page = lambda url: (0.1, False)
+    scraper.wait_for_products = lambda: True
+    scraper.get_scroll_timeout = lambda: 0.01
+    assert scraper.scrape_category('furniture', {}) == 60
+    assert scraper.crawl_truncated
+    assert closed_ids(output_file) == set()
+    assert load_crawl_state() == {}
+    scraper.close()
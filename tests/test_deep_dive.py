@@ -0,0 +1,53 @@
+import pandas as pd
+import pytest
+
+from yad2_benchmark import make_item_page
+from yad2_deep_dive import deep_dive
+from yad2_utils import PolitenessScheduler
+
+FIRST_ID = 7_375_102_279_740
+
+def run_deep_dive(base_url: str, n_listings: int, **kwargs) -> pd.DataFrame:
+    pd.DataFrame({
+        'product_id': [str(FIRST_ID + i) for i in range(n_listings)],
+        'product_url': [f"{base_url}/market/item/{FIRST_ID + i}" for i in range(n_listings)],
+    }).to_csv('input.csv', index=False)
+    deep_dive('input.csv', 'output.csv', delay=0, fetch_workers=4, retries=0, use_cache=False, skip_reposts=False,
+              scheduler=PolitenessScheduler(rate=1e9, host_rates={}, cooldown=0, state_path=None), **kwargs)
+    return pd.read_csv('output.csv', dtype=str)
+
+@pytest.mark.parametrize('parse_workers', [0, 2])
+def test_deep_dive_fetches_and_parses_every_page(http_server, parse_workers):
+    routes = {f"/market/item/{FIRST_ID + i}": (200, make_item_page(FIRST_ID + i, padding_kb=1).encode())
+              for i in range(12)}
+    routes[f"/market/item/{FIRST_ID + 5}"] = (404, b'')
+    base_url = http_server(routes)
+
+    output = run_deep_dive(base_url, 12, parse_workers=parse_workers)
+    assert sorted(output['product_id']) == sorted(str(FIRST_ID + i) for i in range(12) if i != 5)
+    assert output['description'].str.contains('ספה').all()
+    assert output['details_json'].str.startswith('{').all()
+
+def test_deep_dive_resumes_from_its_output(http_server):
+    routes = {f"/market/item/{FIRST_ID + i}": (200, make_item_page(FIRST_ID + i, padding_kb=1).encode())
+              for i in range(4)}
+    base_url = http_server(routes)
+    run_deep_dive(base_url, 2, parse_workers=0)
+    output = run_deep_dive(base_url, 4, parse_workers=0)
+    assert sorted(output['product_id']) == [str(FIRST_ID + i) for i in range(4)]
+
+def test_captcha_pages_are_not_journaled_and_are_retried_next_run(http_server):
+    captcha_page = b'<html><body><div class="captcha-wrapper"><iframe></iframe></div></body></html>'
+    routes = {f"/market/item/{FIRST_ID + i}": (200, make_item_page(FIRST_ID + i, padding_kb=1).encode())
+              for i in range(3)}
+    page = routes[f"/market/item/{FIRST_ID + 1}"]
+    routes[f"/market/item/{FIRST_ID + 1}"] = (200, captcha_page)
+    base_url = http_server(routes)
+
+    output = run_deep_dive(base_url, 3, parse_workers=0)
+    assert sorted(output['product_id']) == [str(FIRST_ID), str(FIRST_ID + 2)]
+
+    routes[f"/market/item/{FIRST_ID + 1}"] = page
+    output = run_deep_dive(base_url, 3, parse_workers=0)
+    assert sorted(output['product_id']) == [str(FIRST_ID + i) for i in range(3)]
+    assert output['description'].str.contains('ספה').all()
@@ -0,0 +1,106 @@
+import gzip
+import json
+import os
+
+import pytest
+
+from yad2_benchmark import make_next_data_page
+from yad2_card_parsers import parse_cards_bs4, parse_cards_embedded
+from yad2_scraper_collections import Yad2CollectionsScraper
+from yad2_utils import NEXT_DATA_RE, PolitenessScheduler
+
+NEXT_DATA_FIXTURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                 'benchmark_fixtures', 'collection_next_data.html.gz')
+
+CAPTCHA_PAGE = b'<html><body><div class="captcha-wrapper"><iframe></iframe></div></body></html>'
+
+def make_scraper(**kwargs) -> Yad2CollectionsScraper:
+    scraper = Yad2CollectionsScraper(**kwargs)
+    scraper.scheduler = PolitenessScheduler(rate=1e9, cooldown=0, state_path=None)
+    return scraper
+
+@pytest.mark.skipif(not os.path.exists(NEXT_DATA_FIXTURE),
+                    reason="no recorded page, run `python yad2_benchmark.py record-fixtures`")
+def test_recorded_next_data_matches_rendered_cards():
+    with gzip.open(NEXT_DATA_FIXTURE, 'rt', encoding='utf-8') as f:
+        html = f.read()
+    cards = parse_cards_embedded(json.loads(NEXT_DATA_RE.search(html).group(1)))
+    assert cards
+    for card in cards:
+        assert card['product_id'].isdigit()
+        assert card['title']
+        assert card['current_price']
+        assert card['product_url'] == f"https://www.yad2.co.il/market/item/{card['product_id']}"
+    # Every card rendered server side must come out of the embedded data with the same fields
+    embedded = {card['product_id']: card for card in cards}
+    for card in parse_cards_bs4(html):
+        assert embedded[card['product_id']]['title'] == card['title']
+        assert embedded[card['product_id']]['current_price'] == card['current_price']
+
+def test_served_embedded_data_becomes_cards(http_server):
+    base_url = http_server({'/market/collections/furniture': (200, make_next_data_page(30).encode())})
+    scraper = make_scraper()
+    cards = parse_cards_embedded(scraper.fetch_embedded_data(f"{base_url}/market/collections/furniture"))
+    scraper.close()
+    assert len(cards) == 30
+    assert cards[0] == {
+        'product_id': '7375102279740',
+        'title': 'ספה נפתחת לאירוח 7375102279740',
+        'current_price': '200',
+        'location': 'בת חפר',
+        'image_url': 'https://cdn.shopify.com/s/files/1/0590/7860/6908/files/y2_7375102279740_large.jpg',
+        'product_url': 'https://www.yad2.co.il/market/item/7375102279740',
+        'tags': 'כמו חדש, איסוף עצמי',
+    }
+
+def test_only_feed_items_are_cards():
+    html = make_next_data_page(5)
+    data = json.loads(NEXT_DATA_RE.search(html).group(1))
+    # The seller, category and promoted item next to the feed look like listings but are not read
+    assert [card['title'] for card in parse_cards_embedded(data)] == [
+        f'ספה נפתחת לאירוח {7_375_102_279_740 + i}' for i in range(5)]
+
+    listing_lookalikes = {'props': {'pageProps': {'seller': {'id': 1, 'title': 'חנות', 'price': 0},
+                                                  'related': [{'id': 2, 'title': 'ספה', 'price': 100}]}}}
+    assert parse_cards_embedded(listing_lookalikes) == []
+    plain_feed = {'props': {'pageProps': {'feed': {'items': [{'id': 42, 'title': 'ספה', 'price': 100}]}}}}
+    assert [card['product_id'] for card in parse_cards_embedded(plain_feed)] == ['42']
+
+@pytest.mark.parametrize('status, body', [
+    (403, b'<html>Forbidden</html>'),
+    (429, b'<html>Too many requests</html>'),
+    (200, CAPTCHA_PAGE),
+])
+def test_blocked_pages_have_no_embedded_data(http_server, status, body):
+    base_url = http_server({'/market/collections/furniture': (status, body)})
+    scraper = make_scraper()
+    assert scraper.fetch_embedded_data(f"{base_url}/market/collections/furniture") is None
+    scraper.close()
+
+@pytest.mark.parametrize('status, body', [(403, b'<html>Forbidden</html>'), (200, CAPTCHA_PAGE)])
+def test_auto_mode_falls_back_to_selenium_when_blocked(http_server, status, body):
+    base_url = http_server({'/market/collections/furniture': (status, body)})
+    scraper = make_scraper(fetch_mode='auto')
+    loaded = []
+
+    def load_page(url):
+        # Stand in for Chrome: record the page and answer with a CAPTCHA so the search stops there
+        loaded.append(url)
+        return 0.1, True
+
+    scraper.load_page = load_page
+    scraper.collect_network_bytes = lambda: 0
+    listings, stop = scraper.search_collection(f"{base_url}/market/collections/furniture")
+    assert (listings, stop) == ([], True)
+    assert loaded == [f"{base_url}/market/collections/furniture?sortOption=newest"]
+    scraper.close()
+
+def test_http_mode_never_starts_chrome(http_server):
+    base_url = http_server({'/market/collections/furniture': (403, b'<html>Forbidden</html>')})
+    scraper = make_scraper(fetch_mode='http')
+    scraper.load_page = lambda url: pytest.fail("http mode must not load pages in the browser")
+    assert scraper.search_collection(f"{base_url}/market/collections/furniture") == ([], True)
+    scraper.close()
+
+def test_selenium_is_the_default_fetch_mode():
+    assert Yad2CollectionsScraper().fetch_mode == 'selenium'
@@ -0,0 +1,62 @@
+import os
+from io import BytesIO
+
+import pytest
+
+from yad2_phash import PHASH_AVAILABLE, PHashIndex, get_shared_index, load_repost_ids
+from yad2_scraper_collections import Yad2CollectionsScraper
+from yad2_utils import PolitenessScheduler, Yad2BaseScraper
+
+HASH = 0x0123456789ABCDEF
+
+def test_repost_indexed_by_another_index_is_flagged_on_next_add():
+    first = PHashIndex('images/phash.db')
+    second = PHashIndex('images/phash.db')
+    assert first.add('111', HASH) is None
+    # The second index loaded before '111' was stored, so it cannot see it yet
+    assert second.add('222', HASH ^ 0b1) is None
+
+    later = PHashIndex('images/phash.db')
+    assert later.add('111', HASH) is None
+    assert later.add('222', HASH ^ 0b1) == ('111', 1)
+    assert later.duplicate_of('222') == ('111', 1)
+    for index in (first, second, later):
+        index.close()
+
+def test_scrapers_share_one_index():
+    first, second = Yad2BaseScraper(), Yad2BaseScraper()
+    assert first.image_downloader.phash_index is second.image_downloader.phash_index
+    assert first.image_downloader.phash_index is get_shared_index('images/phash.db')
+    first.image_downloader.phash_index.add('111', HASH)
+    assert second.image_downloader.phash_index.add('222', HASH) == ('111', 0)
+
+def make_image(kind: str) -> bytes:
+    from PIL import Image
+    image = getattr(Image, f'{kind}_gradient')('L').convert('RGB')
+    output = BytesIO()
+    image.save(output, 'PNG')
+    return output.getvalue()
+
+@pytest.mark.skipif(not PHASH_AVAILABLE, reason="Pillow is not installed")
+def test_reposts_are_flagged_without_keeping_images(http_server):
+    original, other = make_image('linear'), make_image('radial')
+    base_url = http_server({'/a.png': (200, original), '/b.png': (200, original), '/c.png': (200, other)})
+    scraper = Yad2CollectionsScraper(detect_reposts=True)
+    scraper.scheduler = PolitenessScheduler(rate=1e9, host_rates={}, state_path=None)
+    for product_id, path in (('111', '/a.png'), ('222', '/b.png'), ('333', '/c.png')):
+        scraper.build_listing({'product_id': product_id, 'image_url': f"{base_url}{path}", 'title': '',
+                               'current_price': '', 'location': '', 'product_url': '', 'tags': ''})
+    scraper.close()
+
+    # The two listings are hashed concurrently, whichever came second is the repost
+    reposts = load_repost_ids('images/phash.db')
+    assert reposts in ({'111'}, {'222'})
+    [repost] = reposts
+    original_id = ({'111', '222'} - reposts).pop()
+    # Only the hash is kept, not the image
+    assert not [name for _, _, files in os.walk('images') for name in files if name.endswith('.png')]
+
+    # Known listings are checked again from their stored hash, never fetched
+    scraper = Yad2CollectionsScraper(detect_reposts=True)
+    assert scraper.queue_image_hash(repost, f"{base_url}/missing.png").result() == (original_id, 0)
+    scraper.close()
@@ -0,0 +1,59 @@
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from yad2_utils import PolitenessScheduler, is_captcha_response
+
+URL = 'https://www.yad2.co.il/market/collections/furniture'
+
+def make_response(body: str, content_type: str = 'text/html; charset=utf-8') -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response._content = body.encode()
+    response.headers = CaseInsensitiveDict({'Content-Type': content_type})
+    return response
+
+def make_scheduler() -> PolitenessScheduler:
+    return PolitenessScheduler(rate=10.0, host_rates={}, state_path=None)
+
+def host_rate(scheduler: PolitenessScheduler) -> float:
+    return scheduler.hosts['www.yad2.co.il']['rate']
+
+def test_captcha_wrapper_is_a_captcha():
+    assert is_captcha_response(make_response('<html><body><div class="captcha-wrapper"></div></body></html>'))
+    assert is_captcha_response(make_response('<div id="c" class="page captcha-wrapper dark">'))
+
+def test_pages_mentioning_captcha_are_not():
+    page = ('<html><head><script src="https://www.google.com/recaptcha/api.js"></script></head>'
+            '<body><p>Protected by reCAPTCHA</p><div class="captcha-badge"></div></body></html>')
+    assert not is_captcha_response(make_response(page))
+    assert not is_captcha_response(make_response('{"captcha-wrapper": 1}', content_type='application/json'))
+
+def test_browser_page_loads_do_not_look_like_http_latency_spikes():
+    scheduler = make_scheduler()
+    for _ in range(5):
+        scheduler.record(URL, status=200, latency=0.2)
+    scheduler.record(URL, latency=4.0, request_class='browser')
+    assert host_rate(scheduler) == 10.0
+
+def test_latency_spikes_within_a_request_class_back_off():
+    scheduler = make_scheduler()
+    for _ in range(5):
+        scheduler.record(URL, latency=4.0, request_class='browser')
+    scheduler.record(URL, latency=20.0, request_class='browser')
+    assert host_rate(scheduler) == 5.0
+
+def test_throttling_backs_off_and_recovers():
+    scheduler = make_scheduler()
+    scheduler.record(URL, status=429, retry_after=0.5)
+    assert host_rate(scheduler) == 5.0
+    assert scheduler.reserve(URL) > 0.3
+    for _ in range(20):
+        scheduler.record(URL, status=200, latency=0.2)
+    assert host_rate(scheduler) == 10.0
+
+def test_schedulers_share_state_through_the_state_file(tmp_path):
+    state_path = str(tmp_path / 'politeness.json')
+    first = PolitenessScheduler(rate=10.0, host_rates={}, state_path=state_path)
+    second = PolitenessScheduler(rate=10.0, host_rates={}, state_path=state_path)
+    first.record(URL, status=429, retry_after=1.0)
+    assert second.reserve(URL) > 0.8
@@ -0,0 +1,1045 @@
+import os
+import sys
+import gzip
+import json
+import subprocess
+import re
+import random
+import hashlib
+import sqlite3
+from io import BytesIO
+import time
+import logging
+import tempfile
+import threading
+import pandas as pd
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Dict
+
+from bs4 import BeautifulSoup
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from yad2_cache import HttpCache
+from yad2_card_parsers import PARSER_BACKENDS, extract_card_fields, extract_cards_in_browser, parse_cards_bs4, parse_cards_embedded
+from yad2_scraper_collections import Yad2CollectionsScraper, mark_closed_listings, merge_listings
+from yad2_deep_dive import deep_dive, extract_description, extract_details_json, parse_listing_page
+from yad2_scraper_cars import Yad2Scraper
+from yad2_phash import PHASH_AVAILABLE, PHashIndex, dhash, to_signed
+from yad2_store import ListingStore
+from yad2_utils import NEXT_DATA_RE, PAGE_HEADERS, PolitenessScheduler, Yad2BaseScraper
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Recorded Yad2 pages, see record_fixtures. Missing fixtures are generated from the templates below
+FIXTURES_DIR = "benchmark_fixtures"
+# One line per benchmark run, keyed by git commit, so regressions show up across commits.
+# Timings are only comparable on one machine, so the file is local (git-ignored), set
+# YAD2_BENCHMARK_RESULTS to keep it elsewhere
+RESULTS_FILE = os.environ.get('YAD2_BENCHMARK_RESULTS', "benchmark_results.jsonl")
+# Metrics that moved more than this since the last run on another commit are reported
+CHANGE_THRESHOLD = 0.2
+
+def make_existing_listings(n_rows: int) -> pd.DataFrame:
+    """
+    Build a synthetic listings table shaped like the yad2_collections_*.csv files
+    """
+    ids = pd.Series(range(7_000_000_000_000, 7_000_000_000_000 + n_rows)).astype(str)
+    return pd.DataFrame({
+        'product_id': ids,
+        'title': 'ספה נפתחת לאירוח',
+        'current_price': '900',
+        'location': 'תל אביב',
+        'image_url': 'https://cdn.shopify.com/s/files/example_large.jpg',
+        'product_url': 'https://www.yad2.co.il/market/item/' + ids,
+        'tags': '',
+        'first_seen_date': '2025-05-20',
+        'last_seen_date': '2025-05-20',
+        'closing_date': None,
+    })
+
+def make_scraped_batch(n_rows: int, n_cards: int = 2000, new_ratio: float = 0.1) -> List[Dict]:
+    """
+    Build a batch of parsed cards, mostly known ids plus a share of brand-new ones
+    """
+    n_new = int(n_cards * new_ratio)
+    first_id = 7_000_000_000_000
+    known_ids = [str(first_id + i) for i in range(0, n_rows, max(1, n_rows // (n_cards - n_new)))][:n_cards - n_new]
+    new_ids = [str(first_id + n_rows + i) for i in range(n_new)]
+    return [{
+        'product_id': product_id,
+        'title': 'ספה נפתחת לאירוח',
+        'current_price': '850',
+        'location': 'תל אביב',
+        'image_url': 'https://cdn.shopify.com/s/files/example_large.jpg',
+        'product_url': f'https://www.yad2.co.il/market/item/{product_id}',
+        'tags': '',
+        'first_seen_date': '2025-06-01',
+        'last_seen_date': '2025-06-01',
+        'closing_date': None,
+    } for product_id in known_ids + new_ids]
+
+def benchmark_merge(sizes=(10_000, 100_000, 1_000_000), n_cards: int = 2000) -> Dict[int, float]:
+    """
+    Time merge_listings for a scroll session of n_cards against existing tables of each size
+    """
+    results = {}
+    for n_rows in sizes:
+        df_existing = make_existing_listings(n_rows)
+        batch = make_scraped_batch(n_rows, n_cards)
+        start = time.perf_counter()
+        merged = merge_listings(df_existing, batch)
+        elapsed = time.perf_counter() - start
+        results[n_rows] = elapsed
+        logging.info(f"merge_listings: {n_rows:>9,} existing rows x {n_cards} cards -> "
+                     f"{len(merged):,} rows in {elapsed:.3f}s")
+    return results
+
+CARD_TEMPLATE = '''
+<article class="item-grid_grid__P3tKb">
+  <a class="item-grid_imageContainer__U2drL" href="/market/item/{product_id}">
+    {business_tag}<img class="shopify-image_image__KPxpT" src="https://cdn.shopify.com/s/files/1/0590/7860/6908/files/y2_{product_id}_large.jpg?v=1717908033" alt="">
+  </a>
+  <div class="item-grid_content__Xq1">
+    <h2 class="item-title_title__2tG20">ספה נפתחת לאירוח {product_id}</h2>
+    <p class="item-price_price__HMXoj">₪{price}</p>
+    <p class="item-location_location__E96ST"> בת חפר </p>
+    <div class="item-tags_tags__GdgQO"><p class="tag_tag__Zaq8_">כמו חדש</p><p class="tag_tag__Zaq8_">איסוף עצמי</p></div>
+  </div>
+</article>'''
+
+# Fixtures this run generated from the templates because they were not recorded
+synthetic_fixtures = set()
+
+def load_fixture(name: str, make) -> str:
+    """
+    A recorded page from FIXTURES_DIR (plain or .gz), or make() when it was not recorded
+    """
+    path = os.path.join(FIXTURES_DIR, name)
+    if os.path.exists(f"{path}.gz"):
+        with gzip.open(f"{path}.gz", 'rt', encoding='utf-8') as f:
+            return f.read()
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            return f.read()
+    if name not in synthetic_fixtures:
+        logging.warning(f"{name} is not recorded, using a synthetic page. "
+                        f"Record it with `python yad2_benchmark.py record-fixtures`")
+        synthetic_fixtures.add(name)
+    return make()
+
+def record_fixtures(category_key: str = 'furniture', manufacturer: str = '35'):
+    """
+    Record a collection page as served over HTTP, the scrolled collection feed, one of its item pages
+    and a cars search page from the live site into FIXTURES_DIR, gzipped. Needs Chrome for the feed
+    """
+    from yad2_categories import COLLECTIONS
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+
+    def save(name: str, html: str):
+        with gzip.open(os.path.join(FIXTURES_DIR, f"{name}.gz"), 'wt', encoding='utf-8') as f:
+            f.write(html)
+        logging.info(f"Recorded {name}: {len(html):,} chars")
+
+    scraper = Yad2CollectionsScraper(fetch_mode='selenium')
+    collection_url = f"{COLLECTIONS[category_key]['url']}?sortOption=newest"
+    try:
+        # The plain HTTP response, with the __NEXT_DATA__ the 'auto' and 'http' fetch modes read
+        response = scraper.scheduler.get(scraper.session, collection_url, headers=PAGE_HEADERS, timeout=30)
+        if response.ok and NEXT_DATA_RE.search(response.text):
+            save('collection_next_data.html', response.text)
+        else:
+            logging.warning(f"No embedded data in {collection_url} (status {response.status_code}), not recorded")
+
+        scraper.load_page(collection_url)
+        scraper.wait_for_products()
+        while scraper.scroll_to_load_more(max_scrolls=2):
+            pass
+        html = scraper.driver.page_source
+        save('collection_feed.html', html)
+        item_url = next(card['product_url'] for card in parse_cards_bs4(html) if card.get('product_url'))
+        response = scraper.scheduler.get(scraper.session, item_url, timeout=30)
+        response.raise_for_status()
+        save('item_page.html', response.text)
+    finally:
+        scraper.close()
+
+    cars = Yad2Scraper()
+    html = cars.fetch_search_page(cars.build_search_params(manufacturer=manufacturer))
+    if html:
+        save('cars_feed.html', html)
+
+def make_collection_html(n_cards: int) -> str:
+    """
+    Build a collection feed page with n_cards product cards, every 25th one a new business listing
+    """
+    cards = [CARD_TEMPLATE.format(
+        product_id=7_375_102_279_740 + i,
+        price=200 + (i * 37) % 1800,
+        business_tag='<div class="item-image_newBusinessTag__zI6xW">עסק חדש</div>' if i % 25 == 0 else '',
+    ) for i in range(n_cards)]
+    return ('<html><head><title>יד2</title></head><body><div class="feed_feedContainer__Abipd">'
+            + ''.join(cards) + '</div></body></html>')
+
+def benchmark_card_parsers(n_cards: int = 2000) -> Dict[str, float]:
+    """
+    Check every parser backend against the per-card BeautifulSoup path of parse_product_card and time cards/sec
+    """
+    html = load_fixture('collection_feed.html', lambda: make_collection_html(n_cards))
+    n_cards = len(parse_cards_bs4(html))
+
+    # Reference: the original per-card BeautifulSoup path
+    start = time.perf_counter()
+    soup = BeautifulSoup(html, 'html.parser')
+    reference = [fields for fields in map(extract_card_fields, soup.find_all('article', class_='item-grid_grid__P3tKb')) if fields]
+    results = {'reference': n_cards / (time.perf_counter() - start)}
+    logging.info(f"parse_product_card (bs4): {results['reference']:,.0f} cards/s")
+
+    for name, parse_cards in PARSER_BACKENDS.items():
+        start = time.perf_counter()
+        cards = parse_cards(html)
+        results[name] = n_cards / (time.perf_counter() - start)
+        if cards != reference:
+            raise AssertionError(f"Parser backend {name} does not match parse_product_card")
+        logging.info(f"{name} backend: {results[name]:,.0f} cards/s "
+                     f"({results[name] / results['reference']:.1f}x, parity ok)")
+    return results
+
+def benchmark_browser_extraction(n_cards: int = 2000) -> Dict[str, float]:
+    """
+    Check extract_cards_in_browser against the BeautifulSoup reference in headless Chrome,
+    and compare page_source transfer + parse with the in-browser JSON payload.
+    Skipped when Chrome is not available
+    """
+    try:
+        options = Options()
+        options.add_argument('--headless')
+        options.add_argument('--no-sandbox')
+        driver = webdriver.Chrome(options=options)
+    except Exception as e:
+        logging.warning(f"Skipping in-browser extraction benchmark, Chrome unavailable: {e}")
+        return {}
+
+    try:
+        with tempfile.NamedTemporaryFile('w', suffix='.html', encoding='utf-8', delete=False) as f:
+            f.write(make_collection_html(n_cards))
+        driver.get(f"file://{f.name}")
+
+        start = time.perf_counter()
+        page_source = driver.page_source
+        reference = parse_cards_bs4(page_source)
+        results = {'page_source': time.perf_counter() - start}
+
+        start = time.perf_counter()
+        cards = extract_cards_in_browser(driver)
+        results['js'] = time.perf_counter() - start
+        if cards != reference:
+            raise AssertionError("extract_cards_in_browser does not match parse_product_card")
+
+        payload_size = len(json.dumps(cards, ensure_ascii=False))
+        logging.info(f"page_source + bs4: {len(page_source):,} chars in {results['page_source']:.3f}s, "
+                     f"in-browser JSON: ~{payload_size:,} chars in {results['js']:.3f}s (parity ok)")
+        return results
+    finally:
+        driver.quit()
+        os.remove(f.name)
+
+def benchmark_chrome_profiles(n_pages: int = 6, recycle_after_pages: int = 2, n_cards: int = 2000) -> Dict:
+    """
+    Load a collection page n_pages times with a persistent profile, recycling the driver every
+    recycle_after_pages pages, and report cold vs warm Chrome startup time and peak browser memory.
+    Skipped when Chrome is not available
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        page_path = os.path.join(tmp_dir, 'collection.html')
+        with open(page_path, 'w', encoding='utf-8') as f:
+            f.write(make_collection_html(n_cards))
+        scraper = Yad2CollectionsScraper(fetch_mode='selenium', profile_dir=os.path.join(tmp_dir, 'profile'),
+                                         recycle_after_pages=recycle_after_pages)
+        scraper.scheduler = PolitenessScheduler(rate=1e9, state_path=None)
+        try:
+            for _ in range(n_pages):
+                scraper.load_page(f"file://{page_path}")
+                scraper.recycle_driver_if_needed()
+        except Exception as e:
+            logging.warning(f"Skipping Chrome profile benchmark, Chrome unavailable: {e}")
+            return {}
+        finally:
+            scraper.close()
+    summary = scraper.driver_summary()
+    if len(scraper.driver_metrics) != -(-n_pages // recycle_after_pages) or summary['cold_starts'] != 1:
+        raise AssertionError(f"Expected one cold start and a new driver every {recycle_after_pages} pages, "
+                             f"got {scraper.driver_metrics}")
+    logging.info(f"Chrome profiles: cold start {summary['cold_start_time']:.2f}s, "
+                 f"{summary['warm_starts']} warm starts {summary['warm_start_time']:.2f}s on average, "
+                 f"peak RSS {summary['peak_rss_mb']:.0f} MB")
+    return summary
+
+def make_next_data_page(n_cards: int, first_id: int = 7_375_102_279_740) -> str:
+    """
+    Build a collection page carrying its listings in embedded __NEXT_DATA__ JSON
+    """
+    items = [{
+        'id': first_id + i,
+        'title': f'ספה נפתחת לאירוח {first_id + i}',
+        'price': 200 + (i * 37) % 1800,
+        'city': 'בת חפר',
+        'images': [{'src': f'https://cdn.shopify.com/s/files/1/0590/7860/6908/files/y2_{first_id + i}_large.jpg'}],
+        'url': f'/market/item/{first_id + i}',
+        'tags': ['כמו חדש', 'איסוף עצמי'],
+    } for i in range(n_cards)]
+    # The feed as a dehydrated infinite query, next to objects that look like listings but are not
+    next_data = {'props': {'pageProps': {
+        'seller': {'id': 1, 'title': 'חנות', 'price': 0},
+        'categories': [{'id': 2, 'title': 'ריהוט', 'priceRange': [0, 1000]}],
+        'dehydratedState': {'queries': [
+            {'queryKey': ['promoted'], 'state': {'data': {'items': [{'id': 3, 'title': 'קידום', 'price': 1}]}}},
+            {'queryKey': ['feed', {'sortOption': 'newest'}],
+             'state': {'data': {'pages': [{'items': items, 'total': n_cards}], 'pageParams': [1]}}},
+        ]},
+    }}}
+    return ('<html><head><script id="__NEXT_DATA__" type="application/json">'
+            + json.dumps(next_data, ensure_ascii=False) + '</script></head><body></body></html>')
+
+@contextmanager
+def serve_fixtures(routes: Dict[str, bytes], latency: float = 0.0):
+    """
+    Serve recorded pages from a local HTTP stub server, yields its base URL.
+    routes maps a path (without query string) to the response body, answered with an ETag,
+    or to a function of the full request path that returns the body
+    """
+    class FixtureHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            body = routes.get(self.path.split('?')[0])
+            if callable(body):
+                body = body(self.path)
+            etag = f'"{hashlib.sha1(body).hexdigest()}"' if body is not None else None
+            if etag and self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+            self.send_response(200 if body is not None else 404)
+            if etag:
+                self.send_header('ETag', etag)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body or b'')))
+            self.end_headers()
+            self.wfile.write(body or b'')
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def benchmark_http_fetch(n_pages: int = 20, n_cards: int = 200) -> float:
+    """
+    Time fetch_embedded_data + parse_cards_embedded against a local stub server, in pages/sec
+    """
+    scraper = Yad2BaseScraper()
+    scraper.scheduler = PolitenessScheduler(rate=1e9, state_path=None)
+    routes = {f'/market/collections/page-{i}': make_next_data_page(n_cards, 7_375_102_279_740 + i * n_cards).encode()
+              for i in range(n_pages)}
+    with serve_fixtures(routes) as base_url:
+        start = time.perf_counter()
+        n_listings = 0
+        for path in routes:
+            data = scraper.fetch_embedded_data(f"{base_url}{path}", {'sortOption': 'newest'})
+            n_listings += len(parse_cards_embedded(data))
+        elapsed = time.perf_counter() - start
+    if n_listings != n_pages * n_cards:
+        raise AssertionError(f"Expected {n_pages * n_cards} listings from embedded data, got {n_listings}")
+    logging.info(f"HTTP embedded data fetch: {n_pages / elapsed:,.1f} pages/s, {n_listings / elapsed:,.0f} listings/s")
+    return n_pages / elapsed
+
+def benchmark_price_history(n_listings: int = 200_000, changes_per_listing: int = 5) -> Dict[str, float]:
+    """
+    Time price trajectory and recent drops queries on a store with millions of price observations
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = ListingStore(os.path.join(tmp_dir, 'bench.db'))
+        first_id = 7_000_000_000_000
+        day = pd.Timestamp('2025-01-01')
+        with store.conn:
+            store.conn.executemany(
+                'INSERT INTO price_history VALUES (?, ?, ?)',
+                ((str(first_id + i), (day + pd.Timedelta(days=3 * c + i % 3)).strftime('%Y-%m-%d'), 1000 - 50 * c + (i % 7) * 10)
+                 for i in range(n_listings) for c in range(changes_per_listing)))
+        n_observations = n_listings * changes_per_listing
+        as_of = (day + pd.Timedelta(days=3 * changes_per_listing)).strftime('%Y-%m-%d')
+
+        start = time.perf_counter()
+        for i in range(0, n_listings, n_listings // 100):
+            store.price_trajectory(str(first_id + i))
+        results = {'trajectory': (time.perf_counter() - start) / 100}
+
+        start = time.perf_counter()
+        drops = store.price_drops(days=3, as_of=as_of)
+        results['drops'] = time.perf_counter() - start
+        store.close()
+
+    logging.info(f"price_history: {n_observations:,} observations, trajectory in {results['trajectory'] * 1000:.2f}ms, "
+                 f"{len(drops):,} drops in the last 3 days in {results['drops']:.2f}s")
+    return results
+
+def benchmark_closed_listings(n_rows: int = 1_000_000, n_active: int = 50_000, n_seen: int = 45_000) -> Dict[str, float]:
+    """
+    Time closed listing detection on n_rows tracked listings, of which n_active are still open
+    and n_seen of those were seen in this crawl, for the DataFrame and SQLite paths
+    """
+    df_existing = make_existing_listings(n_rows)
+    df_existing.loc[n_active:, 'closing_date'] = '2025-05-25'
+    seen_ids = set(df_existing['product_id'].iloc[:n_seen])
+
+    start = time.perf_counter()
+    _, n_closed = mark_closed_listings(df_existing.copy(), seen_ids, '2025-06-01')
+    results = {'dataframe': time.perf_counter() - start}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = ListingStore(os.path.join(tmp_dir, 'bench.db'))
+        with store.conn:
+            store.conn.executemany('INSERT INTO listings (product_id, first_seen_date, closing_date) VALUES (?, ?, ?)',
+                                   df_existing[['product_id', 'first_seen_date', 'closing_date']].itertuples(index=False, name=None))
+        start = time.perf_counter()
+        n_closed_store = store.mark_closed(seen_ids, '2025-06-01')
+        results['sqlite'] = time.perf_counter() - start
+        store.close()
+
+    if n_closed != n_closed_store:
+        raise AssertionError(f"DataFrame closed {n_closed} listings, SQLite closed {n_closed_store}")
+    logging.info(f"Closed listing detection on {n_rows:,} listings ({n_active:,} active): {n_closed:,} closed, "
+                 f"DataFrame {results['dataframe']:.3f}s, SQLite {results['sqlite']:.3f}s")
+    return results
+
+ITEM_PAGE_TEMPLATE = '''<html><head><title>יד2 מרקט</title>{padding}</head><body>
+<div class="product-description"><span class="boa-product-description-details">
+ספה נפתחת לאירוח במצב מצוין {product_id}, איסוף מבת חפר.
+</span></div>
+<div class="boa-attributes-container"><ul>
+<li class="product-spec__item"><div class="product-spec__label">מצב המוצר</div><div class="product-spec__value">כמו חדש</div></li>
+<li class="product-spec__item"><div class="product-spec__label">צבע</div><div class="product-spec__value">חול</div></li>
+<li class="product-spec__item"><div class="product-spec__label">חומר</div><div class="product-spec__value">בד</div></li>
+</ul></div>
+</body></html>'''
+
+def make_item_page(product_id: int, padding_kb: int = 200) -> str:
+    """
+    Build a deep dive listing page, padded with inline script like the real pages
+    """
+    padding = '<script>' + 'var x=1;' * (padding_kb * 128) + '</script>'
+    return ITEM_PAGE_TEMPLATE.format(product_id=product_id, padding=padding)
+
+def benchmark_deep_dive(n_listings: int = 200, latency: float = 0.2, fetch_workers: int = 16,
+                        parse_workers: int = None) -> float:
+    """
+    Run the deep dive against a local stub server with injected latency, in listings/sec
+    """
+    first_id = 7_375_102_279_740
+    routes = {f'/market/item/{first_id + i}': make_item_page(first_id + i, padding_kb=20).encode()
+              for i in range(n_listings)}
+    with tempfile.TemporaryDirectory() as tmp_dir, serve_fixtures(routes, latency=latency) as base_url:
+        input_csv = os.path.join(tmp_dir, 'input.csv')
+        output_csv = os.path.join(tmp_dir, 'output.csv')
+        pd.DataFrame({'product_id': [str(first_id + i) for i in range(n_listings)],
+                      'product_url': [f"{base_url}{path}" for path in routes]}).to_csv(input_csv, index=False)
+        start = time.perf_counter()
+        deep_dive(input_csv, output_csv, delay=0, fetch_workers=fetch_workers, parse_workers=parse_workers,
+                  use_cache=False, scheduler=PolitenessScheduler(rate=1e9, state_path=None))
+        elapsed = time.perf_counter() - start
+        output = pd.read_csv(output_csv, dtype=str)
+    if len(output) != n_listings or not output['description'].str.contains('ספה').all():
+        raise AssertionError("Deep dive output does not match the served listing pages")
+    logging.info(f"deep_dive: {n_listings} listings at {latency * 1000:.0f}ms latency, "
+                 f"{fetch_workers} fetch workers, {os.cpu_count() if parse_workers is None else parse_workers} parse workers: "
+                 f"{n_listings / elapsed:,.1f} listings/s")
+    return n_listings / elapsed
+
+def benchmark_http_cache(n_pages: int = 100, latency: float = 0.05) -> Dict[str, float]:
+    """
+    Fetch listing pages through a fresh HttpCache cold, warm and stale (revalidated), in pages/sec
+    """
+    first_id = 7_375_102_279_740
+    routes = {f'/market/item/{first_id + i}': make_item_page(first_id + i, padding_kb=20).encode()
+              for i in range(n_pages)}
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir, serve_fixtures(routes, latency=latency) as base_url:
+        scraper = Yad2BaseScraper()
+        cache = HttpCache(os.path.join(tmp_dir, 'http_cache'))
+        for run in ['cold', 'warm', 'revalidated']:
+            if run == 'revalidated':
+                cache.ttls = []  # Everything is stale
+            start = time.perf_counter()
+            for path, body in routes.items():
+                if cache.get(scraper.session, f"{base_url}{path}").content != body:
+                    raise AssertionError(f"HttpCache returned the wrong body for {path}")
+            results[run] = n_pages / (time.perf_counter() - start)
+            logging.info(f"HttpCache {run}: {results[run]:,.1f} pages/s")
+        if cache.stats != {'hits': n_pages, 'revalidated': n_pages, 'misses': n_pages,
+                           'bytes_saved': 2 * sum(map(len, routes.values())),
+                           'bytes_downloaded': sum(map(len, routes.values()))}:
+            raise AssertionError(f"Unexpected HttpCache stats {cache.stats}")
+        cache.log_stats()
+        cache.close()
+    return results
+
+def benchmark_phash_index(n_images: int = 300_000, n_queries: int = 1_000, max_flips: int = 6) -> float:
+    """
+    Load a perceptual-hash index of random hashes and look up near-duplicates, in ms per lookup.
+    Checks the multi-index lookup against a brute force scan
+    """
+    rng = random.Random(0)
+    hashes = [rng.getrandbits(64) for _ in range(n_images)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'phash.db')
+        PHashIndex(db_path).close()
+        conn = sqlite3.connect(db_path)
+        with conn:
+            conn.executemany('INSERT INTO listing_hashes VALUES (?, ?, NULL, NULL)',
+                             ((str(i), to_signed(h)) for i, h in enumerate(hashes)))
+        conn.close()
+
+        start = time.perf_counter()
+        index = PHashIndex(db_path, max_distance=max_flips)
+        load_time = time.perf_counter() - start
+
+        # Reposts of indexed images with up to max_flips bits changed
+        targets = [rng.randrange(n_images) for _ in range(n_queries)]
+        queries = []
+        for target in targets:
+            phash = hashes[target]
+            for bit in rng.sample(range(64), rng.randint(0, max_flips)):
+                phash ^= 1 << bit
+            queries.append(phash)
+        start = time.perf_counter()
+        results = [index.query(phash) for phash in queries]
+        lookup_ms = (time.perf_counter() - start) * 1000 / n_queries
+        if not all(str(target) in [match[0] for match in matches] for target, matches in zip(targets, results)):
+            raise AssertionError("PHashIndex missed a near-duplicate")
+        for phash, matches in list(zip(queries, results))[:20]:
+            expected = sorted(str(i) for i, h in enumerate(hashes) if (h ^ phash).bit_count() <= max_flips)
+            if sorted(match[0] for match in matches) != expected:
+                raise AssertionError("PHashIndex does not match a brute force scan")
+
+        start = time.perf_counter()
+        flagged = sum(index.add(f"new-{i}", phash) is not None for i, phash in enumerate(queries[:200]))
+        add_ms = (time.perf_counter() - start) * 1000 / 200
+        index.close()
+    if flagged != 200:
+        raise AssertionError(f"PHashIndex flagged {flagged} of 200 reposts")
+    logging.info(f"PHashIndex at {n_images:,} images: loaded in {load_time:.2f}s, "
+                 f"{lookup_ms:.3f} ms per lookup, {add_ms:.3f} ms per add")
+
+    if PHASH_AVAILABLE:
+        # A resized, recompressed copy of an image should stay within the duplicate distance
+        from PIL import Image
+        image = Image.radial_gradient('L').convert('RGB').resize((400, 300))
+        original, copy = BytesIO(), BytesIO()
+        image.save(original, 'PNG')
+        image.resize((240, 180)).save(copy, 'JPEG', quality=60)
+        distance = (dhash(original.getvalue()) ^ dhash(copy.getvalue())).bit_count()
+        if distance > max_flips:
+            raise AssertionError(f"dhash of a recompressed copy is {distance} bits away")
+        logging.info(f"dhash: recompressed copy is {distance} bits away")
+    return lookup_ms
+
+MOCK_CAPTION = "7\n9\n10\nugly repair on the handlebar, torn saddle\n5\n3500\n1500\n800"
+
+@contextmanager
+def serve_mock_openai(latency: float = 0.0, rate_limit_every: int = 0, caption: str = MOCK_CAPTION):
+    """
+    Serve a minimal OpenAI-compatible chat completions API, yields its base URL and request counts.
+    Every `rate_limit_every`-th request is answered with a 429 and Retry-After: 0
+    """
+    stats = {'requests': 0, 'rate_limited': 0}
+    lock = threading.Lock()
+
+    class MockOpenAIHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            with lock:
+                stats['requests'] += 1
+                rate_limited = rate_limit_every and stats['requests'] % rate_limit_every == 0
+                stats['rate_limited'] += bool(rate_limited)
+            time.sleep(latency)
+            if rate_limited:
+                status, headers = 429, {'Retry-After': '0'}
+                body = {'error': {'message': 'Rate limit reached', 'type': 'requests', 'code': 'rate_limit_exceeded'}}
+            else:
+                status, headers = 200, {}
+                body = {
+                    'id': f"chatcmpl-mock-{stats['requests']}", 'object': 'chat.completion', 'created': int(time.time()),
+                    'model': request.get('model', ''),
+                    'choices': [{'index': 0, 'finish_reason': 'stop',
+                                 'message': {'role': 'assistant', 'content': caption}}],
+                    'usage': {'prompt_tokens': 1000, 'completion_tokens': 30, 'total_tokens': 1030},
+                }
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockOpenAIHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}/v1", stats
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def benchmark_captioning(n_rows: int = 200, latency: float = 0.2, max_workers: int = 16) -> Dict[str, float]:
+    """
+    Caption a deep dive CSV against the mock OpenAI server with 1 and max_workers workers, in rows/sec,
+    then rerun it to check every row comes from the caption cache, and once more with an edited prompt.
+    Skipped when the openai package is not installed
+    """
+    try:
+        import yad2_image_caption_gpt as captioning
+    except ImportError as e:
+        logging.warning(f"Skipping captioning benchmark, openai unavailable: {e}")
+        return {}
+
+    results = {}
+    cwd = os.getcwd()
+    os.environ.setdefault('OPENAI_API_KEY', 'mock-key')
+    with tempfile.TemporaryDirectory() as tmp_dir, serve_mock_openai(latency, rate_limit_every=25) as (base_url, stats):
+        os.chdir(tmp_dir)
+        try:
+            def caption(workers: int, rows: int, prompt_template: str = '{description}\n{price}') -> float:
+                csv_path = os.path.join(tmp_dir, f'deep_dive_{rows}.csv')
+                pd.DataFrame({
+                    'product_id': [str(7_375_102_279_740 + i) for i in range(rows)],
+                    'image_url': [f"https://cdn.shopify.com/s/files/{i}.jpg" for i in range(rows)],
+                    'description': ['ספה תלת מושבית במצב מצוין'] * rows,
+                    'current_price': ['1,200'] * rows,
+                }).to_csv(csv_path, index=False)
+                start = time.perf_counter()
+                captioning.main(csv_path, os.path.join(tmp_dir, 'images'), max_workers=workers, base_url=base_url,
+                                prompt_template=prompt_template, cache_path=f'caption_cache_{rows}.db')
+                rows_per_sec = rows / (time.perf_counter() - start)
+                output = pd.read_csv(f"captioned_deep_dive_{rows}.csv", dtype=str)
+                if len(output) != rows or not (output['offer_price'] == '800').all():
+                    raise AssertionError("Captioned CSV does not match the mock captions")
+                return rows_per_sec
+
+            for workers, rows in [(1, max(n_rows // 10, 1)), (max_workers, n_rows)]:
+                results[str(workers)] = caption(workers, rows)
+                logging.info(f"captioning: {workers} workers at {latency * 1000:.0f}ms latency: "
+                             f"{results[str(workers)]:,.1f} rows/s")
+
+            # Unchanged rows are served from the cache, an edited prompt misses it
+            n_requests = stats['requests']
+            results['cached'] = caption(max_workers, n_rows)
+            if stats['requests'] != n_requests:
+                raise AssertionError(f"Rerun made {stats['requests'] - n_requests} API requests, expected none")
+            logging.info(f"captioning: cached rerun {results['cached']:,.1f} rows/s")
+            caption(max_workers, n_rows, prompt_template='{description}\n{price} NIS')
+            if stats['requests'] - n_requests < n_rows:
+                raise AssertionError("An edited prompt was served from the caption cache")
+        finally:
+            os.chdir(cwd)
+    logging.info(f"captioning: {stats['rate_limited']} rate limited responses retried, "
+                 f"{results[str(max_workers)] / results['1']:.1f}x with {max_workers} workers")
+    return results
+
+CARS_ITEM_TEMPLATE = '''<div class="feed-item-base_feedItemBox__5WVY1">
+  <a class="feed-item-base_itemLink__wBfEL" href="https://www.yad2.co.il/vehicles/item/{item_id}?opened-from=feed&amp;component-type=main_feed">
+    <img class="single-image_image__Iv6T9" srcset="https://img.yad2.co.il/Pic/{item_id}-s.jpeg 300w, https://img.yad2.co.il/Pic/{item_id}-l.jpeg 800w">
+  </a>
+  <span class="feed-item-info_heading__k5pVC">טויוטה קורולה</span>
+  <span class="feed-item-info_marketingText__eNE4R">SUN הייבריד</span>
+  <span class="feed-item-info_yearAndHandBox___JLbc">2019 • יד 2</span>
+  <span class="price_price__xQt90">89,000 ₪</span>
+</div>'''
+
+def make_cars_page(page: int, n_items: int = 40, n_pages: int = 20) -> str:
+    """
+    Build a cars search results page, empty after the last page
+    """
+    items = [CARS_ITEM_TEMPLATE.format(item_id=f"{page}x{i}") for i in range(n_items)] if page <= n_pages else []
+    return f"<html><body><main>{''.join(items)}</main></body></html>"
+
+def benchmark_cars_crawl(n_pages: int = 20, latency: float = 0.2, rate: float = 20.0,
+                         prefetch: int = 3) -> Dict[int, float]:
+    """
+    Crawl the cars search pages from the stub server without and with prefetching, in pages/sec
+    """
+    def search_page(path: str) -> bytes:
+        page = int(re.search(r'page=(\d+)', path).group(1))
+        return make_cars_page(page, n_pages=n_pages).encode()
+
+    results = {}
+    routes = {'/': b'<html></html>', '/vehicles/cars': search_page}
+    with serve_fixtures(routes, latency=latency) as base_url:
+        for window in [1, prefetch]:
+            scraper = Yad2Scraper(scheduler=PolitenessScheduler(rate=rate, state_path=None))
+            scraper.home_url = f"{base_url}/"
+            scraper.search_url = f"{base_url}/vehicles/cars"
+            start = time.perf_counter()
+            pages = list(scraper.crawl(manufacturer='35', prefetch=window))
+            results[window] = len(pages) / (time.perf_counter() - start)
+            if len(pages) != n_pages or any(len(listings) != 40 for _, listings in pages):
+                raise AssertionError("Cars crawl did not stop on the first empty page")
+            if pages[0][1][0]['link'] != "https://www.yad2.co.il/vehicles/item/1x0":
+                raise AssertionError(f"Unexpected cars listing {pages[0][1][0]}")
+            logging.info(f"cars crawl: prefetch {window} at {latency * 1000:.0f}ms latency: "
+                         f"{results[window]:,.1f} pages/s")
+    return results
+
+def benchmark_cars_checkpoint(n_pages: int = 200, n_items: int = 40) -> Dict[str, float]:
+    """
+    Checkpoint a cars crawl of n_pages pages with the old rewrite-everything save_to_csv
+    and the streaming writer, in seconds, and check both write the same CSV
+    """
+    scraper = Yad2Scraper()
+    pages = [(page, scraper.parse_search_page(make_cars_page(page, n_items=n_items, n_pages=n_pages)))
+             for page in range(1, n_pages + 1)]
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        rewrite_csv = os.path.join(tmp_dir, 'rewrite.csv')
+        stream_csv = os.path.join(tmp_dir, 'stream.csv')
+        logger = logging.getLogger()
+        level = logger.level
+        logger.setLevel(logging.WARNING)
+        try:
+            start = time.perf_counter()
+            all_listings = []
+            for _, listings in pages:
+                all_listings.extend(listings)
+                scraper.save_to_csv(all_listings, rewrite_csv)
+            results['rewrite'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            scraper.stream_to_csv(iter(pages), stream_csv)
+            results['stream'] = time.perf_counter() - start
+        finally:
+            logger.setLevel(level)
+        if not pd.read_csv(rewrite_csv, dtype=str).equals(pd.read_csv(stream_csv, dtype=str)):
+            raise AssertionError("Streaming checkpoint does not match save_to_csv")
+    logging.info(f"cars checkpoint, {n_pages} pages: rewrite every page {results['rewrite']:.2f}s, "
+                 f"stream {results['stream']:.2f}s ({results['rewrite'] / results['stream']:.1f}x)")
+    return results
+
+def benchmark_parse_scaling(n_pages: int = 100, padding_kb: int = 200) -> Dict[int, float]:
+    """
+    Parse listing pages with process pools of 1..cpu_count workers, in pages/sec
+    """
+    pages = [make_item_page(7_375_102_279_740 + i, padding_kb=padding_kb) for i in range(n_pages)]
+    worker_counts = sorted({1, 2, 4, 8, os.cpu_count() or 1})
+    results = {}
+    for n_workers in [n for n in worker_counts if n <= (os.cpu_count() or 1)]:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            list(pool.map(parse_listing_page, pages[:n_workers]))  # Warm up the workers
+            start = time.perf_counter()
+            parsed = list(pool.map(parse_listing_page, pages, chunksize=4))
+            results[n_workers] = n_pages / (time.perf_counter() - start)
+        if not all(fields['description'] for fields in parsed):
+            raise AssertionError("parse_listing_page missed a description")
+        logging.info(f"parse_listing_page: {n_workers} processes, {results[n_workers]:,.1f} pages/s "
+                     f"({results[n_workers] / results[1]:.2f}x)")
+    return results
+
+def benchmark_extract_details_json(n_iterations: int = 200, padding_kb: int = 200) -> Dict[str, float]:
+    """
+    Time extract_details_json and extract_description on a parsed item page, and the full
+    parse_listing_page including the HTML parse, in pages/sec
+    """
+    html = load_fixture('item_page.html', lambda: make_item_page(7_375_102_279_740, padding_kb=padding_kb))
+    soup = BeautifulSoup(html, 'html.parser')
+    if not extract_details_json(soup):
+        raise AssertionError("extract_details_json found no details in the item page fixture")
+
+    results = {}
+    start = time.perf_counter()
+    for _ in range(n_iterations):
+        extract_details_json(soup)
+        extract_description(soup)
+    results['extract'] = n_iterations / (time.perf_counter() - start)
+
+    n_pages = max(1, n_iterations // 10)
+    start = time.perf_counter()
+    for _ in range(n_pages):
+        parse_listing_page(html)
+    results['parse_listing_page'] = n_pages / (time.perf_counter() - start)
+    logging.info(f"extract_details_json + extract_description: {results['extract']:,.0f} pages/s, "
+                 f"parse_listing_page ({len(html) // 1024} KB): {results['parse_listing_page']:,.1f} pages/s")
+    return results
+
+def benchmark_cars_search_parsing(n_iterations: int = 50) -> Dict[str, float]:
+    """
+    Time the search_listings parsing of a cars search page, in pages/sec and listings/sec
+    """
+    html = load_fixture('cars_feed.html', lambda: make_cars_page(1))
+    scraper = Yad2Scraper(scheduler=PolitenessScheduler(state_path=None))
+    n_listings = len(scraper.parse_search_page(html))
+    if not n_listings:
+        raise AssertionError("parse_search_page found no listings in the cars fixture")
+    start = time.perf_counter()
+    for _ in range(n_iterations):
+        scraper.parse_search_page(html)
+    elapsed = time.perf_counter() - start
+    results = {'pages_per_sec': n_iterations / elapsed, 'listings_per_sec': n_iterations * n_listings / elapsed}
+    logging.info(f"cars parse_search_page: {results['pages_per_sec']:,.1f} pages/s, "
+                 f"{results['listings_per_sec']:,.0f} listings/s")
+    return results
+
+def load_feed_cards(n_cards: int) -> List[Dict]:
+    """
+    The parsed cards of the collection feed fixture
+    """
+    return parse_cards_bs4(load_fixture('collection_feed.html', lambda: make_collection_html(n_cards)))
+
+def benchmark_search_collection_merge(sizes=(10_000, 100_000, 1_000_000), n_cards: int = 2000) -> Dict[int, float]:
+    """
+    Time the search_collection merge loop, build_listing for every parsed card of the feed
+    fixture and merge_batch into existing listings of each size, in seconds
+    """
+    cards = load_feed_cards(n_cards)
+    scraper = Yad2CollectionsScraper()
+    # Like a daily crawl, 90% of the cards are already known
+    known = pd.DataFrame([{**scraper.build_listing(card), 'first_seen_date': '2025-05-20', 'last_seen_date': '2025-05-20'}
+                          for card in cards[:int(len(cards) * 0.9)]]).drop_duplicates('product_id')
+    n_new = len({card['product_id'] for card in cards} - set(known['product_id']))
+    results = {}
+    for n_rows in sizes:
+        scraper.df_existing = pd.concat([make_existing_listings(n_rows - len(known)), known], ignore_index=True)
+        start = time.perf_counter()
+        listings = [listing for listing in map(scraper.build_listing, cards) if listing]
+        scraper.merge_batch(listings)
+        results[n_rows] = time.perf_counter() - start
+        if len(scraper.df_existing) != n_rows + n_new:
+            raise AssertionError("merge_batch lost listings")
+        logging.info(f"search_collection merge loop: {len(cards)} cards into {n_rows:>9,} rows "
+                     f"in {results[n_rows]:.3f}s")
+    scraper.close()
+    return results
+
+def benchmark_save_to_csv(sizes=(10_000, 100_000, 1_000_000), n_cards: int = 2000) -> Dict[int, float]:
+    """
+    Time the collections save_to_csv of merged listings tables of each size, in seconds
+    """
+    scraper = Yad2CollectionsScraper()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_rows in sizes:
+            output_file = os.path.join(tmp_dir, f'yad2_collections_{n_rows}.csv')
+            batch = make_scraped_batch(n_rows, n_cards)
+            scraper.df_existing = merge_listings(make_existing_listings(n_rows), batch)
+            start = time.perf_counter()
+            scraper.save_to_csv(batch, output_file)
+            results[n_rows] = time.perf_counter() - start
+            if not os.path.exists(output_file):
+                raise AssertionError(f"save_to_csv did not write {output_file}")
+            logging.info(f"save_to_csv: {len(scraper.df_existing):>9,} rows in {results[n_rows]:.3f}s "
+                         f"({os.path.getsize(output_file) / 1024 / 1024:.0f} MB)")
+    scraper.close()
+    return results
+
+def reserve_slots(state_path: str, url: str, rate: float, n_requests: int) -> List[float]:
+    """
+    Wait for n_requests slots of a scheduler sharing state_path, returns the send times
+    """
+    scheduler = PolitenessScheduler(rate=rate, host_rates={}, state_path=state_path)
+    sent = []
+    for _ in range(n_requests):
+        scheduler.wait(url)
+        sent.append(time.time())
+    return sent
+
+def simulate_throttling_host(scheduler: PolitenessScheduler, url: str, server_rate: int,
+                             duration: float) -> Dict[str, float]:
+    """
+    Send through the scheduler for `duration` seconds to a simulated host that answers 429
+    once it saw server_rate requests in the last second
+    """
+    accepted = deque()
+    ok = throttled = 0
+    end = time.time() + duration
+    while time.time() < end:
+        scheduler.wait(url)
+        now = time.time()
+        while accepted and accepted[0] < now - 1:
+            accepted.popleft()
+        if len(accepted) >= server_rate:
+            throttled += 1
+            scheduler.record(url, status=429)
+        else:
+            accepted.append(now)
+            ok += 1
+            scheduler.record(url, status=200, latency=0.05)
+    return {'ok_per_sec': ok / duration, 'throttled_share': throttled / max(ok + throttled, 1)}
+
+def benchmark_politeness_scheduler(rate: float = 40.0, server_rate: int = 20, duration: float = 3.0,
+                                   n_processes: int = 2, n_requests: int = 40) -> Dict[str, Dict]:
+    """
+    Check that scheduler processes sharing a state file share one budget per host, and compare
+    a fixed rate against the adaptive rate on a host that throttles at half the configured rate
+    """
+    url = 'https://www.yad2.co.il/market/item/1'
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        state_path = os.path.join(tmp_dir, 'politeness.json')
+        with ProcessPoolExecutor(max_workers=n_processes) as pool:
+            futures = [pool.submit(reserve_slots, state_path, url, rate, n_requests) for _ in range(n_processes)]
+            sent = sorted(t for future in futures for t in future.result())
+        achieved = (len(sent) - 1) / (sent[-1] - sent[0])
+        if achieved > rate * 1.1:
+            raise AssertionError(f"{n_processes} processes sent {achieved:.1f} requests/s, above the shared {rate}/s")
+        results['shared'] = {'processes': n_processes, 'requests_per_sec': achieved}
+        logging.info(f"politeness: {n_processes} processes sharing one host budget of {rate:.0f}/s "
+                     f"sent {achieved:.1f} requests/s")
+
+    for name, scheduler in [
+        ('fixed', PolitenessScheduler(rate=rate, host_rates={}, decrease=1.0, increase=0.0, cooldown=0.0, state_path=None)),
+        ('adaptive', PolitenessScheduler(rate=rate, host_rates={}, cooldown=0.5, state_path=None)),
+    ]:
+        results[name] = simulate_throttling_host(scheduler, url, server_rate, duration)
+        logging.info(f"politeness: {name} rate against a host throttling at {server_rate}/s: "
+                     f"{results[name]['ok_per_sec']:.1f} accepted/s, "
+                     f"{results[name]['throttled_share']:.0%} of requests throttled")
+    if results['adaptive']['throttled_share'] >= results['fixed']['throttled_share']:
+        raise AssertionError("The adaptive rate did not reduce throttled requests")
+    return results
+
+BENCHMARKS = {
+    'merge': benchmark_merge,
+    'card_parsers': benchmark_card_parsers,
+    'browser_extraction': benchmark_browser_extraction,
+    'chrome_profiles': benchmark_chrome_profiles,
+    'http_fetch': benchmark_http_fetch,
+    'price_history': benchmark_price_history,
+    'closed_listings': benchmark_closed_listings,
+    'extract_details_json': benchmark_extract_details_json,
+    'search_collection_merge': benchmark_search_collection_merge,
+    'save_to_csv': benchmark_save_to_csv,
+    'cars_search_parsing': benchmark_cars_search_parsing,
+    'deep_dive': benchmark_deep_dive,
+    'http_cache': benchmark_http_cache,
+    'phash_index': benchmark_phash_index,
+    'captioning': benchmark_captioning,
+    'cars_crawl': benchmark_cars_crawl,
+    'cars_checkpoint': benchmark_cars_checkpoint,
+    'politeness_scheduler': benchmark_politeness_scheduler,
+    'parse_scaling': benchmark_parse_scaling,
+}
+
+def git_commit() -> str:
+    """
+    The current commit, marked -dirty when the tree has uncommitted changes
+    """
+    repo = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True, cwd=repo).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True,
+                               text=True, check=True, cwd=repo).stdout.strip()
+        return f"{commit}-dirty" if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def flatten_metrics(result, prefix: str = '') -> Dict[str, float]:
+    """
+    Flatten a benchmark's (nested) result dict into metric name -> value
+    """
+    if isinstance(result, dict):
+        metrics = {}
+        for key, value in result.items():
+            metrics.update(flatten_metrics(value, f"{prefix}.{key}" if prefix else str(key)))
+        return metrics
+    if isinstance(result, (int, float)) and not isinstance(result, bool):
+        return {prefix or 'value': float(result)}
+    return {}
+
+def load_results(path: str = RESULTS_FILE) -> pd.DataFrame:
+    """
+    Every stored metric, one row per run, benchmark and metric
+    """
+    rows = []
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    run = json.loads(line)
+                    rows += [{'commit': run['commit'], 'date': run['date'], 'benchmark': run['benchmark'],
+                              'metric': metric, 'value': value} for metric, value in run['metrics'].items()]
+    return pd.DataFrame(rows, columns=['commit', 'date', 'benchmark', 'metric', 'value'])
+
+def store_result(name: str, metrics: Dict[str, float], commit: str, path: str = RESULTS_FILE,
+                 synthetic: List[str] = None):
+    """
+    Append a benchmark run to the results file and report metrics that moved by more than
+    CHANGE_THRESHOLD since the last run on another commit. synthetic lists the fixtures the
+    run generated instead of reading recorded pages
+    """
+    previous = load_results(path)
+    previous = previous[(previous['benchmark'] == name) & (previous['commit'] != commit)]
+    if not previous.empty:
+        last_commit = previous['commit'].iloc[-1]
+        last = previous[previous['commit'] == last_commit].groupby('metric')['value'].last()
+        for metric, value in metrics.items():
+            if metric in last and last[metric] and abs(value / last[metric] - 1) > CHANGE_THRESHOLD:
+                logging.warning(f"{name}.{metric}: {last[metric]:,.4g} at {last_commit} -> {value:,.4g} "
+                                f"({value / last[metric] - 1:+.0%})")
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'commit': commit, 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                            'benchmark': name, 'metrics': metrics,
+                            'synthetic_fixtures': sorted(synthetic or [])}) + '\n')
+
+def show_history(names: List[str] = None, path: str = RESULTS_FILE):
+    """
+    Print each metric per commit, oldest commit first
+    """
+    results = load_results(path)
+    if names:
+        results = results[results['benchmark'].isin(names)]
+    if results.empty:
+        logging.info(f"No benchmark results in {path}")
+        return
+    commits = list(dict.fromkeys(results['commit']))
+    history = results.pivot_table(index=['benchmark', 'metric'], columns='commit', values='value', aggfunc='last')
+    with pd.option_context('display.max_rows', None, 'display.width', 200, 'display.float_format', '{:,.4g}'.format):
+        print(history[commits])
+
+def main(names: List[str] = None, path: str = RESULTS_FILE):
+    """
+    Run the named benchmarks (all by default) and store their results under the current commit
+    """
+    unknown = [name for name in names or [] if name not in BENCHMARKS]
+    if unknown:
+        raise SystemExit(f"Unknown benchmarks {unknown}, choose from {list(BENCHMARKS)}")
+    commit = git_commit()
+    for name in names or BENCHMARKS:
+        synthetic_fixtures.clear()
+        metrics = flatten_metrics(BENCHMARKS[name]())
+        if metrics:
+            store_result(name, metrics, commit, path, synthetic=synthetic_fixtures)
+    logging.info(f"Stored results for {commit} in {path}, compare commits with "
+                 f"`python yad2_benchmark.py history`")
+
+if __name__ == "__main__":
+    # python yad2_benchmark.py [benchmark ...] | history [benchmark ...] | record-fixtures
+    if sys.argv[1:2] == ['history']:
+        show_history(sys.argv[2:])
+    elif sys.argv[1:2] == ['record-fixtures']:
+        record_fixtures()
+    else:
+        main(sys.argv[1:])
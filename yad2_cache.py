@@ -0,0 +1,256 @@
+"""
+Shared on-disk HTTP response cache for the Yad2 scrapers and notebooks.
+Bodies are stored zlib-compressed under their content hash, so identical responses from
+different URLs are stored once. An SQLite index maps each URL to its body, validators and
+last access time. Stale entries are revalidated with ETag/If-Modified-Since, the least
+recently used entries are evicted when the cache grows past its size limit.
+"""
+import os
+import re
+import time
+import zlib
+import atexit
+import sqlite3
+import hashlib
+import logging
+import threading
+import requests
+from functools import partial
+from requests.structures import CaseInsensitiveDict
+from typing import Dict, List, Tuple
+from yad2_utils import is_captcha_response
+
+# Seconds an entry is served without revalidation, first matching URL pattern wins
+DEFAULT_TTLS: List[Tuple[str, int]] = [
+    (r'cdn\.shopify\.com|\.(jpe?g|png|webp|gif)(\?|$)', 30 * 24 * 3600),  # Images never change
+    (r'yad2\.co\.il/(market/item|item)/', 24 * 3600),  # Listing pages
+    (r'.*', 3600),
+]
+
+# Response headers kept with the body
+STORED_HEADERS = ['Content-Type', 'ETag', 'Last-Modified']
+
+class HttpCache:
+    def __init__(self, cache_dir: str = 'http_cache', max_bytes: int = 2 * 1024 ** 3,
+                 ttls: List[Tuple[str, int]] = None):
+        # Absolute, so the shared cache keeps working after a chdir
+        self.cache_dir = cache_dir = os.path.abspath(cache_dir)
+        self.bodies_dir = os.path.join(cache_dir, 'bodies')
+        self.max_bytes = max_bytes
+        self.ttls = [(re.compile(pattern), ttl) for pattern, ttl in (ttls or DEFAULT_TTLS)]
+        os.makedirs(self.bodies_dir, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(cache_dir, 'index.db'), check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute('CREATE TABLE IF NOT EXISTS entries ('
+                          'url TEXT PRIMARY KEY, content_hash TEXT NOT NULL, size INTEGER NOT NULL, '
+                          'content_type TEXT, etag TEXT, last_modified TEXT, '
+                          'stored_at REAL NOT NULL, last_access REAL NOT NULL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries (last_access)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_entries_content_hash ON entries (content_hash)')
+        self.conn.commit()
+        # Running size of the cached bodies, so a store never sums the whole index
+        self.total_bytes = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+        self.stats = {'hits': 0, 'revalidated': 0, 'misses': 0, 'bytes_saved': 0, 'bytes_downloaded': 0}
+
+    def ttl_for(self, url: str) -> int:
+        for pattern, ttl in self.ttls:
+            if pattern.search(url):
+                return ttl
+        return 0
+
+    @staticmethod
+    def cache_key(url: str, params: Dict = None) -> str:
+        """
+        Entries are keyed by the full request URL, query parameters included
+        """
+        return requests.Request('GET', url, params=params).prepare().url
+
+    def is_fresh(self, url: str, params: Dict = None) -> bool:
+        """
+        Whether a GET for this URL will be served from disk without touching the network
+        """
+        url = self.cache_key(url, params)
+        with self.lock:
+            entry = self.conn.execute('SELECT stored_at FROM entries WHERE url = ?', (url,)).fetchone()
+        return entry is not None and time.time() - entry[0] < self.ttl_for(url)
+
+    def _count(self, **deltas):
+        with self.lock:
+            for key, delta in deltas.items():
+                self.stats[key] += delta
+
+    def _body_path(self, content_hash: str) -> str:
+        return os.path.join(self.bodies_dir, content_hash[:2], f"{content_hash}.z")
+
+    def _read_body(self, content_hash: str) -> bytes:
+        with open(self._body_path(content_hash), 'rb') as f:
+            return zlib.decompress(f.read())
+
+    def _write_body(self, content: bytes) -> str:
+        content_hash = hashlib.sha256(content).hexdigest()
+        path = self._body_path(content_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{threading.get_ident()}.temp"
+            with open(temp_path, 'wb') as f:
+                f.write(zlib.compress(content, 6))
+            os.replace(temp_path, path)
+        return content_hash
+
+    def _make_response(self, url: str, content: bytes, headers: Dict) -> requests.Response:
+        """
+        Build a requests.Response for a cached body, so callers can't tell it from a live one
+        """
+        response = requests.Response()
+        response.url = url
+        response.status_code = 200
+        response._content = content
+        response.headers = CaseInsensitiveDict({k: v for k, v in headers.items() if v})
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        return response
+
+    def get(self, session, url: str, scheduler=None, **kwargs) -> requests.Response:
+        """
+        GET a URL through the cache: fresh entries are served from disk, stale ones are
+        revalidated, everything else is fetched with the session and stored if successful.
+        With a scheduler, requests that reach the network wait for their politeness slot
+        """
+        url = self.cache_key(url, kwargs.pop('params', None))
+        now = time.time()
+        with self.lock:
+            entry = self.conn.execute('SELECT content_hash, size, content_type, etag, last_modified, stored_at '
+                                      'FROM entries WHERE url = ?', (url,)).fetchone()
+
+        headers = dict(kwargs.pop('headers', None) or {})
+        if entry:
+            content_hash, size, content_type, etag, last_modified, stored_at = entry
+            stored_headers = {'Content-Type': content_type, 'ETag': etag, 'Last-Modified': last_modified}
+            if now - stored_at < self.ttl_for(url):
+                try:
+                    content = self._read_body(content_hash)
+                    self._touch(url, now)
+                    self._count(hits=1, bytes_saved=size)
+                    return self._make_response(url, content, stored_headers)
+                except (OSError, zlib.error) as e:
+                    logging.warning(f"Dropping unreadable cache entry for {url}: {e}")
+                    entry = None
+            else:
+                if etag:
+                    headers['If-None-Match'] = etag
+                if last_modified:
+                    headers['If-Modified-Since'] = last_modified
+
+        fetch = partial(scheduler.get, session) if scheduler else session.get
+        response = fetch(url, headers=headers, **kwargs)
+        if entry and response.status_code == 304:
+            try:
+                content = self._read_body(content_hash)
+                with self.lock, self.conn:
+                    self.conn.execute('UPDATE entries SET stored_at = ?, last_access = ? WHERE url = ?',
+                                      (now, now, url))
+                self._count(revalidated=1, bytes_saved=size)
+                return self._make_response(url, content, stored_headers)
+            except (OSError, zlib.error):
+                # The body is gone, fetch it again without validators
+                for header in ('If-None-Match', 'If-Modified-Since'):
+                    headers.pop(header, None)
+                response = fetch(url, headers=headers, **kwargs)
+
+        self._count(misses=1, bytes_downloaded=len(response.content))
+        if response.status_code == 200:
+            self.store(url, response)
+        return response
+
+    def store(self, url: str, response: requests.Response):
+        """
+        Store a successful response and evict old entries if the cache is over its size limit.
+        CAPTCHA challenges come back as 200s too, they are never stored
+        """
+        if is_captcha_response(response):
+            logging.warning(f"Not caching the CAPTCHA page served for {url}")
+            return
+        try:
+            content_hash = self._write_body(response.content)
+        except OSError as e:
+            logging.error(f"Error writing cache entry for {url}: {e}")
+            return
+        now = time.time()
+        with self.lock, self.conn:
+            replaced = self.conn.execute('SELECT size FROM entries WHERE url = ?', (url,)).fetchone()
+            self.conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                              (url, content_hash, len(response.content), *(response.headers.get(h) for h in STORED_HEADERS),
+                               now, now))
+            self.total_bytes += len(response.content) - (replaced[0] if replaced else 0)
+            over_limit = self.total_bytes > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def _touch(self, url: str, now: float):
+        with self.lock, self.conn:
+            self.conn.execute('UPDATE entries SET last_access = ? WHERE url = ?', (now, url))
+
+    def evict(self):
+        """
+        Drop least recently used entries until the cache fits in max_bytes.
+        Only runs once the running total crosses the limit, so the total is synced with the
+        index here, which other processes may have written to
+        """
+        with self.lock, self.conn:
+            total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            self.total_bytes = total
+            if total <= self.max_bytes:
+                return
+            evicted = []
+            for url, content_hash, size in self.conn.execute(
+                    'SELECT url, content_hash, size FROM entries ORDER BY last_access'):
+                if total <= self.max_bytes:
+                    break
+                evicted.append((url, content_hash))
+                total -= size
+            self.total_bytes = total
+            self.conn.executemany('DELETE FROM entries WHERE url = ?', [(url,) for url, _ in evicted])
+            # Remove bodies no other URL points to
+            for content_hash in {content_hash for _, content_hash in evicted}:
+                if not self.conn.execute('SELECT 1 FROM entries WHERE content_hash = ? LIMIT 1',
+                                         (content_hash,)).fetchone():
+                    try:
+                        os.remove(self._body_path(content_hash))
+                    except OSError:
+                        pass
+        logging.info(f"Evicted {len(evicted)} entries from the HTTP cache")
+
+    def log_stats(self):
+        stats = self.stats
+        requests_seen = stats['hits'] + stats['revalidated'] + stats['misses']
+        if not requests_seen:
+            return
+        logging.info(f"HTTP cache: {stats['hits']} hits, {stats['revalidated']} revalidated, {stats['misses']} misses "
+                     f"({(stats['hits'] + stats['revalidated']) / requests_seen:.0%} served from disk), "
+                     f"{stats['bytes_saved'] / 1024 / 1024:.1f} MB saved, "
+                     f"{stats['bytes_downloaded'] / 1024 / 1024:.1f} MB downloaded")
+
+    def close(self):
+        self.conn.close()
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+def get_shared_cache() -> HttpCache:
+    """
+    The cache shared by every scraper in this process, its stats are logged at exit
+    """
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = HttpCache()
+            atexit.register(_shared_cache.log_stats)
+        return _shared_cache
+
+def cached_get(url: str, session=None, **kwargs) -> requests.Response:
+    """
+    GET through the shared cache, e.g. from the notebooks
+    """
+    return get_shared_cache().get(session or requests, url, **kwargs)
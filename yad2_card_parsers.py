@@ -0,0 +1,289 @@
+"""
+Parser backends for Yad2 collection feed pages.
+Every backend takes the page HTML and returns one dict of raw card fields per product card,
+skipping new business listings. extract_cards_in_browser does the same inside the page via WebDriver,
+and parse_cards_embedded reads the cards from the page's embedded __NEXT_DATA__ JSON.
+"""
+import json
+import logging
+from bs4 import BeautifulSoup
+from typing import Callable, Dict, List
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+CARD_CLASS = 'item-grid_grid__P3tKb'
+BUSINESS_TAG_CLASS = 'item-image_newBusinessTag__zI6xW'
+LINK_CLASS = 'item-grid_imageContainer__U2drL'
+IMAGE_CLASS = 'shopify-image_image__KPxpT'
+PRICE_CLASS = 'item-price_price__HMXoj'
+LOCATION_CLASS = 'item-location_location__E96ST'
+TITLE_CLASS = 'item-title_title__2tG20'
+TAGS_CLASS = 'item-tags_tags__GdgQO'
+TAG_CLASS = 'tag_tag__Zaq8_'
+
+def build_card_fields(href: str, image_url: str, price: str, location: str, title: str, tags: List[str]) -> Dict:
+    """
+    Build the raw card fields dict shared by all backends
+    """
+    product_url = f"https://www.yad2.co.il{href}" if href is not None else ''
+    return {
+        'product_id': product_url.split('/')[-1] if product_url else '',
+        'title': title,
+        'current_price': price.replace('₪', ''),
+        'location': location,
+        'image_url': image_url,
+        'product_url': product_url,
+        'tags': ', '.join(tags),
+    }
+
+def extract_card_fields(card) -> Dict:
+    """
+    Extract the raw fields of a single BeautifulSoup product card
+    Returns an empty dict for new business listings
+    """
+    # Skip if it's a new business listing
+    if card.find('div', class_=BUSINESS_TAG_CLASS):
+        return {}
+
+    # Get product URL and ID from the link
+    link = card.find('a', class_=LINK_CLASS)
+
+    # Get image URL
+    img_elem = card.find('img', class_=IMAGE_CLASS)
+
+    # Get price, location and title
+    price_elem = card.find('p', class_=PRICE_CLASS)
+    location_elem = card.find('p', class_=LOCATION_CLASS)
+    title_elem = card.find('h2', class_=TITLE_CLASS)
+
+    # Get tags/condition
+    tags_container = card.find('div', class_=TAGS_CLASS)
+    tags = [tag.text.strip() for tag in tags_container.find_all('p', class_=TAG_CLASS)] if tags_container else []
+
+    return build_card_fields(
+        href=link.get('href', '') if link else None,
+        image_url=img_elem.get('src', '') if img_elem else '',
+        price=price_elem.text.strip() if price_elem else '',
+        location=location_elem.text.strip() if location_elem else '',
+        title=title_elem.text.strip() if title_elem else '',
+        tags=tags,
+    )
+
+def parse_cards_bs4(html: str) -> List[Dict]:
+    """
+    Reference backend: BeautifulSoup with the pure Python html.parser
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    cards = []
+    for card in soup.find_all('article', class_=CARD_CLASS):
+        try:
+            fields = extract_card_fields(card)
+        except Exception as e:
+            logging.error(f"Error parsing product card: {e}")
+            continue
+        if fields:
+            cards.append(fields)
+    return cards
+
+def _has_class(elem, class_name: str) -> bool:
+    return class_name in elem.get('class', '').split()
+
+def _extract_card_fields_lxml(card) -> Dict:
+    """
+    Walk a single lxml product card once and pull out all fields together
+    """
+    # The first match of each field wins, like BeautifulSoup's find
+    found = {}
+    tags = []
+    for elem in card.iter():
+        tag = elem.tag
+        if not isinstance(tag, str):
+            continue  # Comments and processing instructions
+        classes = elem.get('class')
+        if not classes:
+            continue
+        classes = classes.split()
+        if tag == 'div':
+            if BUSINESS_TAG_CLASS in classes:
+                return {}
+            if TAGS_CLASS in classes and 'tags' not in found:
+                found['tags'] = elem
+                tags = [p.text_content().strip() for p in elem.iter('p') if _has_class(p, TAG_CLASS)]
+        elif tag == 'a' and LINK_CLASS in classes:
+            found.setdefault('link', elem)
+        elif tag == 'img' and IMAGE_CLASS in classes:
+            found.setdefault('img', elem)
+        elif tag == 'p':
+            if PRICE_CLASS in classes:
+                found.setdefault('price', elem)
+            elif LOCATION_CLASS in classes:
+                found.setdefault('location', elem)
+        elif tag == 'h2' and TITLE_CLASS in classes:
+            found.setdefault('title', elem)
+
+    def text(key: str) -> str:
+        return found[key].text_content().strip() if key in found else ''
+
+    return build_card_fields(
+        href=found['link'].get('href', '') if 'link' in found else None,
+        image_url=found['img'].get('src', '') if 'img' in found else '',
+        price=text('price'),
+        location=text('location'),
+        title=text('title'),
+        tags=tags,
+    )
+
+def parse_cards_lxml(html: str) -> List[Dict]:
+    """
+    Fast backend: lxml's C parser with a single walk per card
+    """
+    root = lxml.html.document_fromstring(html)
+    cards = []
+    for card in root.iter('article'):
+        if not _has_class(card, CARD_CLASS):
+            continue
+        try:
+            fields = _extract_card_fields_lxml(card)
+        except Exception as e:
+            logging.error(f"Error parsing product card: {e}")
+            continue
+        if fields:
+            cards.append(fields)
+    return cards
+
+# Collects the raw fields of every card inside the page, so only this compact JSON
+# crosses the WebDriver wire instead of the whole page source.
+# Text is returned untrimmed and cleaned up in Python to match BeautifulSoup exactly.
+EXTRACT_CARDS_JS = """
+const [cardSel, businessSel, linkSel, imageSel, priceSel, locationSel, titleSel, tagsSel, tagSel] = arguments;
+const text = (card, sel) => { const elem = card.querySelector(sel); return elem ? elem.textContent : ''; };
+const cards = [];
+for (const card of document.querySelectorAll(cardSel)) {
+    if (card.querySelector(businessSel)) continue;
+    const link = card.querySelector(linkSel);
+    const img = card.querySelector(imageSel);
+    const tagsContainer = card.querySelector(tagsSel);
+    cards.push({
+        href: link ? (link.getAttribute('href') || '') : null,
+        image_url: img ? (img.getAttribute('src') || '') : '',
+        price: text(card, priceSel),
+        location: text(card, locationSel),
+        title: text(card, titleSel),
+        tags: tagsContainer ? Array.from(tagsContainer.querySelectorAll(tagSel), tag => tag.textContent) : [],
+    });
+}
+return cards;
+"""
+
+def extract_cards_in_browser(driver) -> List[Dict]:
+    """
+    In-browser backend: run one script in the page and build the card fields from its JSON result
+    """
+    raw_cards = driver.execute_script(
+        EXTRACT_CARDS_JS,
+        f'article.{CARD_CLASS}', f'div.{BUSINESS_TAG_CLASS}', f'a.{LINK_CLASS}', f'img.{IMAGE_CLASS}',
+        f'p.{PRICE_CLASS}', f'p.{LOCATION_CLASS}', f'h2.{TITLE_CLASS}', f'div.{TAGS_CLASS}', f'p.{TAG_CLASS}',
+    )
+    return [build_card_fields(
+        href=raw['href'],
+        image_url=raw['image_url'],
+        price=raw['price'].strip(),
+        location=raw['location'].strip(),
+        title=raw['title'].strip(),
+        tags=[tag.strip() for tag in raw['tags']],
+    ) for raw in raw_cards or []]
+
+def _items_of(feed) -> List:
+    """
+    The items of one feed page, given as a list or as an object with an items list
+    """
+    if isinstance(feed, list):
+        return feed
+    if isinstance(feed, dict) and isinstance(feed.get('items'), list):
+        return feed['items']
+    return []
+
+def _find_product_items(data):
+    """
+    Yield the product items of the feed in a page's __NEXT_DATA__, and only those: the feed queries
+    dehydrated under props.pageProps.dehydratedState (single or infinite-query pages), or
+    props.pageProps.feed. Sellers, categories and other objects elsewhere in the page are never read
+    """
+    page_props = ((data or {}).get('props') or {}).get('pageProps') or {}
+    feeds = []
+    for query in (page_props.get('dehydratedState') or {}).get('queries') or []:
+        if 'feed' not in json.dumps(query.get('queryKey', '')).lower():
+            continue
+        query_data = (query.get('state') or {}).get('data')
+        if isinstance(query_data, dict) and isinstance(query_data.get('pages'), list):
+            feeds.extend(query_data['pages'])
+        else:
+            feeds.append(query_data)
+    if 'feed' in page_props:
+        feeds.append(page_props['feed'])
+    for feed in feeds:
+        for item in _items_of(feed):
+            if isinstance(item, dict) and 'id' in item:
+                yield item
+
+def _first_value(item: Dict, keys: List[str]):
+    for key in keys:
+        value = item.get(key)
+        if value not in (None, '', [], {}):
+            return value
+    return None
+
+def _as_text(value) -> str:
+    """
+    Flatten the price/image/location shapes seen in embedded data to a string
+    """
+    if isinstance(value, list):
+        return _as_text(value[0]) if value else ''
+    if isinstance(value, dict):
+        return _as_text(_first_value(value, ['url', 'src', 'originalSrc', 'amount', 'minVariantPrice', 'text', 'name']))
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return '' if value is None else str(value).strip()
+
+def parse_cards_embedded(data: Dict) -> List[Dict]:
+    """
+    Embedded data backend: build card fields from the feed items in a page's __NEXT_DATA__ JSON
+    """
+    cards = []
+    seen = set()
+    for item in _find_product_items(data):
+        if item.get('isBusiness') or item.get('newBusiness'):
+            continue
+        url = _as_text(_first_value(item, ['url', 'href', 'link']))
+        if url.startswith('https://www.yad2.co.il'):
+            url = url[len('https://www.yad2.co.il'):]
+        href = url if url.startswith('/') else f"/market/item/{item['id']}"
+        fields = build_card_fields(
+            href=href,
+            image_url=_as_text(_first_value(item, ['image', 'imageUrl', 'featuredImage', 'images'])),
+            price=_as_text(_first_value(item, ['price', 'priceRange'])),
+            location=_as_text(_first_value(item, ['location', 'city', 'area'])),
+            title=_as_text(item.get('title')),
+            tags=[_as_text(tag) for tag in item.get('tags') or [] if _as_text(tag)],
+        )
+        if fields['product_id'] and fields['product_id'] not in seen:
+            seen.add(fields['product_id'])
+            cards.append(fields)
+    return cards
+
+PARSER_BACKENDS: Dict[str, Callable[[str], List[Dict]]] = {'bs4': parse_cards_bs4}
+if lxml is not None:
+    PARSER_BACKENDS['lxml'] = parse_cards_lxml
+
+def get_card_parser(backend: str = 'auto') -> Callable[[str], List[Dict]]:
+    """
+    Return the card parser for a backend name, 'auto' picks the fastest one installed
+    """
+    if backend == 'auto':
+        backend = 'lxml' if 'lxml' in PARSER_BACKENDS else 'bs4'
+    if backend not in PARSER_BACKENDS:
+        raise ValueError(f"Unknown or unavailable parser backend: {backend}")
+    return PARSER_BACKENDS[backend]
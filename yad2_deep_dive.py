@@ -1,14 +1,22 @@
+import os
 import glob
 import re
-import pandas as pd
+import asyncio
 import requests
 from bs4 import BeautifulSoup
 import json
 import time
 import logging
 from typing import Dict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 
 from tqdm import tqdm
+from yad2_cache import HttpCache, get_shared_cache
+from yad2_phash import load_repost_ids
+from yad2_store import load_listings, store_path_for
+from yad2_utils import (PolitenessScheduler, THROTTLE_STATUS_CODES, JsonlJournal, compact_journal_to_csv,
+                        is_captcha_response, read_csv_column)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -46,66 +54,209 @@ def extract_description(soup) -> str:
             return desc_elem.text.strip()
     return ''
 
-# Main deep dive function
-def deep_dive(input_csv, output_csv, limit=None, delay=1.5):
-    # Read input data
-    df = pd.read_csv(input_csv, dtype=str)
-    
-    # Try to load existing output file if it exists
-    existing_results = []
-    try:
-        existing_df = pd.read_csv(output_csv, dtype=str)
-        existing_results = existing_df.to_dict('records')
-        logging.info(f"Loaded {len(existing_results)} existing results from {output_csv}")
-    except FileNotFoundError:
-        logging.info(f"No existing output file found at {output_csv}")
+DEEP_DIVE_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/136.0.0.0 Safari/537.36'
+}
+
+# Status codes worth retrying with backoff
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+def make_session(pool_size: int) -> requests.Session:
+    """
+    A session whose connection pool fits `pool_size` concurrent requests
+    """
+    session = requests.Session()
+    session.headers.update(DEEP_DIVE_HEADERS)
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def parse_listing_page(html: str) -> Dict:
+    """
+    Extract the deep dive fields from a listing page
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    return {
+        'description': extract_description(soup),
+        'details_json': json.dumps(extract_details_json(soup), ensure_ascii=False),
+    }
+
+async def fetch_listing_page(session: requests.Session, url: str, scheduler: PolitenessScheduler,
+                             retries: int = 3, backoff: float = 2.0, io_pool: ThreadPoolExecutor = None,
+                             cache: HttpCache = None) -> str:
+    """
+    Fetch a listing page with the shared session on the I/O thread pool, waiting for the host's
+    politeness slot and retrying 429/5xx responses, CAPTCHAs and connection errors. Throttled responses
+    and CAPTCHAs push the host's next slot past Retry-After or the scheduler's cooldown, other failures
+    back off exponentially. With a cache, fresh pages are read from disk without taking a slot
+    """
+    loop = asyncio.get_running_loop()
+    get = partial(cache.get, session, url, timeout=30) if cache else partial(session.get, url, timeout=30)
+    for attempt in range(retries + 1):
+        fresh = cache and cache.is_fresh(url)
+        if not fresh:
+            await asyncio.sleep(scheduler.reserve(url))
+        start = time.time()
+        try:
+            resp = await loop.run_in_executor(io_pool, get)
+        except requests.exceptions.RequestException as e:
+            scheduler.record(url)
+            if attempt == retries:
+                raise
+            logging.warning(f"Error fetching {url}: {e}, retrying")
+            await asyncio.sleep(backoff * 2 ** attempt)
+            continue
+        blocked = is_captcha_response(resp)
+        if not fresh:
+            retry_after = resp.headers.get('Retry-After', '')
+            scheduler.record(url, status=resp.status_code, latency=time.time() - start, blocked=blocked,
+                             retry_after=float(retry_after) if retry_after.isdigit() else None)
+        if blocked:
+            # The host's cooldown delays the retry, a page still blocked fails so it is not journaled
+            if attempt < retries:
+                logging.warning(f"CAPTCHA on {url}, retrying")
+                continue
+            raise requests.exceptions.HTTPError(f"CAPTCHA on {url}", response=resp)
+        if resp.status_code in RETRY_STATUS_CODES and attempt < retries:
+            logging.warning(f"Got {resp.status_code} for {url}, retrying")
+            if resp.status_code not in THROTTLE_STATUS_CODES:
+                await asyncio.sleep(backoff * 2 ** attempt)
+            continue
+        resp.raise_for_status()
+        return resp.text
+
+async def deep_dive_async(input_csv, output_csv, limit=None, fetch_workers=8, parse_workers=None,
+                          queue_size=32, rate=1 / 1.5, retries=3, use_cache=True,
+                          skip_reposts=True, scheduler: PolitenessScheduler = None):
+    """
+    Deep dive as a two stage pipeline: `fetch_workers` I/O workers fetch pages over one pooled
+    session at most `rate` requests per second per host (a politeness scheduler whose state is
+    shared with the other scrapers unless `scheduler` is given), and hand the raw HTML
+    to a pool of `parse_workers` processes (0 parses in the event loop). The queues between
+    the stages hold at most `queue_size` items, so memory stays flat.
+    With use_cache, pages go through the shared on-disk HTTP cache, with skip_reposts listings
+    flagged as reposts by the perceptual-hash index are not fetched again
+    """
+    # Read input data, either a collections CSV or its SQLite store
+    df = load_listings(input_csv)
     
-    # Create a set of already processed URLs
-    processed_urls = {record.get('product_url') for record in existing_results if record.get('product_url')}
+    # Results are streamed to a journal as they finish and merged into the output CSV at the end,
+    # so a crash only loses the listings in flight. Resume by reading only the product_url keys
+    journal_path = f"{output_csv}.jsonl"
+    processed_urls = read_csv_column(output_csv, 'product_url')
+    logging.info(f"Found {len(processed_urls)} existing results in {output_csv}")
+    journal_urls = JsonlJournal.read_keys(journal_path, 'product_url')
+    if journal_urls:
+        logging.info(f"Resuming with {len(journal_urls)} results from {journal_path}")
+    processed_urls |= journal_urls
     
     # Filter out already processed listings
     new_listings = df[~df['product_url'].isin(processed_urls)]
+    if limit:
+        new_listings = new_listings[new_listings.index < limit]
+    new_listings = new_listings[new_listings['product_url'].notna() & (new_listings['product_url'] != '')]
+    if skip_reposts and 'product_id' in new_listings:
+        repost_ids = load_repost_ids()
+        reposts = new_listings['product_id'].astype(str).isin(repost_ids)
+        if reposts.any():
+            logging.info(f"Skipping {reposts.sum()} listings flagged as reposts")
+            new_listings = new_listings[~reposts]
     logging.info(f"Found {len(new_listings)} new listings to process")
     
-    results = existing_results.copy()  # Start with existing results
+    parse_workers = os.cpu_count() if parse_workers is None else parse_workers
+    session = make_session(fetch_workers)
+    scheduler = scheduler or PolitenessScheduler(rate=rate, host_rates={})
+    cache = get_shared_cache() if use_cache else None
+    journal = JsonlJournal(journal_path)
+    url_queue = asyncio.Queue(maxsize=queue_size)
+    html_queue = asyncio.Queue(maxsize=queue_size)
+    io_pool = ThreadPoolExecutor(max_workers=fetch_workers)
+    pool = ProcessPoolExecutor(max_workers=parse_workers) if parse_workers else None
+    loop = asyncio.get_running_loop()
+    start = time.time()
     
-    for idx, row in tqdm(new_listings.iterrows(), total=len(new_listings)):
-        if limit and idx >= limit:
-            break
-        url = row.get('product_url')
-        if not url:
-            continue
-        logging.info(f"Scraping {url}")
-        try:
-            resp = requests.get(url, headers={
-                'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/136.0.0.0 Safari/537.36'
-            })
-            resp.raise_for_status()
-            soup = BeautifulSoup(resp.text, 'html.parser')
-            # Extract fields
-            description = extract_description(soup)
-            details_json = extract_details_json(soup)
-            # Merge all data
-            enriched = dict(row)
-            enriched['description'] = description
-            enriched['details_json'] = json.dumps(details_json, ensure_ascii=False)
-            results.append(enriched)
-        except Exception as e:
-            logging.error(f"Error scraping {url}: {e}")
-        time.sleep(delay)
+    with tqdm(total=len(new_listings)) as pbar:
+        def done():
+            pbar.update(1)
+            pbar.set_postfix(req_per_sec=f"{pbar.n / max(time.time() - start, 1e-9):.2f}")
+        
+        async def produce():
+            for _, row in new_listings.iterrows():
+                await url_queue.put(dict(row))
+            for _ in range(fetch_workers):
+                await url_queue.put(None)
+        
+        async def fetch():
+            while (row := await url_queue.get()) is not None:
+                url = row['product_url']
+                logging.info(f"Scraping {url}")
+                try:
+                    html = await fetch_listing_page(session, url, scheduler, retries=retries, io_pool=io_pool,
+                                                    cache=cache)
+                except Exception as e:
+                    logging.error(f"Error scraping {url}: {e}")
+                    done()
+                    continue
+                await html_queue.put((row, html))
+        
+        async def parse():
+            while (item := await html_queue.get()) is not None:
+                row, html = item
+                try:
+                    if pool:
+                        fields = await loop.run_in_executor(pool, parse_listing_page, html)
+                    else:
+                        fields = parse_listing_page(html)
+                    # Merge all data
+                    row.update(fields)
+                    journal.append(row)
+                except Exception as e:
+                    logging.error(f"Error parsing {row['product_url']}: {e}")
+                done()
+        
+        # One parse coroutine per process keeps every worker busy without unbounded submissions
+        parsers = [asyncio.create_task(parse()) for _ in range(max(parse_workers, 1))]
+        await asyncio.gather(produce(), *(fetch() for _ in range(fetch_workers)))
+        for _ in parsers:
+            await html_queue.put(None)
+        await asyncio.gather(*parsers)
     
-    # Save to new CSV
-    pd.DataFrame(results).to_csv(output_csv, index=False, encoding='utf-8-sig')
+    if pool:
+        pool.shutdown()
+    io_pool.shutdown()
+    session.close()
+    journal.close()
+    
+    elapsed = time.time() - start
+    logging.info(f"Scraped {len(new_listings)} listings in {elapsed:.1f}s "
+                 f"({len(new_listings) / max(elapsed, 1e-9):.2f} req/s)")
+    
+    # Merge the journal into the output CSV
+    compact_journal_to_csv(journal_path, output_csv)
     logging.info(f"Saved deep dive results to {output_csv}")
 
+# Main deep dive function
+def deep_dive(input_csv, output_csv, limit=None, delay=1.5, fetch_workers=8, parse_workers=None, queue_size=32,
+              retries=3, use_cache=True, skip_reposts=True, scheduler=None):
+    # delay is the politeness interval per host, enforced by the politeness scheduler across all workers
+    asyncio.run(deep_dive_async(input_csv, output_csv, limit=limit, fetch_workers=fetch_workers,
+                                parse_workers=parse_workers, queue_size=queue_size,
+                                rate=1 / delay if delay else 1e9, retries=retries, use_cache=use_cache,
+                                skip_reposts=skip_reposts, scheduler=scheduler))
+
 if __name__ == "__main__":
-    # Example usage
-    for f in glob.glob('yad2_collections_*.csv'):
+    # Example usage, reading each query's SQLite store instead of its CSV when it has one
+    inputs = glob.glob('yad2_collections_*.db')
+    inputs += [f for f in glob.glob('yad2_collections_*.csv') if store_path_for(f) not in inputs]
+    for f in inputs:
         deep_dive(
             input_csv=f,
             output_csv=f"yad2_deep_dive_{'_'.join(re.findall(r'[א-ת]+', f))}.csv",
             limit=None,  # Set to an integer for testing
-            delay=1.5
+            delay=1.5,  # At most one request every 1.5 seconds to the host, shared by all workers
+            fetch_workers=8,
+            parse_workers=None  # One parsing process per core
         )
 
     
\ No newline at end of file
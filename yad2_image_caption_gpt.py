@@ -1,31 +1,167 @@
 import os
+import json
 import time
+import random
+import sqlite3
+import hashlib
 import pandas as pd
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
-from openai import OpenAI
+from openai import OpenAI, APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+from yad2_utils import JsonlJournal
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def call_chatgpt_with_image(image_url, prompt):
+MODEL = "gpt-4.1-2025-04-14"
+ANSWER_COLS = ["state", "desirability", "photo_appeal", "issues", "desc_match", "new_price", "sell_price", "offer_price"]
+RETRY_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+# USD per million (input, output) tokens, used to report what the caption cache saved
+TOKEN_PRICES = {MODEL: (2.00, 8.00)}
+
+def make_client(base_url=None, timeout=60.0):
+    """
+    One client for the whole run so connections are reused, base_url points it at any OpenAI-compatible server
+    """
     api_key = os.getenv('OPENAI_API_KEY')
     if not api_key:
         raise ValueError("OPENAI_API_KEY environment variable is not set")
-    model = "gpt-4.1-2025-04-14"
-    client = OpenAI(api_key=api_key)
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": image_url}}
+    # Retries are handled in call_chatgpt_with_image
+    return OpenAI(api_key=api_key, base_url=base_url, timeout=timeout, max_retries=0)
+
+def get_retry_after(error):
+    """
+    The server's Retry-After in seconds, if it sent one
+    """
+    response = getattr(error, 'response', None)
+    try:
+        return float(response.headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def call_chatgpt_with_image(image_url, prompt, client=None, model=MODEL, retries=5, backoff=2.0):
+    return request_caption(image_url, prompt, client, model, retries, backoff)['caption']
+
+def request_caption(image_url, prompt, client=None, model=MODEL, retries=5, backoff=2.0):
+    """
+    Caption an image, returns the caption with the token usage and latency of the request
+    """
+    client = client or make_client()
+    start = time.time()
+    for attempt in range(retries + 1):
+        try:
+            response = client.chat.completions.create(
+                model=model,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": prompt},
+                            {"type": "image_url", "image_url": {"url": image_url}}
+                        ]
+                    }
                 ]
+            )
+            usage = response.usage
+            return {
+                'caption': response.choices[0].message.content,
+                'prompt_tokens': usage.prompt_tokens if usage else 0,
+                'completion_tokens': usage.completion_tokens if usage else 0,
+                'latency': time.time() - start,
             }
-        ]
-    )
-    return response.choices[0].message.content
+        except RETRY_ERRORS as e:
+            if attempt == retries:
+                raise
+            # Honor the rate limiter's Retry-After, otherwise back off exponentially with jitter
+            wait = get_retry_after(e)
+            if wait is None:
+                wait = backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+            logging.warning(f"{type(e).__name__} from the API, retrying in {wait:.1f}s")
+            time.sleep(wait)
+
+def get_cost(model, prompt_tokens, completion_tokens):
+    input_price, output_price = TOKEN_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+def hash_text(text):
+    return hashlib.sha256(str(text).encode('utf-8')).hexdigest()
+
+class CaptionCache:
+    """
+    Persistent caption cache keyed by hashes of (image, description, price, rendered prompt, model),
+    so rows that haven't changed are never paid for twice
+    """
+    def __init__(self, db_path="caption_cache.db"):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute('CREATE TABLE IF NOT EXISTS captions (cache_key TEXT PRIMARY KEY, '
+                          'template_hash TEXT NOT NULL, model TEXT NOT NULL, caption TEXT NOT NULL, '
+                          'prompt_tokens INTEGER, completion_tokens INTEGER, latency REAL, created_at TEXT)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_captions_template ON captions (template_hash, model)')
+        self.conn.commit()
+        self.stats = {'hits': 0, 'misses': 0, 'saved_cost': 0.0, 'saved_latency': 0.0, 'spent_cost': 0.0}
+
+    @staticmethod
+    def make_key(image_key, description, price, prompt, model):
+        return hash_text(json.dumps([image_key, description, price, prompt, model], ensure_ascii=False, default=str))
+
+    def get(self, cache_key):
+        """
+        The cached caption for a key, counting what the hit saved
+        """
+        row = self.conn.execute('SELECT caption, model, prompt_tokens, completion_tokens, latency FROM captions '
+                                'WHERE cache_key = ?', (cache_key,)).fetchone()
+        if row is None:
+            self.stats['misses'] += 1
+            return None
+        caption, model, prompt_tokens, completion_tokens, latency = row
+        self.stats['hits'] += 1
+        self.stats['saved_cost'] += get_cost(model, prompt_tokens or 0, completion_tokens or 0)
+        self.stats['saved_latency'] += latency or 0.0
+        return caption
+
+    def put(self, cache_key, template_hash, model, result):
+        self.stats['spent_cost'] += get_cost(model, result['prompt_tokens'], result['completion_tokens'])
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO captions VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                              (cache_key, template_hash, model, result['caption'], result['prompt_tokens'],
+                               result['completion_tokens'], result['latency'], time.strftime('%Y-%m-%d %H:%M:%S')))
+
+    def invalidate(self, prompt_template=None, model=None):
+        """
+        Drop the cached captions of a prompt template and/or model, everything when neither is given.
+        Editing a template already misses the cache, this reclaims the old template's entries
+        """
+        query, params = 'DELETE FROM captions WHERE 1 = 1', []
+        if prompt_template is not None:
+            query += ' AND template_hash = ?'
+            params.append(hash_text(prompt_template))
+        if model is not None:
+            query += ' AND model = ?'
+            params.append(model)
+        with self.conn:
+            n_deleted = self.conn.execute(query, params).rowcount
+        logging.info(f"Invalidated {n_deleted} cached captions")
+        return n_deleted
+
+    def log_stats(self):
+        stats = self.stats
+        logging.info(f"Caption cache: {stats['hits']} hits, {stats['misses']} misses, "
+                     f"saved ${stats['saved_cost']:.2f} and {stats['saved_latency']:.0f}s of API latency, "
+                     f"spent ${stats['spent_cost']:.2f}")
+
+    def close(self):
+        self.conn.close()
+
+def get_image_key(image_url, image_path):
+    """
+    Hash the image bytes when we have the image locally, otherwise its URL
+    """
+    if os.path.exists(image_path):
+        with open(image_path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    return image_url
 
 def parse_caption_to_columns(caption):
     # Split by newlines, strip whitespace, and pad to 8 fields if needed
@@ -46,6 +182,13 @@ def parse_caption_to_columns(caption):
         "offer_price": lines[7],
     }
 
+def get_row_keys(df, id_col):
+    """
+    The key of every row, its id or its index when the id is missing
+    """
+    index_keys = pd.Series(df.index.astype(str), index=df.index)
+    return df[id_col].fillna(index_keys) if id_col in df else index_keys
+
 def main(csv_path,
           image_folder,
           id_col="product_id",
@@ -53,21 +196,36 @@ def main(csv_path,
           description_col="description",
           price_col="current_price",
           prompt_template=None,
-          limit=None):
+          limit=None,
+          max_workers=8,
+          base_url=None,
+          model=MODEL,
+          cache_path="caption_cache.db",
+          refresh=False):
     os.makedirs(image_folder, exist_ok=True)
     df = pd.read_csv(csv_path, dtype=str)
-    captions = []
-    # Define the prompt template after loading the CSV
-    for idx, row in tqdm(df.iterrows(), total=len(df)):
+    row_keys = get_row_keys(df, id_col)
+    out_csv = "captioned_" + os.path.basename(csv_path)
+
+    # Captions are appended to a journal as they arrive and merged into the CSV once at the end,
+    # so a crash only loses the requests in flight and a rerun resumes from the journal
+    journal_path = f"{out_csv}.jsonl"
+    done_keys = JsonlJournal.read_keys(journal_path, 'row_key')
+    if done_keys:
+        logging.info(f"Resuming with {len(done_keys)} captions from {journal_path}")
+
+    tasks = []
+    for idx, row in df.iterrows():
         if limit and idx >= limit:
             break
-        item_id = row.get(id_col, str(idx))
+        item_id = row_keys[idx]
         image_url = row.get(image_url_col)
         description = row.get(description_col, "")
         price = row.get(price_col, "")
-        if not image_url:
+        if item_id in done_keys:
+            continue
+        if not isinstance(image_url, str) or not image_url:
             logging.warning(f"No image URL for row {idx}")
-            captions.append("")
             continue
         # Build image filename
         ext = os.path.splitext(image_url)[-1].split('?')[0]
@@ -81,22 +239,61 @@ def main(csv_path,
                 continue
         # Format the prompt for this row
         prompt = prompt_template.format(description=description, price=price)
-        # Call ChatGPT with the image
-        try:
-            caption = call_chatgpt_with_image(image_url, prompt)
-        except Exception as e:
-            logging.error(f"Error calling ChatGPT for row {idx}: {e}")
-            caption = "\n".join([""]*8)
-        captions.append(caption)
-        # Parse and save answers to columns
-        parsed = parse_caption_to_columns(caption)
-        answer_cols = ["state", "desirability", "photo_appeal", "issues", "desc_match", "new_price", "sell_price", "offer_price"]
-        for col in answer_cols:
-            df.at[idx, col] = parsed[col]
-        df.at[idx, "full_caption"] = caption
-        # Save intermediate CSV after each row
-        out_csv = "captioned_" + os.path.basename(csv_path)
-        df.to_csv(out_csv, index=False, encoding="utf-8-sig")
+        cache_key = CaptionCache.make_key(get_image_key(image_url, image_path), description, price, prompt, model)
+        tasks.append((item_id, image_url, prompt, cache_key))
+
+    # Rows whose image, description, price, prompt and model are unchanged come from the cache
+    cache = CaptionCache(cache_path)
+    template_hash = hash_text(prompt_template)
+    journal = JsonlJournal(journal_path)
+    uncached = []
+    cached_rows = []
+    for item_id, image_url, prompt, cache_key in tasks:
+        caption = None if refresh else cache.get(cache_key)
+        if caption is None:
+            uncached.append((item_id, image_url, prompt, cache_key))
+        else:
+            cached_rows.append({'row_key': item_id, **parse_caption_to_columns(caption), 'full_caption': caption})
+    # Cache hits go to the journal in one write, a warm cache costs a single fsync
+    if cached_rows:
+        journal.append_many(cached_rows)
+
+    # One shared client, at most max_workers requests in flight, only made when a row needs the API
+    client = make_client(base_url) if uncached else None
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(request_caption, image_url, prompt, client, model): (item_id, cache_key)
+                   for item_id, image_url, prompt, cache_key in uncached}
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            item_id, cache_key = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                logging.error(f"Error calling ChatGPT for row {item_id}: {e}")
+                continue
+            cache.put(cache_key, template_hash, model, result)
+            # Parse and journal answers to columns
+            caption = result['caption']
+            journal.append({'row_key': item_id, **parse_caption_to_columns(caption), 'full_caption': caption})
+    journal.close()
+    if client is not None:
+        client.close()
+    elapsed = time.time() - start
+    logging.info(f"Captioned {len(uncached)} rows in {elapsed:.1f}s ({len(uncached) / max(elapsed, 1e-9):.2f} rows/s)")
+    cache.log_stats()
+    cache.close()
+
+    # Merge the journal into the CSV once
+    records = pd.DataFrame(JsonlJournal.iter_records(journal_path))
+    if not records.empty:
+        records = records.drop_duplicates(subset=['row_key'], keep='last').set_index('row_key')
+        for col in ANSWER_COLS + ["full_caption"]:
+            captions = row_keys.map(records[col])
+            df[col] = captions.fillna(df[col]) if col in df else captions
+    temp_csv = f"{out_csv}.temp"
+    df.to_csv(temp_csv, index=False, encoding="utf-8-sig")
+    os.replace(temp_csv, out_csv)
+    os.remove(journal_path)
     logging.info(f"Done")
 
 if __name__ == "__main__":
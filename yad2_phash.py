@@ -0,0 +1,248 @@
+"""
+Perceptual-hash index for spotting reposted listings.
+Every listing image gets a 64-bit dHash, stored packed in SQLite and in an in-memory
+multi-index: the hash is split into four 16-bit chunks, and two hashes within distance d
+share at least one chunk within distance d // 4, so a lookup only probes a few buckets.
+"""
+import os
+import atexit
+import sqlite3
+import logging
+import threading
+from array import array
+from collections import defaultdict
+from datetime import datetime
+from itertools import combinations
+from io import BytesIO
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+PHASH_AVAILABLE = Image is not None
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+N_CHUNKS = 4
+CHUNK_BITS = 16
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+def dhash(image_bytes: bytes, hash_size: int = 8) -> int:
+    """
+    Difference hash: shrink to (hash_size + 1) x hash_size grayscale and compare neighbouring pixels
+    """
+    if Image is None:
+        raise ImportError("Pillow is required for perceptual hashing: pip install Pillow")
+    with Image.open(BytesIO(image_bytes)) as image:
+        pixels = list(image.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+def to_signed(value: int) -> int:
+    """
+    Store an unsigned 64-bit hash in an SQLite INTEGER
+    """
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+def to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+def chunk_neighbours(chunk: int, radius: int) -> List[int]:
+    """
+    Every 16-bit value within `radius` bits of chunk
+    """
+    neighbours = [chunk]
+    for n_bits in range(1, radius + 1):
+        for bits in combinations(range(CHUNK_BITS), n_bits):
+            flipped = chunk
+            for bit in bits:
+                flipped ^= 1 << bit
+            neighbours.append(flipped)
+    return neighbours
+
+class PHashIndex:
+    def __init__(self, db_path: str = 'images/phash.db', max_distance: int = 6):
+        self.db_path = db_path
+        self.max_distance = max_distance
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute('CREATE TABLE IF NOT EXISTS listing_hashes (product_id TEXT PRIMARY KEY, '
+                          'phash INTEGER NOT NULL, image_url TEXT, added_date TEXT)')
+        # One dHash per stored image file, so a reused image is never decoded twice
+        self.conn.execute('CREATE TABLE IF NOT EXISTS image_hashes (image_hash TEXT PRIMARY KEY, '
+                          'phash INTEGER NOT NULL) WITHOUT ROWID')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS duplicates (product_id TEXT PRIMARY KEY, '
+                          'duplicate_of TEXT NOT NULL, distance INTEGER NOT NULL, flagged_date TEXT)')
+        self.conn.commit()
+
+        # Packed hashes, parallel to product_ids, and one chunk -> positions table per chunk
+        self.hashes = array('Q')
+        self.product_ids: List[str] = []
+        self.positions: Dict[str, int] = {}
+        self.tables = [defaultdict(list) for _ in range(N_CHUNKS)]
+        for product_id, phash in self.conn.execute('SELECT product_id, phash FROM listing_hashes ORDER BY rowid'):
+            self._insert(product_id, to_unsigned(phash))
+        logging.info(f"Loaded {len(self.product_ids)} perceptual hashes from {db_path}")
+
+    def __len__(self) -> int:
+        return len(self.product_ids)
+
+    def _insert(self, product_id: str, phash: int):
+        position = len(self.product_ids)
+        self.hashes.append(phash)
+        self.product_ids.append(product_id)
+        self.positions[product_id] = position
+        for i in range(N_CHUNKS):
+            self.tables[i][(phash >> (i * CHUNK_BITS)) & CHUNK_MASK].append(position)
+
+    def query(self, phash: int, max_distance: int = None) -> List[Tuple[str, int]]:
+        """
+        All indexed listings within max_distance bits of phash, closest first
+        """
+        max_distance = self.max_distance if max_distance is None else max_distance
+        radius = max_distance // N_CHUNKS
+        seen = set()
+        matches = []
+        with self.lock:
+            for i in range(N_CHUNKS):
+                table = self.tables[i]
+                for chunk in chunk_neighbours((phash >> (i * CHUNK_BITS)) & CHUNK_MASK, radius):
+                    for position in table.get(chunk, ()):
+                        if position in seen:
+                            continue
+                        seen.add(position)
+                        distance = (self.hashes[position] ^ phash).bit_count()
+                        if distance <= max_distance:
+                            matches.append((self.product_ids[position], distance))
+        return sorted(matches, key=lambda match: match[1])
+
+    def add(self, product_id: str, phash: int, image_url: str = None) -> Optional[Tuple[str, int]]:
+        """
+        Index a listing's image hash and flag it if it looks like a repost of an earlier listing.
+        A listing that is already indexed, e.g. by another process, is checked again against the
+        listings indexed before it, so pairs indexed apart are still flagged
+        Returns the (product_id, distance) of the closest earlier listing, if any
+        """
+        product_id = str(product_id)
+        today = datetime.now().strftime('%Y-%m-%d')
+        with self.lock:
+            position = self.positions.get(product_id)
+            if position is not None:
+                duplicate = self.duplicate_of(product_id)
+                if duplicate:
+                    return duplicate
+                phash = self.hashes[position]
+            match = next((m for m in self.query(phash) if m[0] != product_id
+                          and (position is None or self.positions[m[0]] < position)), None)
+            if position is None:
+                self._insert(product_id, phash)
+            if position is None or match:
+                with self.conn:
+                    if position is None:
+                        self.conn.execute('INSERT OR IGNORE INTO listing_hashes VALUES (?, ?, ?, ?)',
+                                          (product_id, to_signed(phash), image_url, today))
+                    if match:
+                        self.conn.execute('INSERT OR IGNORE INTO duplicates VALUES (?, ?, ?, ?)',
+                                          (product_id, match[0], match[1], today))
+        if match:
+            logging.info(f"Listing {product_id} looks like a repost of {match[0]} (distance {match[1]})")
+        return match
+
+    def add_image(self, product_id: str, image_hash: str, path: str, image_url: str = None) -> Optional[Tuple[str, int]]:
+        """
+        Index a listing from its stored image file, decoding each distinct image only once
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT phash FROM image_hashes WHERE image_hash = ?', (image_hash,)).fetchone()
+        if row:
+            phash = to_unsigned(row[0])
+        else:
+            with open(path, 'rb') as f:
+                phash = dhash(f.read())
+            with self.lock, self.conn:
+                self.conn.execute('INSERT OR IGNORE INTO image_hashes VALUES (?, ?)', (image_hash, to_signed(phash)))
+        return self.add(product_id, phash, image_url)
+
+    def hash_of(self, product_id: str) -> Optional[int]:
+        with self.lock:
+            position = self.positions.get(str(product_id))
+            return self.hashes[position] if position is not None else None
+
+    def duplicate_of(self, product_id: str) -> Optional[Tuple[str, int]]:
+        with self.lock:
+            row = self.conn.execute('SELECT duplicate_of, distance FROM duplicates WHERE product_id = ?',
+                                    (str(product_id),)).fetchone()
+        return tuple(row) if row else None
+
+    def load_duplicates(self) -> pd.DataFrame:
+        """
+        Every flagged repost with the listing it duplicates
+        """
+        with self.lock:
+            return pd.read_sql_query('SELECT * FROM duplicates ORDER BY flagged_date, product_id', self.conn, dtype={
+                'product_id': str, 'duplicate_of': str})
+
+    def close(self):
+        self.conn.close()
+
+_shared_indexes: Dict[str, PHashIndex] = {}
+_shared_indexes_lock = threading.Lock()
+
+def get_shared_index(db_path: str = 'images/phash.db') -> PHashIndex:
+    """
+    One index per database in this process, so listings from every scraper and worker are
+    compared with each other. Closed at exit
+    """
+    db_path = os.path.abspath(db_path)
+    with _shared_indexes_lock:
+        if db_path not in _shared_indexes:
+            _shared_indexes[db_path] = PHashIndex(db_path)
+            atexit.register(_shared_indexes[db_path].close)
+        return _shared_indexes[db_path]
+
+def load_repost_ids(db_path: str = 'images/phash.db') -> set:
+    """
+    product_ids flagged as reposts, an empty set if nothing was indexed yet
+    """
+    if not os.path.exists(db_path):
+        return set()
+    conn = sqlite3.connect(db_path)
+    try:
+        return {row[0] for row in conn.execute('SELECT product_id FROM duplicates')}
+    except sqlite3.OperationalError:
+        return set()
+    finally:
+        conn.close()
+
+def main():
+    # Index every downloaded listing image that is not indexed yet and report the reposts
+    index = PHashIndex()
+    images = sqlite3.connect('images/index.db')
+    rows = images.execute('SELECT p.product_id, p.image_hash, MIN(u.path), MIN(u.image_url) FROM product_images p '
+                          'JOIN image_urls u USING (image_hash) GROUP BY p.product_id').fetchall()
+    images.close()
+    for product_id, image_hash, path, image_url in rows:
+        if product_id in index.positions:
+            continue
+        try:
+            index.add_image(product_id, image_hash, path, image_url)
+        except Exception as e:
+            logging.error(f"Error hashing image {path}: {e}")
+    logging.info(f"{len(index)} listings indexed, {len(index.load_duplicates())} flagged as reposts")
+    index.close()
+
+if __name__ == "__main__":
+    main()
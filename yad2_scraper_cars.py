@@ -1,20 +1,25 @@
 import requests
 from bs4 import BeautifulSoup
 import pandas as pd
-import time
 import json
-from typing import List, Dict
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Dict, Optional, Tuple
 import logging
-import uuid
 import os
 from urllib.parse import urlparse
+from yad2_cache import get_shared_cache
+from yad2_utils import (ImageDownloader, JsonlJournal, PolitenessScheduler, compact_journal_to_csv,
+                        get_shared_scheduler)
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 class Yad2Scraper:
-    def __init__(self, download_images: bool = False):
+    def __init__(self, download_images: bool = False, scheduler: PolitenessScheduler = None):
         self.base_url = "https://www.yad2.co.il/api/feed"
+        self.home_url = "https://www.yad2.co.il/"
+        self.search_url = "https://www.yad2.co.il/vehicles/cars"
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/136.0.0.0 Safari/537.36',
             'Accept': 'application/json, text/plain, */*',
@@ -36,6 +41,13 @@ class Yad2Scraper:
         # Create a session object
         self.session = requests.Session()
         self.session.headers.update(self.headers)
+        # Responses shared on disk with the other scrapers and the notebooks
+        self.cache = get_shared_cache()
+        # Content-addressed image store, started on first use
+        self.image_downloader = None
+        # Politeness is per request and per host, shared with the other scrapers by default
+        self.scheduler = scheduler or get_shared_scheduler()
+        self.cookies_warmed = False
 
     def debug_request(self, url, params=None):
         """
@@ -63,37 +75,20 @@ class Yad2Scraper:
 
     def download_image(self, image_url: str) -> str:
         """
-        Download an image and save it with a UUID filename
+        Download an image into the content-addressed image store and wait for it
         Returns the local path to the saved image
         """
-        try:
-            # Generate a unique filename with the original extension
-            file_extension = os.path.splitext(urlparse(image_url).path)[1]
-            if not file_extension:
-                file_extension = '.jpg'  # Default to jpg if no extension found
-            filename = f"{uuid.uuid4()}{file_extension}"
-            filepath = os.path.join(self.images_dir, filename)
-
-            # Download and save the image
-            response = requests.get(image_url, headers=self.headers)
-            response.raise_for_status()
-            
-            with open(filepath, 'wb') as f:
-                f.write(response.content)
-            
-            logging.info(f"Downloaded image: {filename}")
-            return filepath
-
-        except Exception as e:
-            logging.error(f"Error downloading image {image_url}: {e}")
-            return ""
+        if self.image_downloader is None:
+            self.image_downloader = ImageDownloader(self.images_dir, self.headers, scheduler=self.scheduler)
+        result = self.image_downloader.submit(None, image_url).result()
+        return result[1] if result else ""
 
     def get_listing_details(self, url: str) -> Dict:
         """
         Fetch and parse details from an individual listing page
         """
         try:
-            response = self.session.get(url)
+            response = self.cache.get(self.session, url, scheduler=self.scheduler)
             response.raise_for_status()
             soup = BeautifulSoup(response.text, 'html.parser')
             
@@ -120,15 +115,11 @@ class Yad2Scraper:
             logging.error(f"Error fetching listing details from {url}: {e}")
             return {}
 
-    def search_listings(self, category: str = "cars", manufacturer: str = None, 
-                       model: str = None, year: str = None, 
-                       min_price: int = None, max_price: int = None, 
-                       page: int = 1) -> List[Dict]:
+    def build_search_params(self, manufacturer: str = None, model: str = None, year: str = None,
+                            min_price: int = None, max_price: int = None, page: int = 1) -> Dict:
         """
-        Search for listings on Yad2 with given parameters
+        Build the query parameters of a search results page
         """
-        # Construct the URL with query parameters
-        url = f"https://www.yad2.co.il/vehicles/cars"
         params = {
             "manufacturer": manufacturer,
             "model": model,
@@ -142,98 +133,160 @@ class Yad2Scraper:
             min_price_str = str(min_price) if min_price is not None else "-1"
             max_price_str = str(max_price) if max_price is not None else "-1"
             params["price"] = f"{min_price_str}-{max_price_str}"
+        return params
 
-        try:
-            # First visit the main page to get cookies
-            self.session.get("https://www.yad2.co.il/")
-            time.sleep(0.5)  # Wait a bit before making the request
-            
-            # Make the request
-            response = self.session.get(url, params=params)
-            response.raise_for_status()
-            
-            # Parse the HTML
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Find all listing items
-            listings = []
-            for item in soup.find_all('div', class_='feed-item-base_feedItemBox__5WVY1'):
-                try:
-                    # Extract the link
-                    link_elem = item.find('a', class_='feed-item-base_itemLink__wBfEL')
-                    link = link_elem['href'] if link_elem else ''
-                    if link:
-                        # Clean the URL by removing query parameters
-                        parsed_url = urlparse(link)
-                        clean_link = f"{parsed_url.scheme}://{parsed_url.netloc}{parsed_url.path}"
-                        if not clean_link.startswith('http'):
-                            clean_link = f"https://www.yad2.co.il{clean_link}"
-                        link = clean_link
-                    
-                    # Extract the image URL
-                    img_elem = item.find('img', class_='single-image_image__Iv6T9')
-                    image_url = ''
-                    if img_elem and 'srcset' in img_elem.attrs:
-                        # Get the highest resolution image from srcset
-                        srcset = img_elem['srcset']
-                        image_url = srcset.split(',')[-1].strip().split(' ')[0]
-                    
-                    # Extract title and model details
-                    title_elem = item.find('span', class_='feed-item-info_heading__k5pVC')
-                    model_elem = item.find('span', class_='feed-item-info_marketingText__eNE4R')
-                    year_elem = item.find('span', class_='feed-item-info_yearAndHandBox___JLbc')
-                    
-                    # Extract agency and price
-                    agency_elem = item.find('span', class_='commercial-item-left-side_agencyName__psfbp')
-                    price_elem = item.find('span', class_='price_price__xQt90')
-                    monthly_payment_elem = item.find('span', class_='monthly-payment_monthlyPaymentBox__9nxfH')
-                    
-                    # Download the image
-                    if self.download_images:
-                        image_path = self.download_image(image_url) if image_url else ''
-                        time.sleep(0.3)  # Small delay between image downloads
-                    else:
-                        image_path = image_url
-                    
-                    # Get additional details from the listing page
-                    # listing_details = self.get_listing_details(link) if link else {}
-                    
-                    listing = {
-                        'title': title_elem.text.strip() if title_elem else '',
-                        'model_details': model_elem.text.strip() if model_elem else '',
-                        'year': year_elem.text.strip() if year_elem else '',
-                        'agency': agency_elem.text.strip() if agency_elem else '',
-                        'price': price_elem.text.strip() if price_elem else '',
-                        'monthly_payment': monthly_payment_elem.text.strip() if monthly_payment_elem else '',
-                        'link': link,
-                        'image_path': image_path,
-                        # 'description': listing_details.get('description', ''),
-                        # 'kilometers': listing_details.get('קילומטראז׳', ''),
-                        # 'color': listing_details.get('צבע', ''),
-                        # 'current_ownership': listing_details.get('בעלות נוכחית', ''),
-                        # 'test_until': listing_details.get('טסט עד', ''),
-                        # 'previous_ownership': listing_details.get('בעלות קודמת', ''),
-                        # 'transmission': listing_details.get('תיבת הילוכים', ''),
-                        # 'road_date': listing_details.get('תאריך עליה לכביש', ''),
-                        # 'engine_type': listing_details.get('סוג מנוע', ''),
-                        # 'body_type': listing_details.get('מרכב', ''),
-                        # 'seats': listing_details.get('מושבים', ''),
-                        # 'horsepower': listing_details.get('כוח סוס', ''),
-                        # 'engine_volume': listing_details.get('נפח מנוע', ''),
-                        # 'fuel_consumption': listing_details.get('צריכת דלק משולבת', '')
-                    }
-                    listings.append(listing)
-                    time.sleep(0.5)  # Small delay between listing requests
-                    
-                except Exception as e:
-                    logging.error(f"Error parsing listing: {e}")
-                    continue
+    def polite_get(self, url: str, **kwargs) -> requests.Response:
+        """
+        GET with the session in the host's politeness slot
+        """
+        return self.scheduler.get(self.session, url, **kwargs)
 
-            return listings
+    def warm_cookies(self):
+        """
+        Visit the main page once per session to get cookies
+        """
+        if not self.cookies_warmed:
+            self.polite_get(self.home_url)
+            self.cookies_warmed = True
 
+    def fetch_search_page(self, params: Dict) -> Optional[str]:
+        """
+        Fetch one search results page, None on errors
+        """
+        try:
+            self.warm_cookies()
+            response = self.polite_get(self.search_url, params=params)
+            response.raise_for_status()
+            return response.text
         except requests.exceptions.RequestException as e:
             logging.error(f"Error fetching data: {e}")
-            return []
+            return None
+
+    def parse_search_page(self, html: str) -> List[Dict]:
+        """
+        Parse the listings of a search results page
+        """
+        soup = BeautifulSoup(html, 'html.parser')
+        
+        # Find all listing items
+        listings = []
+        for item in soup.find_all('div', class_='feed-item-base_feedItemBox__5WVY1'):
+            try:
+                # Extract the link
+                link_elem = item.find('a', class_='feed-item-base_itemLink__wBfEL')
+                link = link_elem['href'] if link_elem else ''
+                if link:
+                    # Clean the URL by removing query parameters
+                    parsed_url = urlparse(link)
+                    clean_link = f"{parsed_url.scheme}://{parsed_url.netloc}{parsed_url.path}"
+                    if not clean_link.startswith('http'):
+                        clean_link = f"https://www.yad2.co.il{clean_link}"
+                    link = clean_link
+                
+                # Extract the image URL
+                img_elem = item.find('img', class_='single-image_image__Iv6T9')
+                image_url = ''
+                if img_elem and 'srcset' in img_elem.attrs:
+                    # Get the highest resolution image from srcset
+                    srcset = img_elem['srcset']
+                    image_url = srcset.split(',')[-1].strip().split(' ')[0]
+                
+                # Extract title and model details
+                title_elem = item.find('span', class_='feed-item-info_heading__k5pVC')
+                model_elem = item.find('span', class_='feed-item-info_marketingText__eNE4R')
+                year_elem = item.find('span', class_='feed-item-info_yearAndHandBox___JLbc')
+                
+                # Extract agency and price
+                agency_elem = item.find('span', class_='commercial-item-left-side_agencyName__psfbp')
+                price_elem = item.find('span', class_='price_price__xQt90')
+                monthly_payment_elem = item.find('span', class_='monthly-payment_monthlyPaymentBox__9nxfH')
+                
+                # Download the image
+                if self.download_images:
+                    image_path = self.download_image(image_url) if image_url else ''
+                else:
+                    image_path = image_url
+                
+                # Get additional details from the listing page
+                # listing_details = self.get_listing_details(link) if link else {}
+                
+                listing = {
+                    'title': title_elem.text.strip() if title_elem else '',
+                    'model_details': model_elem.text.strip() if model_elem else '',
+                    'year': year_elem.text.strip() if year_elem else '',
+                    'agency': agency_elem.text.strip() if agency_elem else '',
+                    'price': price_elem.text.strip() if price_elem else '',
+                    'monthly_payment': monthly_payment_elem.text.strip() if monthly_payment_elem else '',
+                    'link': link,
+                    'image_path': image_path,
+                    # 'description': listing_details.get('description', ''),
+                    # 'kilometers': listing_details.get('קילומטראז׳', ''),
+                    # 'color': listing_details.get('צבע', ''),
+                    # 'current_ownership': listing_details.get('בעלות נוכחית', ''),
+                    # 'test_until': listing_details.get('טסט עד', ''),
+                    # 'previous_ownership': listing_details.get('בעלות קודמת', ''),
+                    # 'transmission': listing_details.get('תיבת הילוכים', ''),
+                    # 'road_date': listing_details.get('תאריך עליה לכביש', ''),
+                    # 'engine_type': listing_details.get('סוג מנוע', ''),
+                    # 'body_type': listing_details.get('מרכב', ''),
+                    # 'seats': listing_details.get('מושבים', ''),
+                    # 'horsepower': listing_details.get('כוח סוס', ''),
+                    # 'engine_volume': listing_details.get('נפח מנוע', ''),
+                    # 'fuel_consumption': listing_details.get('צריכת דלק משולבת', '')
+                }
+                listings.append(listing)
+                
+            except Exception as e:
+                logging.error(f"Error parsing listing: {e}")
+                continue
+
+        return listings
+
+    def search_listings(self, category: str = "cars", manufacturer: str = None, 
+                       model: str = None, year: str = None, 
+                       min_price: int = None, max_price: int = None, 
+                       page: int = 1) -> List[Dict]:
+        """
+        Search for listings on Yad2 with given parameters
+        """
+        html = self.fetch_search_page(self.build_search_params(manufacturer, model, year, min_price, max_price, page))
+        return self.parse_search_page(html) if html else []
+
+    def crawl(self, manufacturer: str = None, model: str = None, year: str = None,
+              min_price: int = None, max_price: int = None, start_page: int = 1,
+              prefetch: int = 2) -> Iterator[Tuple[int, List[Dict]]]:
+        """
+        Yield (page, listings) in order until the first empty page, keeping `prefetch` pages
+        in flight while the current page is parsed (0 fetches one page at a time)
+        """
+        self.warm_cookies()
+        with ThreadPoolExecutor(max_workers=max(prefetch, 1)) as pool:
+            window = deque()
+            next_page = start_page
+
+            def fetch_next():
+                nonlocal next_page
+                params = self.build_search_params(manufacturer, model, year, min_price, max_price, next_page)
+                window.append((next_page, pool.submit(self.fetch_search_page, params)))
+                next_page += 1
+
+            for _ in range(max(prefetch, 1)):
+                fetch_next()
+            while window:
+                page, future = window.popleft()
+                if prefetch:
+                    fetch_next()
+                html = future.result()
+                listings = self.parse_search_page(html) if html else []
+                # If no listings found, we've reached the end
+                if not listings:
+                    logging.info(f"No more listings found on page {page}. Stopping pagination.")
+                    for _, pending in window:
+                        pending.cancel()
+                    return
+                if not prefetch:
+                    fetch_next()
+                yield page, listings
 
     def save_to_csv(self, listings: List[Dict], filename: str = "yad2_listings.csv"):
         """
@@ -264,6 +317,36 @@ class Yad2Scraper:
                 os.remove(temp_filename)
             raise
 
+    def stream_to_csv(self, pages: Iterator[Tuple[int, List[Dict]]], filename: str = "yad2_listings.csv") -> int:
+        """
+        Append each page's listings to a partial JSONL checkpoint as it arrives, so memory and
+        the per-page write cost stay constant, then compact it into the CSV once with an atomic replace
+        Returns the number of listings saved
+        """
+        partial_filename = f"{filename}.partial.jsonl"
+        # A checkpoint left by a crashed crawl holds the pages it got, like its CSV used to,
+        # so it becomes the CSV before the new crawl starts a new checkpoint
+        if os.path.exists(partial_filename):
+            logging.warning(f"Recovering the listings of an interrupted crawl from {partial_filename}")
+            compact_journal_to_csv(partial_filename, filename, merge_existing=False)
+        journal = JsonlJournal(partial_filename)
+        n_listings = 0
+        try:
+            for page, listings in pages:
+                journal.append_many(listings)
+                n_listings += len(listings)
+                logging.info(f"Saved checkpoint of page {page} ({n_listings} listings) to {partial_filename}")
+        finally:
+            journal.close()
+
+        if not n_listings:
+            logging.warning("No listings to save")
+            os.remove(partial_filename)
+            return 0
+        compact_journal_to_csv(partial_filename, filename, merge_existing=False)
+        logging.info(f"Saved {n_listings} listings to {filename}")
+        return n_listings
+
 def main():
     scraper = Yad2Scraper()
     
@@ -277,38 +360,21 @@ def main():
         "max_price": None     # Maximum price
     }
 
-    # Get listings from all available pages
-    all_listings = []
-    page = 1
+    # Get listings from all available pages, prefetching the next pages while parsing,
+    # and stream every page to the checkpoint as it arrives
     output_file = "yad2_listings.csv"
-    
-    while True:
-        logging.info(f"Fetching page {page}")
-        listings = scraper.search_listings(
-            category=search_params["category"],
-            manufacturer=search_params["manufacturer"],
-            model=search_params["model"],
-            year=search_params["year"],
-            min_price=search_params["min_price"],
-            max_price=search_params["max_price"],
-            page=page
-        )
-        
-        # If no listings found, we've reached the end
-        if not listings:
-            logging.info(f"No more listings found on page {page}. Stopping pagination.")
-            break
-            
-        all_listings.extend(listings)
-        
-        # Save checkpoint after each page
-        scraper.save_to_csv(all_listings, output_file)
-        logging.info(f"Saved checkpoint to {output_file}")
-        
-        page += 1
-        time.sleep(1)  # Be nice to the server
+    n_listings = scraper.stream_to_csv(scraper.crawl(
+        manufacturer=search_params["manufacturer"],
+        model=search_params["model"],
+        year=search_params["year"],
+        min_price=search_params["min_price"],
+        max_price=search_params["max_price"],
+    ), output_file)
+
+    if scraper.image_downloader is not None:
+        scraper.image_downloader.close()
 
-    logging.info(f"Total listings found: {len(all_listings)}")
+    logging.info(f"Total listings found: {n_listings}")
     logging.info(f"Final results saved to {output_file}")
 
 if __name__ == "__main__":
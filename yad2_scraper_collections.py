@@ -1,9 +1,10 @@
 import time
 import logging
-from bs4 import BeautifulSoup
-from typing import List, Dict, Set
-from yad2_utils import Yad2BaseScraper
+from typing import List, Dict, Optional, Set, Tuple
+from yad2_utils import CAPTCHA_CLASS, Yad2BaseScraper
+from yad2_card_parsers import BUSINESS_TAG_CLASS, CARD_CLASS, LINK_CLASS, extract_card_fields, extract_cards_in_browser, get_card_parser, parse_cards_embedded
 from yad2_categories import COLLECTIONS
+from yad2_store import ListingStore, migrate_csv, store_path_for
 from urllib.parse import urlencode
 from selenium import webdriver
 from selenium.webdriver.common.by import By
@@ -13,26 +14,307 @@ from selenium.webdriver.chrome.options import Options
 from selenium.common.exceptions import TimeoutException
 import pandas as pd
 import os
+import json
+import sys
+import heapq
+import queue
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from tqdm import tqdm
 
+try:
+    import psutil
+except ImportError:
+    psutil = None  # Browser memory is not tracked without psutil
+
+def merge_listings(df_existing: pd.DataFrame, listings: List[Dict]) -> pd.DataFrame:
+    """
+    Upsert a batch of parsed listings into the existing listings, keyed on product_id.
+    Known ids get their last_seen_date and current_price updated, new ids are
+    appended with their first_seen_date. Runs as a single vectorized pass.
+    """
+    if not listings:
+        return df_existing
+
+    df_new = pd.DataFrame(listings)
+    df_new['product_id'] = df_new['product_id'].astype(str)
+    df_new = df_new.drop_duplicates(subset=['product_id'], keep='last')
+
+    if df_existing is None or df_existing.empty:
+        return df_new.reset_index(drop=True)
+
+    existing_ids = df_existing['product_id'].astype(str)
+    new_by_id = df_new.set_index('product_id')
+
+    # Update known listings in bulk
+    known = existing_ids.isin(new_by_id.index)
+    if known.any():
+        known_ids = existing_ids[known]
+        df_existing.loc[known, 'last_seen_date'] = known_ids.map(new_by_id['last_seen_date'])
+        df_existing.loc[known, 'current_price'] = known_ids.map(new_by_id['current_price'])
+        # A listing that shows up again is live
+        if 'closing_date' in df_existing.columns:
+            df_existing.loc[known, 'closing_date'] = None
+
+    # Insert listings we have never seen before
+    df_inserted = df_new[~df_new['product_id'].isin(existing_ids)]
+    logging.info(f"Merged {int(known.sum())} known listings and {len(df_inserted)} new listings")
+    if df_inserted.empty:
+        return df_existing
+    return pd.concat([df_existing, df_inserted], ignore_index=True)
+
+CARD_SELECTOR = f"article.{CARD_CLASS}"
+
+# Returns [number of product cards, whether the end-of-feed marker is present]
+FEED_STATE_JS = """
+const cards = document.querySelectorAll(arguments[0]).length;
+const ended = arguments[1] ? document.querySelector(arguments[1]) !== null : false;
+return [cards, ended];
+"""
+
+# Returns the product IDs of the cards in feed order, skipping new business listings
+FEED_IDS_JS = """
+return Array.from(document.querySelectorAll(arguments[0]))
+    .filter(card => !card.querySelector(arguments[2]))
+    .map(card => {
+        const link = card.querySelector(arguments[1]);
+        return link ? (link.getAttribute('href') || '').split('/').pop() : '';
+    });
+"""
+
+# Per output file crawl bookkeeping, e.g. the date of the last full sweep
+CRAWL_STATE_FILE = "yad2_crawl_state.json"
+crawl_state_lock = threading.Lock()
+
+def load_crawl_state() -> Dict:
+    """
+    Load the crawl state of all output files
+    """
+    if not os.path.exists(CRAWL_STATE_FILE):
+        return {}
+    try:
+        with open(CRAWL_STATE_FILE, encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logging.error(f"Error loading crawl state: {e}")
+        return {}
+
+def update_crawl_state(output_file: str, **values):
+    """
+    Update the crawl state of one output file, safe to call from several workers
+    """
+    with crawl_state_lock:
+        state = load_crawl_state()
+        state.setdefault(output_file, {}).update(values)
+        temp_filename = f"{CRAWL_STATE_FILE}.temp"
+        with open(temp_filename, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(temp_filename, CRAWL_STATE_FILE)
+
+# Queries that kept hitting CAPTCHAs, for solving by hand, and CAPTCHA frequency per category
+QUARANTINE_FILE = "yad2_captcha_quarantine.json"
+CAPTCHA_STATS_FILE = "yad2_captcha_stats.json"
+captcha_files_lock = threading.Lock()
+
+def load_json_file(path: str, default):
+    if not os.path.exists(path):
+        return default
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logging.error(f"Error loading {path}: {e}")
+        return default
+
+def write_json_file(path: str, data):
+    temp_filename = f"{path}.temp"
+    with open(temp_filename, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(temp_filename, path)
+
+def record_captcha_stats(category_key: str, blocked: bool):
+    """
+    Count a crawl of a category and whether it hit a CAPTCHA, safe to call from several workers
+    """
+    with captcha_files_lock:
+        stats = load_json_file(CAPTCHA_STATS_FILE, {})
+        category = stats.setdefault(category_key, {'crawls': 0, 'captchas': 0, 'last_captcha': None})
+        category['crawls'] += 1
+        if blocked:
+            category['captchas'] += 1
+            category['last_captcha'] = datetime.now().strftime('%Y-%m-%d %H:%M')
+        write_json_file(CAPTCHA_STATS_FILE, stats)
+
+def log_captcha_stats(category_keys: List[str] = None):
+    """
+    Log the CAPTCHA rate of each category, to tune crawl rates
+    """
+    for category_key, category in sorted(load_json_file(CAPTCHA_STATS_FILE, {}).items()):
+        if category_keys is None or category_key in category_keys:
+            logging.info(f"CAPTCHA rate for {category_key}: {category['captchas']}/{category['crawls']} crawls "
+                         f"({category['captchas'] / max(category['crawls'], 1):.0%}), "
+                         f"last on {category['last_captcha'] or 'never'}")
+
+class CaptchaQuarantine:
+    """
+    Queries parked after a CAPTCHA, retried with exponential backoff while the other queries go on
+    (5, 10, then 20 minutes by default). Queries still blocked after max_attempts retries are
+    written to QUARANTINE_FILE for solving by hand
+    """
+    def __init__(self, base_delay: float = 300.0, max_attempts: int = 3, path: str = QUARANTINE_FILE):
+        self.base_delay = base_delay
+        self.max_attempts = max_attempts
+        self.path = path
+        self.parked = []  # Heap of (retry_at, order, attempts, queries)
+        self.order = itertools.count()
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.parked)
+
+    def park(self, queries: List[Dict], attempts: int):
+        """
+        Park queries that hit a CAPTCHA on their attempts-th try
+        """
+        category_key = queries[0].get('category_key')
+        if attempts > self.max_attempts:
+            logging.warning(f"{category_key} hit a CAPTCHA {attempts} times, saving it to {self.path} to solve by hand")
+            self.surface(queries, attempts)
+            return
+        delay = self.base_delay * 2 ** (attempts - 1)
+        logging.warning(f"{category_key} hit a CAPTCHA, retrying in {delay:.0f}s")
+        with self.lock:
+            heapq.heappush(self.parked, (time.time() + delay, next(self.order), attempts, queries))
+
+    def pop_ready(self) -> Optional[Tuple[List[Dict], int]]:
+        """
+        The next parked queries whose backoff is over, with their attempt count
+        """
+        with self.lock:
+            if self.parked and self.parked[0][0] <= time.time():
+                _, _, attempts, queries = heapq.heappop(self.parked)
+                return queries, attempts
+        return None
+
+    def next_retry_in(self) -> Optional[float]:
+        """
+        Seconds until the next parked queries are due, None if nothing is parked
+        """
+        with self.lock:
+            return max(0.0, self.parked[0][0] - time.time()) if self.parked else None
+
+    def surface(self, queries: List[Dict], attempts: int):
+        with captcha_files_lock:
+            quarantined = load_json_file(self.path, [])
+            parked_date = datetime.now().strftime('%Y-%m-%d %H:%M')
+            quarantined.extend({**query, 'attempts': attempts, 'parked_date': parked_date} for query in queries)
+            write_json_file(self.path, quarantined)
+
+# Lean browsing profile: Chrome content settings (2 = block) and URL patterns blocked over CDP
+LEAN_CHROME_PREFS = {
+    'profile.managed_default_content_settings.images': 2,
+    'profile.managed_default_content_settings.media_stream': 2,
+    'profile.managed_default_content_settings.notifications': 2,
+}
+LEAN_BLOCKED_URLS = [
+    # Images and media
+    '*.jpg*', '*.jpeg*', '*.png*', '*.gif*', '*.webp*', '*.avif*', '*.svg*', '*.ico*',
+    '*.mp4*', '*.webm*', '*.mp3*', '*.m3u8*',
+    # Fonts
+    '*.woff*', '*.woff2*', '*.ttf*', '*.otf*', '*.eot*',
+    # Third-party analytics and ads
+    '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*', '*googlesyndication.com*',
+    '*facebook.net*', '*connect.facebook.com*', '*hotjar.com*', '*clarity.ms*', '*tiktok.com*',
+    '*taboola.com*', '*outbrain.com*', '*criteo.com*',
+]
+
+def mark_closed_listings(df_existing: pd.DataFrame, seen_ids: Set[str], closing_date: str,
+                         first_seen_after: str = None):
+    """
+    Set closing_date on active listings whose product_id was not seen, as one set difference.
+    With first_seen_after, only listings first seen after that date are considered
+    Returns the updated DataFrame and the number of listings closed
+    """
+    if df_existing is None or df_existing.empty:
+        return df_existing, 0
+    if 'closing_date' not in df_existing.columns:
+        df_existing['closing_date'] = None
+
+    active = df_existing['closing_date'].isna() | (df_existing['closing_date'] == '')
+    closed = active & ~df_existing['product_id'].astype(str).isin(seen_ids)
+    if first_seen_after is not None:
+        closed &= df_existing['first_seen_date'] > first_seen_after
+    df_existing.loc[closed, 'closing_date'] = closing_date
+    return df_existing, int(closed.sum())
+
 class Yad2CollectionsScraper(Yad2BaseScraper):
-    def __init__(self, download_images: bool = False, headless: bool = True):
+    def __init__(self, download_images: bool = False, headless: bool = True, parser_backend: str = 'auto',
+                 scroll_mode: str = 'event', feed_end_selector: str = None,
+                 stop_after_known: int = None, full_sweep_days: int = 7, lean: bool = False,
+                 fetch_mode: str = 'selenium', max_http_pages: int = 50,
+                 storage: str = 'csv', export_csv: bool = False, profile_dir: str = None,
+                 recycle_after_pages: int = 50, max_browser_rss_mb: float = 1500, solve_captchas: bool = False,
+                 detect_reposts: bool = False):
         super().__init__(download_images)
+        # Hash every listing's image for repost detection, even when images are not kept
+        self.detect_reposts = detect_reposts
         self.base_url = "https://www.yad2.co.il/market/collections"
         self.headless = headless
+        # Parser backend for the feed ('auto', 'lxml' or 'bs4' parse the HTML, 'js' extracts in the browser)
+        self.parser_backend = parser_backend
+        self.parse_cards = get_card_parser(parser_backend) if parser_backend != 'js' else None
         
-        # Set up Chrome options
-        self.chrome_options = Options()
-        if headless:
-            self.chrome_options.add_argument('--headless')
-        self.chrome_options.add_argument('--no-sandbox')
-        self.chrome_options.add_argument('--disable-dev-shm-usage')
-        self.chrome_options.add_argument(f'user-agent={self.headers["User-Agent"]}')
+        # Infinite scroll: 'event' waits on the card count in the DOM, 'sleep' uses fixed sleeps
+        self.scroll_mode = scroll_mode
+        self.feed_end_selector = feed_end_selector  # CSS selector of the end-of-feed marker, if known
+        self.scroll_latencies: List[float] = []  # Seconds until new cards appeared, per successful scroll
+        self.scroll_step_times: List[float] = []  # Seconds spent per scroll step in the current search
         
-        # Initialize the Chrome driver
-        self.driver = webdriver.Chrome(options=self.chrome_options)
-        self.wait = WebDriverWait(self.driver, 10)
+        # Incremental crawl: stop scrolling after this many consecutive known product IDs (None crawls the whole feed)
+        self.stop_after_known = stop_after_known
+        self.full_sweep_days = full_sweep_days  # Do a full sweep at least this often to refresh last_seen_date
+        self.incremental = False
+        self.crawl_reached_known = False  # Whether the current crawl stopped on a run of known listings
+        self.feed_ended = False  # Whether scrolling reached the end-of-feed marker or stopped loading cards
+        # Whether the current crawl stopped before the end of the feed (page cap or an error),
+        # listings below that point were not seen and must not be closed
+        self.crawl_truncated = False
+        
+        # Lean profile: block images, media, fonts and trackers, we only read text and img src attributes
+        self.lean = lean
+        self.query_metrics: List[Dict] = []  # Bytes transferred and page load time per query
+        
+        # Fetching: 'selenium' always renders in the browser, 'auto' tries the embedded page data over
+        # HTTP and falls back to Selenium when blocked, 'http' never starts Chrome. The embedded data
+        # shape is only checked against a recorded page (tests/test_embedded_data.py), so it is opt-in
+        self.fetch_mode = fetch_mode
+        self.max_http_pages = max_http_pages
+        
+        # Storage: 'csv' rewrites the yad2_collections_*.csv file, 'sqlite' upserts into a .db next to it
+        self.storage = storage
+        self.export_csv = export_csv  # Also write the CSV from the SQLite store after every category
+        self.store = None
+        
+        # Driver lifecycle: a persistent Chrome profile keeps cookies and caches between runs, and the
+        # driver is recycled after recycle_after_pages page loads or once Chrome uses max_browser_rss_mb
+        self.profile_dir = os.path.abspath(profile_dir) if profile_dir else None
+        self.recycle_after_pages = recycle_after_pages
+        self.max_browser_rss_mb = max_browser_rss_mb
+        self.driver_metrics: List[Dict] = []  # Startup time, warm profile, pages and peak RSS per driver
+        self.load_cookies_into_session()
+        
+        # Set up Chrome options, the Chrome driver is started on first use
+        self.chrome_options = self.build_chrome_options(headless)
+        self._driver = None
+        self.wait = None
+        
+        # CAPTCHAs: by default the query gives up and is parked for a retry, solve_captchas opens a
+        # visible browser and waits for the CAPTCHA to be solved by hand (interactive runs only)
+        self.solve_captchas = solve_captchas
+        self.captcha_blocked = False  # Whether the last query gave up on a CAPTCHA
         
         # For tracking listings
         self.existing_ids: Set[str] = set()  # Set of product IDs seen in current scrape
@@ -43,15 +325,239 @@ class Yad2CollectionsScraper(Yad2BaseScraper):
         """
         Clean up the driver when the object is destroyed
         """
-        if hasattr(self, 'driver'):
-            self.driver.quit()
+        self.close()
+
+    @property
+    def driver(self) -> webdriver.Chrome:
+        """
+        The Chrome driver, started lazily so HTTP-only runs never launch Chrome
+        """
+        if self._driver is None:
+            self._driver = self.start_driver()
+            self.wait = WebDriverWait(self._driver, 10)
+        return self._driver
+
+    @driver.setter
+    def driver(self, driver: webdriver.Chrome):
+        self._driver = driver
+
+    def close(self):
+        """
+        Quit the Chrome driver, close the store and finish image downloads, safe to call more than once
+        """
+        if getattr(self, '_image_downloader', None) is not None:
+            self.close_image_downloader()
+        if getattr(self, 'store', None) is not None:
+            self.store.close()
+            self.store = None
+        if getattr(self, '_driver', None) is not None:
+            self.quit_driver()
+
+    def build_chrome_options(self, headless: bool) -> Options:
+        """
+        Build the Chrome options, with the lean profile prefs if enabled
+        """
+        chrome_options = Options()
+        if headless:
+            chrome_options.add_argument('--headless')
+        chrome_options.add_argument('--no-sandbox')
+        chrome_options.add_argument('--disable-dev-shm-usage')
+        chrome_options.add_argument(f'user-agent={self.headers["User-Agent"]}')
+        if self.profile_dir:
+            chrome_options.add_argument(f'--user-data-dir={self.profile_dir}')
+        # Network events in the performance log let us count the bytes transferred per query
+        chrome_options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+        if self.lean:
+            chrome_options.add_experimental_option('prefs', LEAN_CHROME_PREFS)
+        return chrome_options
+
+    def start_driver(self) -> webdriver.Chrome:
+        """
+        Start a Chrome driver with the current options, blocking heavy resources in lean mode
+        and restoring the cookies saved by the last driver
+        """
+        warm = bool(self.profile_dir) and os.path.isdir(os.path.join(self.profile_dir, 'Default'))
+        start = time.time()
+        driver = webdriver.Chrome(options=self.chrome_options)
+        if self.lean:
+            try:
+                driver.execute_cdp_cmd('Network.enable', {})
+                driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': LEAN_BLOCKED_URLS})
+            except Exception as e:
+                logging.error(f"Error setting up resource blocking: {e}")
+        cookies = self.read_saved_cookies()
+        if cookies:
+            # Session cookies are not kept in the profile, set them all before the first page load
+            try:
+                driver.execute_cdp_cmd('Network.setCookies', {'cookies': [
+                    {key: value for key, value in {
+                        'name': cookie['name'], 'value': cookie['value'], 'domain': cookie.get('domain'),
+                        'path': cookie.get('path'), 'secure': cookie.get('secure'),
+                        'httpOnly': cookie.get('httpOnly'), 'expires': cookie.get('expiry'),
+                    }.items() if value is not None} for cookie in cookies]})
+            except Exception as e:
+                logging.error(f"Error restoring cookies: {e}")
+        startup_time = time.time() - start
+        self.driver_metrics.append({'startup_time': startup_time, 'warm': warm, 'pages': 0, 'peak_rss_mb': 0.0})
+        logging.info(f"Started Chrome in {startup_time:.2f}s ({'warm' if warm else 'cold'} profile)")
+        return driver
+
+    def quit_driver(self):
+        """
+        Save the cookies and quit the Chrome driver, the next page load starts a fresh one
+        """
+        self.save_cookies()
+        self.track_browser_memory()
+        try:
+            self._driver.quit()
+        except Exception as e:
+            logging.error(f"Error quitting driver: {e}")
+        self._driver = None
+        self.wait = None
+        if self.driver_metrics:
+            metrics = self.driver_metrics[-1]
+            logging.info(f"Chrome served {metrics['pages']} pages, peak RSS {metrics['peak_rss_mb']:.0f} MB")
+
+    def browser_rss_mb(self) -> float:
+        """
+        Resident memory of chromedriver and every Chrome process it started, 0 without psutil
+        """
+        if psutil is None or self._driver is None:
+            return 0.0
+        try:
+            root = psutil.Process(self._driver.service.process.pid)
+            processes = [root] + root.children(recursive=True)
+        except (psutil.Error, AttributeError):
+            return 0.0
+        total = 0
+        for process in processes:
+            try:
+                total += process.memory_info().rss
+            except psutil.Error:
+                pass  # Renderers come and go
+        return total / 1024 / 1024
+
+    def track_browser_memory(self) -> float:
+        """
+        Sample the browser's RSS into the current driver's peak
+        """
+        rss = self.browser_rss_mb()
+        if self.driver_metrics:
+            self.driver_metrics[-1]['peak_rss_mb'] = max(self.driver_metrics[-1]['peak_rss_mb'], rss)
+        return rss
+
+    def recycle_driver_if_needed(self):
+        """
+        Quit the driver after recycle_after_pages page loads or once Chrome grows past max_browser_rss_mb
+        """
+        if self._driver is None or not self.driver_metrics:
+            return
+        pages = self.driver_metrics[-1]['pages']
+        rss = self.track_browser_memory()
+        if self.recycle_after_pages and pages >= self.recycle_after_pages:
+            reason = f"{pages} pages"
+        elif self.max_browser_rss_mb and rss > self.max_browser_rss_mb:
+            reason = f"{rss:.0f} MB RSS"
+        else:
+            return
+        logging.info(f"Recycling Chrome after {reason}")
+        self.quit_driver()
+
+    def driver_summary(self) -> Dict:
+        """
+        Cold and warm Chrome startup times and peak browser memory over every driver so far
+        """
+        cold = [m['startup_time'] for m in self.driver_metrics if not m['warm']]
+        warm = [m['startup_time'] for m in self.driver_metrics if m['warm']]
+        return {
+            'cold_starts': len(cold), 'cold_start_time': sum(cold) / len(cold) if cold else None,
+            'warm_starts': len(warm), 'warm_start_time': sum(warm) / len(warm) if warm else None,
+            'peak_rss_mb': max((m['peak_rss_mb'] for m in self.driver_metrics), default=0.0),
+        }
+
+    @property
+    def cookies_path(self) -> Optional[str]:
+        return os.path.join(self.profile_dir, 'yad2_cookies.json') if self.profile_dir else None
+
+    def read_saved_cookies(self) -> List[Dict]:
+        if not self.cookies_path or not os.path.exists(self.cookies_path):
+            return []
+        try:
+            with open(self.cookies_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"Error reading cookies from {self.cookies_path}: {e}")
+            return []
+
+    def save_cookies(self):
+        """
+        Save the browser's cookies in the profile, for the next driver and the HTTP session
+        """
+        if not self.cookies_path or self._driver is None:
+            return
+        try:
+            cookies = self._driver.get_cookies()
+        except Exception as e:
+            logging.error(f"Error reading cookies from the browser: {e}")
+            return
+        if not cookies:
+            return
+        os.makedirs(self.profile_dir, exist_ok=True)
+        temp_path = f"{self.cookies_path}.temp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(cookies, f)
+        os.replace(temp_path, self.cookies_path)
+        self.load_cookies_into_session()
+
+    def load_cookies_into_session(self):
+        """
+        Give the HTTP session the browser's saved cookies, so embedded data fetches look like the same visitor
+        """
+        for cookie in self.read_saved_cookies():
+            self.session.cookies.set(cookie['name'], cookie['value'], domain=cookie.get('domain', ''),
+                                     path=cookie.get('path', '/'))
+
+    def load_page(self, url: str) -> Tuple[float, bool]:
+        """
+        Load a page in the browser in the host's politeness slot
+        Returns the page load time and whether the page is a CAPTCHA
+        """
+        self.scheduler.wait(url)
+        load_start = time.time()
+        self.driver.get(url)
+        page_load_time = time.time() - load_start
+        self.driver_metrics[-1]['pages'] += 1
+        
+        # Check for CAPTCHA, slowing every scraper down if we got one
+        captcha = self.detect_captcha()
+        self.scheduler.record(url, latency=page_load_time, blocked=captcha, request_class='browser')
+        return page_load_time, captcha
+
+    def collect_network_bytes(self) -> int:
+        """
+        Sum the bytes received since the last call, from the Chrome performance log
+        """
+        total = 0
+        try:
+            for entry in self.driver.get_log('performance'):
+                message = json.loads(entry['message'])['message']
+                if message.get('method') == 'Network.loadingFinished':
+                    total += int(message['params'].get('encodedDataLength', 0))
+        except Exception as e:
+            logging.error(f"Error reading network log: {e}")
+        return total
 
     def load_existing_product_ids(self, output_file: str):
         """
-        Load existing product IDs from the CSV file if it exists
+        Load existing product IDs from the CSV file or the SQLite store if it exists
         """
         self.output_file = output_file
-        if os.path.exists(output_file):
+        if self.storage == 'sqlite':
+            self.open_store(output_file)
+            self.existing_ids = self.store.load_product_ids()
+            self.df_existing = None
+            logging.info(f"Loaded {len(self.existing_ids)} listings from {self.store.db_path}")
+        elif os.path.exists(output_file):
             try:
                 df = pd.read_csv(output_file, dtype=str)
                 self.df_existing = df
@@ -67,7 +573,39 @@ class Yad2CollectionsScraper(Yad2BaseScraper):
             self.existing_ids = set()
             self.df_existing = None
 
-    def get_collection_name(self, url: str) -> str:
+    def open_store(self, output_file: str):
+        """
+        Open the SQLite store for an output file, migrating its CSV on first use
+        """
+        if self.store is not None:
+            self.store.close()
+        db_path = store_path_for(output_file)
+        if not os.path.exists(db_path) and os.path.exists(output_file):
+            self.store = migrate_csv(output_file, db_path)
+        else:
+            self.store = ListingStore(db_path)
+
+    def merge_batch(self, listings: List[Dict]):
+        """
+        Merge a batch of scraped listings into the in-memory listings (CSV storage only,
+        the SQLite store upserts the batch when it is saved)
+        """
+        if self.storage == 'csv':
+            self.df_existing = merge_listings(self.df_existing, listings)
+
+    def save_listings(self, listings: List[Dict], output_file: str):
+        """
+        Save the scraped listings with the configured storage backend
+        """
+        if self.storage == 'sqlite':
+            self.store.upsert_listings(listings)
+            if self.export_csv:
+                self.store.export_csv(output_file)
+        else:
+            self.save_to_csv(listings, output_file)
+
+    @staticmethod
+    def get_collection_name(url: str) -> str:
         """
         Extract collection name from URL
         """
@@ -79,83 +617,72 @@ class Yad2CollectionsScraper(Yad2BaseScraper):
             logging.error(f"Error extracting collection name from {url}: {e}")
             return "unknown_collection"
 
-    # def update_listing_status(self, current_listings: Set[str]):
-    #     """
-    #     Update the status of listings in the CSV file
-    #     """
-    #     if self.df_existing is not None:
-    #         # Find listings that were active but not seen in current scrape
-    #         closed_listings = self.active_listings - current_listings
-            
-    #         if closed_listings:
-    #             # Update closing date for closed listings
-    #             mask = (self.df_existing['product_id'].astype(str).isin(closed_listings)) & \
-    #                    (self.df_existing['closing_date'].isna())
-    #             self.df_existing.loc[mask, 'closing_date'] = datetime.now().strftime('%Y-%m-%d')
-    #             self.df_existing.to_csv(self.output_file, index=False, encoding='utf-8-sig')
-    #             logging.info(f"Marked {len(closed_listings)} listings as closed")
-            
-    #         # Update active listings set
-    #         self.active_listings = self.active_listings - closed_listings
+    def get_crawl_boundary(self, listings: List[Dict]) -> Optional[str]:
+        """
+        For an incremental crawl that stopped at known listings, the newest first_seen_date
+        among the known listings it stopped on. Listings first seen after that date sit above
+        the stopping point in the newest-first feed, so the crawl must have seen them if live.
+        Returns None when the whole feed was crawled
+        """
+        if not (self.incremental and self.crawl_reached_known):
+            return None
+        tail_ids = [listing['product_id'] for listing in listings[-self.stop_after_known:]
+                    if listing['product_id'] in self.existing_ids]
+        if self.storage == 'sqlite':
+            return self.store.max_first_seen_date(tail_ids)
+        known = self.df_existing['product_id'].astype(str).isin(tail_ids)
+        return self.df_existing.loc[known, 'first_seen_date'].max() if known.any() else None
+
+    def update_listing_status(self, listings: List[Dict]):
+        """
+        Mark active listings that were not seen in this crawl as closed, in one vectorized pass.
+        Incremental crawls only close listings above the point where the crawl stopped
+        """
+        seen_ids = {str(listing['product_id']) for listing in listings}
+        boundary = self.get_crawl_boundary(listings)
+        if self.incremental and self.crawl_reached_known and boundary is None:
+            logging.info("Could not place the incremental crawl in the feed, skipping closed listing detection")
+            return
+        closing_date = datetime.now().strftime('%Y-%m-%d')
+        if self.storage == 'sqlite':
+            n_closed = self.store.mark_closed(seen_ids, closing_date, boundary)
+        else:
+            self.df_existing, n_closed = mark_closed_listings(self.df_existing, seen_ids, closing_date, boundary)
+        logging.info(f"Marked {n_closed} listings as closed"
+                     + (f" (first seen after {boundary})" if boundary else ""))
 
     def parse_product_card(self, card) -> Dict:
         """
-        Parse a single product card and extract relevant information
+        Parse a single BeautifulSoup product card and extract relevant information
         """
         try:
-            # Skip if it's a new business listing
-            if card.find('div', class_='item-image_newBusinessTag__zI6xW'):
-                return {}
-
-            # Get product URL and ID from the link
-            link = card.find('a', class_='item-grid_imageContainer__U2drL')
-            product_url = f"https://www.yad2.co.il{link.get('href', '')}" if link else ''
-            product_id = product_url.split('/')[-1] if product_url else ''
-
-            # Get image URL
-            img_elem = card.find('img', class_='shopify-image_image__KPxpT')
-            image_url = img_elem.get('src', '') if img_elem else ''
-
-            # Get price information
-            price_elem = card.find('p', class_='item-price_price__HMXoj')
-            current_price = price_elem.text.strip().replace('₪', '') if price_elem else ''
-
-            # Get location
-            location_elem = card.find('p', class_='item-location_location__E96ST')
-            location = location_elem.text.strip() if location_elem else ''
-
-            # Get title
-            title_elem = card.find('h2', class_='item-title_title__2tG20')
-            title = title_elem.text.strip() if title_elem else ''
-
-            # Get tags/condition
-            tags_container = card.find('div', class_='item-tags_tags__GdgQO')
-            tags = [tag.text.strip() for tag in tags_container.find_all('p', class_='tag_tag__Zaq8_')] if tags_container else []
-
-            # Download image if enabled
-            if self.download_images and image_url:
-                image_path = self.download_image(image_url)
-                time.sleep(0.3)  # Small delay between image downloads
-
-            current_date = datetime.now().strftime('%Y-%m-%d')
-            
-            return {
-                'product_id': product_id,
-                'title': title,
-                'current_price': current_price,
-                'location': location,
-                'image_url': image_url,
-                'product_url': product_url,
-                'tags': ', '.join(tags),
-                'first_seen_date': current_date,
-                'last_seen_date': current_date,
-                'closing_date': None
-            }
-
+            return self.build_listing(extract_card_fields(card))
         except Exception as e:
             logging.error(f"Error parsing product card: {e}")
             return {}
 
+    def build_listing(self, fields: Dict) -> Dict:
+        """
+        Turn the raw fields of a product card into a listing row
+        """
+        if not fields:
+            return {}
+
+        # Queue the image download or repost check if enabled, card parsing never waits on it
+        if self.download_images and fields['image_url']:
+            self.queue_image_download(fields['product_id'], fields['image_url'])
+        elif self.detect_reposts and fields['image_url']:
+            self.queue_image_hash(fields['product_id'], fields['image_url'])
+
+        current_date = datetime.now().strftime('%Y-%m-%d')
+        
+        return {
+            **fields,
+            'first_seen_date': current_date,
+            'last_seen_date': current_date,
+            'closing_date': None
+        }
+
     def wait_for_products(self, timeout: int = 10) -> bool:
         """
         Wait for products to load and return True if products are found
@@ -178,11 +705,15 @@ class Yad2CollectionsScraper(Yad2BaseScraper):
         Scroll to the bottom of the page to load more content via infinite scroll
         Returns True if new content was loaded, False otherwise
         """
+        if self.scroll_mode == 'event':
+            return self.scroll_until_new_cards(max_scrolls)
+
         try:
             # Get initial number of products
-            initial_products = len(self.driver.find_elements(By.CSS_SELECTOR, "article.item-grid_grid__P3tKb"))
+            initial_products = len(self.driver.find_elements(By.CSS_SELECTOR, CARD_SELECTOR))
             
             for scroll_attempt in range(max_scrolls):
+                step_start = time.time()
                 # Scroll to the bottom of the page
                 self.driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
                 
@@ -190,27 +721,133 @@ class Yad2CollectionsScraper(Yad2BaseScraper):
                 time.sleep(2)
                 
                 # Check if new products were loaded
-                current_products = len(self.driver.find_elements(By.CSS_SELECTOR, "article.item-grid_grid__P3tKb"))
+                current_products = len(self.driver.find_elements(By.CSS_SELECTOR, CARD_SELECTOR))
                 if current_products == initial_products:
                     time.sleep(3
                     )
-                    current_products = len(self.driver.find_elements(By.CSS_SELECTOR, "article.item-grid_grid__P3tKb"))
+                    current_products = len(self.driver.find_elements(By.CSS_SELECTOR, CARD_SELECTOR))
+                self.scroll_step_times.append(time.time() - step_start)
                 if current_products > initial_products:
                     logging.info(f"Loaded {current_products - initial_products} more products via scrolling")
                     return True
                     
+            # Every scroll came back without new cards, so the feed is exhausted
+            self.feed_ended = True
             return False
         except Exception as e:
             logging.error(f"Error during scrolling: {e}")
             return False
 
+    def get_scroll_timeout(self, min_timeout: float = 1.0, max_timeout: float = 5.0) -> float:
+        """
+        Adaptive scroll timeout learned from the latencies seen so far:
+        three times the 90th percentile of recent loads, clamped to [min_timeout, max_timeout]
+        """
+        if not self.scroll_latencies:
+            return max_timeout
+        recent = sorted(self.scroll_latencies[-20:])
+        p90 = recent[int(0.9 * (len(recent) - 1))]
+        return min(max(3 * p90, min_timeout), max_timeout)
+
+    def scroll_until_new_cards(self, max_scrolls: int = 3) -> bool:
+        """
+        Scroll and wait on the DOM instead of sleeping: returns as soon as new cards
+        appear, the end-of-feed marker shows, or the adaptive timeout runs out
+        Returns True if new content was loaded, False otherwise
+        """
+        def feed_state():
+            return self.driver.execute_script(FEED_STATE_JS, CARD_SELECTOR, self.feed_end_selector)
+
+        try:
+            initial_products, feed_ended = feed_state()
+            if feed_ended:
+                self.feed_ended = True
+                return False
+            
+            for scroll_attempt in range(max_scrolls):
+                step_start = time.time()
+                self.driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+                
+                # Poll the card count until it grows or the feed ends
+                state = [initial_products, False]
+                def feed_changed(driver):
+                    state[:] = feed_state()
+                    return state[0] > initial_products or state[1]
+                try:
+                    WebDriverWait(self.driver, self.get_scroll_timeout(), poll_frequency=0.1).until(feed_changed)
+                except TimeoutException:
+                    pass
+                
+                step_time = time.time() - step_start
+                self.scroll_step_times.append(step_time)
+                current_products, feed_ended = state
+                if current_products > initial_products:
+                    self.scroll_latencies.append(step_time)
+                    logging.info(f"Loaded {current_products - initial_products} more products via scrolling "
+                                 f"in {step_time:.2f}s")
+                    return True
+                if feed_ended:
+                    logging.info("Reached the end of the feed")
+                    self.feed_ended = True
+                    return False
+                    
+            # Every scroll came back without new cards, so the feed is exhausted
+            logging.info(f"No new products after {max_scrolls} scrolls, reached the end of the feed")
+            self.feed_ended = True
+            return False
+        except Exception as e:
+            logging.error(f"Error during scrolling: {e}")
+            return False
+
+    def get_feed_product_ids(self) -> List[str]:
+        """
+        Get the product IDs currently in the feed, in feed order, skipping new business listings
+        """
+        return self.driver.execute_script(FEED_IDS_JS, CARD_SELECTOR, f"a.{LINK_CLASS}", f"div.{BUSINESS_TAG_CLASS}")
+
+    def reached_known_listings(self) -> bool:
+        """
+        In incremental mode, check if the feed shows a run of stop_after_known consecutive known product IDs.
+        The feed is sorted by newest, so everything below that run was already crawled before
+        """
+        if not self.incremental:
+            return False
+        try:
+            return self.has_known_run(self.get_feed_product_ids())
+        except Exception as e:
+            logging.error(f"Error reading feed product IDs: {e}")
+        return False
+
+    def has_known_run(self, product_ids: List[str]) -> bool:
+        """
+        Check if product_ids, in feed order, contain stop_after_known consecutive known IDs
+        """
+        run = 0
+        for product_id in product_ids:
+            run = run + 1 if product_id in self.existing_ids else 0
+            if run >= self.stop_after_known:
+                logging.info(f"Reached {run} consecutive known listings, stopping the crawl")
+                self.crawl_reached_known = True
+                return True
+        return False
+
+    def full_sweep_due(self, output_file: str) -> bool:
+        """
+        Check if the last full sweep of this output file is older than full_sweep_days
+        """
+        last_full_sweep = load_crawl_state().get(output_file, {}).get('last_full_sweep')
+        if not last_full_sweep:
+            return True
+        days_since = (datetime.now() - datetime.strptime(last_full_sweep, '%Y-%m-%d')).days
+        return days_since >= self.full_sweep_days
+
     def detect_captcha(self) -> bool:
         """
         Detect if a CAPTCHA is present on the page
         """
         try:
             # Look for the specific CAPTCHA wrapper
-            if self.driver.find_elements(By.CSS_SELECTOR, "div.captcha-wrapper"):
+            if self.driver.find_elements(By.CSS_SELECTOR, f"div.{CAPTCHA_CLASS}"):
                 return True
                     
             return False
@@ -218,24 +855,30 @@ class Yad2CollectionsScraper(Yad2BaseScraper):
             logging.error(f"Error detecting CAPTCHA: {e}")
             return False
 
-    def restart_driver_without_headless(self):
+    def solve_captcha(self) -> bool:
+        """
+        Let the CAPTCHA be solved by hand in a visible browser
+        Returns whether it was solved
+        """
+        if self.headless:
+            return self.restart_driver_without_headless()
+        return self.wait_for_captcha_solved()
+
+    def restart_driver_without_headless(self) -> bool:
         """
         Restart the driver in non-headless mode for CAPTCHA solving
+        Returns whether the CAPTCHA was solved
         """
         try:
             logging.info("CAPTCHA detected! Restarting browser in visible mode...")
             current_url = self.driver.current_url
             
             # Close the current driver
-            self.driver.quit()
+            self.quit_driver()
             
             # Restart without headless
-            self.chrome_options = Options()
-            self.chrome_options.add_argument('--no-sandbox')
-            self.chrome_options.add_argument('--disable-dev-shm-usage')
-            self.chrome_options.add_argument(f'user-agent={self.headers["User-Agent"]}')
-            
-            self.driver = webdriver.Chrome(options=self.chrome_options)
+            self.chrome_options = self.build_chrome_options(headless=False)
+            self.driver = self.start_driver()
             self.wait = WebDriverWait(self.driver, 10)
             
             # Navigate back to the current URL
@@ -246,14 +889,16 @@ class Yad2CollectionsScraper(Yad2BaseScraper):
             logging.info("Waiting for CAPTCHA to be solved...")
             
             # Wait for CAPTCHA to be solved (captcha-wrapper to disappear)
-            self.wait_for_captcha_solved()
+            return self.wait_for_captcha_solved()
             
         except Exception as e:
             logging.error(f"Error restarting driver: {e}")
+            return False
 
-    def wait_for_captcha_solved(self, timeout: int = 300):
+    def wait_for_captcha_solved(self, timeout: int = 300) -> bool:
         """
         Wait for the CAPTCHA to be solved by monitoring when captcha-wrapper disappears
+        Returns whether it was solved within the timeout, never blocks on input
         """
         try:
             # Create a longer wait for CAPTCHA solving (5 minutes max)
@@ -261,19 +906,17 @@ class Yad2CollectionsScraper(Yad2BaseScraper):
             
             # Wait for the captcha-wrapper to disappear
             captcha_wait.until_not(
-                EC.presence_of_element_located((By.CSS_SELECTOR, "div.captcha-wrapper"))
+                EC.presence_of_element_located((By.CSS_SELECTOR, f"div.{CAPTCHA_CLASS}"))
             )
             
             logging.info("CAPTCHA solved! Continuing with scraping...")
+            return True
             
         except TimeoutException:
-            logging.warning(f"CAPTCHA not solved within {timeout} seconds. You may need to solve it manually.")
-            logging.info("Press Enter to continue anyway...")
-            input("Waiting for manual confirmation...")
+            logging.warning(f"CAPTCHA not solved within {timeout} seconds")
         except Exception as e:
             logging.error(f"Error waiting for CAPTCHA to be solved: {e}")
-            logging.info("Press Enter to continue...")
-            input("Waiting for manual confirmation...")
+        return False
 
     def search_collection(self, collection_url: str, page: int = 1, filters: Dict = None) -> List[Dict]:
         """
@@ -297,48 +940,74 @@ class Yad2CollectionsScraper(Yad2BaseScraper):
             params['sortOption'] = 'newest'
             
             url = f"{collection_url}?{urlencode(params)}"
+            self.crawl_reached_known = False
+            self.feed_ended = False
+            self.crawl_truncated = False
             
-            # Load the page with Selenium
-            self.driver.get(url)
+            # Try the embedded page data over plain HTTP first, Chrome is only needed when that fails
+            if self.fetch_mode != 'selenium':
+                listings = self.search_collection_http(collection_url, params)
+                if listings is not None:
+                    self.merge_batch(listings)
+                    return listings, False
+                if self.fetch_mode == 'http':
+                    return [], True
+                logging.info("Embedded data unavailable, falling back to Selenium")
             
-            # Check for CAPTCHA
-            if self.detect_captcha() and self.headless:
-                self.restart_driver_without_headless()
+            # Load the page with Selenium
+            self.collect_network_bytes()  # Drop network events from earlier queries
+            page_load_time, captcha = self.load_page(url)
+            if captcha and not (self.solve_captchas and self.solve_captcha()):
+                logging.warning(f"CAPTCHA on {url}, giving up on this query for now")
+                self.captcha_blocked = True
+                return [], True
             
             # Wait for products to load
             if not self.wait_for_products():
                 return [], True
 
-            # If this is page 1, try scrolling to load more content
-            if self.scroll_to_load_more(max_scrolls=2):
-                while self.scroll_to_load_more(max_scrolls=2):
-                    pass
-
-            # Get the page source after JavaScript has loaded the content
-            soup = BeautifulSoup(self.driver.page_source, 'html.parser')
+            # If this is page 1, try scrolling to load more content,
+            # incremental crawls stop once they reach listings we already know
+            self.scroll_step_times = []
+            scroll_start = time.time()
+            while not self.reached_known_listings() and self.scroll_to_load_more(max_scrolls=2):
+                pass
+            self.crawl_truncated = not (self.crawl_reached_known or self.feed_ended)
+            if self.crawl_truncated:
+                logging.warning("Scrolling stopped before the end of the feed, skipping closed listing detection")
+            self.track_browser_memory()
+            if self.scroll_step_times:
+                logging.info(f"Scrolling took {time.time() - scroll_start:.1f}s over {len(self.scroll_step_times)} steps "
+                             f"({sum(self.scroll_step_times) / len(self.scroll_step_times):.2f}s per step, "
+                             f"{self.scroll_mode} mode)")
             
-            # Find all product cards
-            product_cards = soup.find_all('article', class_='item-grid_grid__P3tKb')
+            # Report bandwidth and latency for this query
+            bytes_transferred = self.collect_network_bytes()
+            self.query_metrics.append({'url': url, 'bytes_transferred': bytes_transferred,
+                                       'page_load_time': page_load_time, 'lean': self.lean})
+            logging.info(f"Page loaded in {page_load_time:.2f}s, {bytes_transferred / 1024 / 1024:.1f} MB transferred "
+                         f"({'lean' if self.lean else 'full'} profile)")
+
+            # Parse all product cards after JavaScript has loaded the content
+            if self.parser_backend == 'js':
+                cards = extract_cards_in_browser(self.driver)
+            else:
+                cards = self.parse_cards(self.driver.page_source)
             
-            # Parse each product card with progress bar
+            # Build a listing for each product card with progress bar
             listings = []
-            current_listings = set()
-            if len(product_cards) == 0:
+            if len(cards) == 0:
                 logging.info(f"No products found on page {page}")
                 return [], True
             
-            for card in tqdm(product_cards, desc=f"Processing page {page}", leave=False):
-                listing = self.parse_product_card(card)
+            for fields in tqdm(cards, desc=f"Processing page {page}", leave=False):
+                listing = self.build_listing(fields)
                 if listing:
-                    product_id = listing.get('product_id')
-                    # Update last_seen_date for existing listings
-                    if self.df_existing is not None:
-                        mask = self.df_existing['product_id'].astype(str) == str(product_id)
-                        if mask.any():
-                            self.df_existing.loc[mask, 'last_seen_date'] = listing['last_seen_date']
-                            self.df_existing.loc[mask, 'current_price'] = listing['current_price']
-                    else:
-                        listings.append(listing)
+                    listings.append(listing)
+
+            # Merge the whole batch into the existing listings in one pass
+            self.merge_batch(listings)
+            self.recycle_driver_if_needed()
             
             return listings, False
 
@@ -346,26 +1015,62 @@ class Yad2CollectionsScraper(Yad2BaseScraper):
             logging.error(f"Error searching collection {collection_url}: {e}")
             return [], True
 
-    def scrape_category(self, category_key: str, filters: Dict = None) -> None:
+    def search_collection_http(self, collection_url: str, params: Dict) -> Optional[List[Dict]]:
+        """
+        Fetch the collection pages with the pooled session and read the listings from
+        their embedded data, one request per page instead of a browser render
+        Returns None when blocked or when the pages carry no usable data,
+        sets crawl_truncated when the max_http_pages cap cut the feed short
+        """
+        listings = []
+        seen_ids = set()
+        for page_number in range(1, self.max_http_pages + 1):
+            page_params = dict(params)
+            if page_number > 1:
+                page_params['pageNumber'] = page_number
+            
+            data = self.fetch_embedded_data(collection_url, page_params)
+            if data is None:
+                return None
+            
+            cards = [fields for fields in parse_cards_embedded(data) if fields['product_id'] not in seen_ids]
+            if not cards:
+                if page_number == 1:
+                    return None
+                self.feed_ended = True
+                break
+            
+            for fields in cards:
+                seen_ids.add(fields['product_id'])
+                listing = self.build_listing(fields)
+                if listing:
+                    listings.append(listing)
+            logging.info(f"Fetched {len(cards)} listings over HTTP from page {page_number}")
+            
+            if self.incremental and self.has_known_run([listing['product_id'] for listing in listings]):
+                self.crawl_reached_known = True
+                break
+        else:
+            logging.warning(f"Stopped at the {self.max_http_pages} page cap before the end of the feed, "
+                            f"skipping closed listing detection")
+            self.crawl_truncated = True
+        
+        return listings
+
+    def scrape_category(self, category_key: str, filters: Dict = None) -> int:
         """
         Scrape all products from a specific category with optional filters
+        Returns the number of listings found
         """
         if category_key not in COLLECTIONS:
             logging.error(f"Category {category_key} not found in COLLECTIONS")
-            return
+            return 0
 
         category = COLLECTIONS[category_key]
         collection_url = category['url']
-        collection_name = self.get_collection_name(collection_url)
 
         applied_filters = {k:v for k,v in filters.items() if v is not None}
-        
-        # Add filters to filename if present
-        if filters:
-            filter_str = '_'.join(f"{k}_{v}" for k, v in applied_filters.items())
-            output_file = f"yad2_collections_{collection_name}_{filter_str}.csv"
-        else:
-            output_file = f"yad2_collections_{collection_name}.csv"
+        output_file = get_output_file(category_key, filters)
         
         logging.info(f"Starting to scrape category: {category['name']}")
         if applied_filters:
@@ -374,7 +1079,12 @@ class Yad2CollectionsScraper(Yad2BaseScraper):
         # Load existing product IDs
         self.load_existing_product_ids(output_file)
         
+        # Only crawl the new listings at the top of the feed, unless a full sweep is due
+        self.incremental = bool(self.stop_after_known and self.existing_ids) and not self.full_sweep_due(output_file)
+        logging.info(f"Crawl mode: {'incremental' if self.incremental else 'full sweep'}")
+        
         # Get listings from all available pages
+        self.captcha_blocked = False
         all_listings = []
         page = 1
         stop_scraping = False
@@ -388,10 +1098,19 @@ class Yad2CollectionsScraper(Yad2BaseScraper):
                 #     break
                     
         all_listings.extend(listings)
+        record_captcha_stats(category_key, self.captcha_blocked)
+        if self.captcha_blocked:
+            return 0
+        
+        # Close listings that disappeared from the feed, only when the crawl completed
+        if not stop_scraping and not self.crawl_truncated and all_listings:
+            self.update_listing_status(all_listings)
                 
         # Save checkpoint after each page
-        self.save_to_csv(all_listings, output_file)
+        self.save_listings(all_listings, output_file)
         logging.info(f"Saved checkpoint to {output_file}")
+        if not self.incremental and not stop_scraping and not self.crawl_truncated:
+            update_crawl_state(output_file, last_full_sweep=datetime.now().strftime('%Y-%m-%d'))
                 
                 # page += 1
                 # pbar.update(1)
@@ -399,35 +1118,45 @@ class Yad2CollectionsScraper(Yad2BaseScraper):
 
         logging.info(f"Total listings found for {category['name']}: {len(all_listings)}")
         logging.info(f"Final results saved to {output_file}")
+        return len(all_listings)
 
     def save_to_csv(self, listings: List[Dict], output_file: str):
         """
         Save listings to CSV file, preserving existing data
         """
         try:
-            df_new = pd.DataFrame(listings)
+            # search_collection already merged the batch into df_existing
+            df_combined = self.df_existing if self.df_existing is not None else pd.DataFrame(listings)
+            if df_combined.empty:
+                logging.warning("No listings to save")
+                return
             
-            if os.path.exists(output_file):
-                # Read existing data
-                
-                # Combine existing and new data
-                df_combined = pd.concat([self.df_existing, df_new], ignore_index=True)
-                
-                # Remove duplicates based on product_id and last_seen_date
-                df_combined = df_combined.drop_duplicates(subset=['product_id', 'last_seen_date'], keep='last')
-                
-                # Sort by last_seen_date and product_id
-                df_combined = df_combined.sort_values(['last_seen_date', 'product_id'], ascending=[False, True])
-                
-                df_combined.to_csv(output_file, index=False, encoding='utf-8-sig')
-                logging.info(f"Updated {output_file} with {len(listings)} new listings")
+            # Sort by last_seen_date and product_id
+            df_combined = df_combined.sort_values(['last_seen_date', 'product_id'], ascending=[False, True])
+            
+            existed = os.path.exists(output_file)
+            df_combined.to_csv(output_file, index=False, encoding='utf-8-sig')
+            if existed:
+                logging.info(f"Updated {output_file} with {len(listings)} scraped listings")
             else:
-                df_new.to_csv(output_file, index=False, encoding='utf-8-sig')
-                logging.info(f"Created new file {output_file} with {len(listings)} listings")
+                logging.info(f"Created new file {output_file} with {len(df_combined)} listings")
                 
         except Exception as e:
             logging.error(f"Error saving to CSV: {e}")
 
+def get_output_file(category_key: str, filters: Dict = None) -> str:
+    """
+    Build the CSV filename for a category and its filters
+    """
+    collection_name = Yad2CollectionsScraper.get_collection_name(COLLECTIONS[category_key]['url'])
+    applied_filters = {k:v for k,v in (filters or {}).items() if v is not None}
+    
+    # Add filters to filename if present
+    if filters:
+        filter_str = '_'.join(f"{k}_{v}" for k, v in applied_filters.items())
+        return f"yad2_collections_{collection_name}_{filter_str}.csv"
+    return f"yad2_collections_{collection_name}.csv"
+
 def process_queries(scraper, queries):
     """
     Process multiple scraping queries with their respective filters
@@ -441,11 +1170,139 @@ def process_queries(scraper, queries):
             logging.info(f"With filters: {filters}")
             
         scraper.scrape_category(category_key, filters)
-        time.sleep(2)  # Be nice between categories
+
+def process_queries_parallel(queries, num_workers: int = 2, profiles_dir: str = 'chrome_profiles',
+                             quarantine: CaptchaQuarantine = None, **scraper_kwargs) -> List[Dict]:
+    """
+    Spread queries across a pool of workers, each with its own Chrome driver and its own
+    persistent profile under profiles_dir (None starts every driver with an empty profile).
+    Queries writing to the same output file go to the same worker, so every
+    output file is only ever written by one worker.
+    A query that hits a CAPTCHA is parked in the quarantine with the rest of its group and
+    retried later, while the workers go on with the other queries.
+    Returns throughput, CAPTCHA and Chrome startup/memory stats per worker
+    """
+    quarantine = quarantine if quarantine is not None else CaptchaQuarantine()
+    # Group queries by output file so workers never share a file
+    groups: Dict[str, List[Dict]] = {}
+    for query in queries:
+        category_key = query.get('category_key')
+        if category_key not in COLLECTIONS:
+            logging.error(f"Category {category_key} not found in COLLECTIONS")
+            continue
+        groups.setdefault(get_output_file(category_key, query.get('filters', {})), []).append(query)
+
+    work_queue = queue.Queue()
+    for group in groups.values():
+        work_queue.put(group)
+    num_workers = max(1, min(num_workers, len(groups)))
+
+    def worker(worker_id: int) -> Dict:
+        stats = {'worker_id': worker_id, 'queries': 0, 'listings': 0, 'captchas': 0, 'elapsed': 0.0}
+        start = time.time()
+        kwargs = dict(scraper_kwargs)
+        if profiles_dir:
+            kwargs.setdefault('profile_dir', os.path.join(profiles_dir, f'worker-{worker_id}'))
+        scraper = Yad2CollectionsScraper(**kwargs)
+        try:
+            while True:
+                # New queries first, then parked ones once their backoff is over
+                try:
+                    group, attempts = work_queue.get_nowait(), 0
+                except queue.Empty:
+                    parked = quarantine.pop_ready()
+                    if parked is None:
+                        retry_in = quarantine.next_retry_in()
+                        if retry_in is None:
+                            break
+                        time.sleep(min(retry_in, 10))
+                        continue
+                    group, attempts = parked
+                for i, query in enumerate(group):
+                    category_key = query.get('category_key')
+                    logging.info(f"[worker {worker_id}] Processing category: {category_key}")
+                    try:
+                        stats['listings'] += scraper.scrape_category(category_key, query.get('filters', {}))
+                    except Exception as e:
+                        logging.error(f"[worker {worker_id}] Error processing {category_key}: {e}")
+                    stats['queries'] += 1
+                    if scraper.captcha_blocked:
+                        # Park the rest of the group and go on with a fresh browser
+                        stats['captchas'] += 1
+                        quarantine.park(group[i:], attempts + 1)
+                        if scraper._driver is not None:
+                            scraper.quit_driver()
+                        break
+        finally:
+            scraper.close()
+            stats['elapsed'] = time.time() - start
+            stats.update(scraper.driver_summary())
+        return stats
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        all_stats = list(executor.map(worker, range(num_workers)))
+
+    for stats in all_stats:
+        rate = stats['listings'] / stats['elapsed'] if stats['elapsed'] else 0.0
+        stats['listings_per_sec'] = rate
+        logging.info(f"[worker {stats['worker_id']}] {stats['queries']} queries, {stats['listings']} listings, "
+                     f"{stats['captchas']} CAPTCHAs in {stats['elapsed']:.1f}s ({rate:.2f} listings/s)")
+        if stats['cold_starts'] or stats['warm_starts']:
+            start_times = [f"{stats[f'{kind}_starts']} {kind} in {stats[f'{kind}_start_time']:.2f}s"
+                           for kind in ('cold', 'warm') if stats[f'{kind}_starts']]
+            logging.info(f"[worker {stats['worker_id']}] Chrome starts: {', '.join(start_times)} on average, "
+                         f"peak RSS {stats['peak_rss_mb']:.0f} MB")
+    log_captcha_stats(sorted({query.get('category_key') for group in groups.values() for query in group}))
+    return all_stats
+
+def remove_quarantined_query(path: str, entry: Dict):
+    """
+    Drop one solved entry from the quarantine file, removing the file once it is empty
+    """
+    with captcha_files_lock:
+        quarantined = load_json_file(path, [])
+        if entry in quarantined:
+            quarantined.remove(entry)
+        if quarantined:
+            write_json_file(path, quarantined)
+        elif os.path.exists(path):
+            os.remove(path)
+
+def solve_quarantined_queries(path: str = QUARANTINE_FILE, profile_dir: str = os.path.join('chrome_profiles', 'solver'),
+                              **scraper_kwargs):
+    """
+    Run the quarantined queries in a visible browser, waiting for each CAPTCHA to be solved by hand.
+    The browser gets its own profile, so it never fights a running crawl for a worker's profile lock.
+    Each query leaves the quarantine file only once it ran through, so an interrupted session loses nothing
+    """
+    with captcha_files_lock:
+        quarantined = load_json_file(path, [])
+    if not quarantined:
+        logging.info(f"No quarantined queries in {path}")
+        return
+    logging.info(f"Solving {len(quarantined)} quarantined queries")
+    scraper = Yad2CollectionsScraper(**{'headless': False, 'solve_captchas': True, 'profile_dir': profile_dir,
+                                        **scraper_kwargs})
+    try:
+        for entry in quarantined:
+            category_key = entry['category_key']
+            logging.info(f"Processing quarantined category: {category_key}")
+            try:
+                scraper.scrape_category(category_key, entry.get('filters', {}))
+            except Exception as e:
+                logging.error(f"Error processing {category_key}: {e}, it stays in {path}")
+                continue
+            if scraper.captcha_blocked:
+                logging.warning(f"{category_key} is still blocked, it stays in {path}")
+                continue
+            remove_quarantined_query(path, entry)
+    finally:
+        scraper.close()
+    log_captcha_stats(sorted({entry['category_key'] for entry in quarantined}))
 
 def main():
-    # Start in headless mode for speed, but will switch to visible mode if CAPTCHA is detected
-    scraper = Yad2CollectionsScraper(download_images=False, headless=True)
+    # Number of parallel Chrome drivers, each worker handles its own output files
+    num_workers = 2
     
     # Example queries with different filters
     queries = [
@@ -480,7 +1337,18 @@ def main():
         }
     ]
     
-    process_queries(scraper, queries)
+    # Queries that hit a CAPTCHA are retried later and saved to the quarantine file if they keep
+    # hitting it, solve them by hand with `python yad2_scraper_collections.py solve-captchas`
+    if sys.argv[1:] == ['solve-captchas']:
+        solve_quarantined_queries(storage='sqlite', detect_reposts=True)
+        return
+    
+    # Start in headless mode for speed
+    # Incremental crawls stop after 30 consecutive known listings, with a full sweep every 7 days
+    # Listings are kept in SQLite stores, migrated from the existing CSV files on first run
+    # Images are not kept, but every new listing's image is hashed so the deep dive can skip reposts
+    process_queries_parallel(queries, num_workers=num_workers, download_images=False, detect_reposts=True,
+                             headless=True, stop_after_known=30, full_sweep_days=7, storage='sqlite')
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,258 @@
+"""
+SQLite storage backend for Yad2 collection listings.
+One database per query, next to where its yad2_collections_*.csv file used to live,
+with product_id as the primary key so each run only writes the day's delta.
+Price changes are kept in an append-only price_history log next to the listings.
+"""
+import os
+import re
+import glob
+import sqlite3
+import logging
+import pandas as pd
+from typing import List, Dict, Optional, Set, Tuple
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+LISTING_COLUMNS = [
+    'product_id', 'seller_id', 'title', 'current_price', 'was_price', 'location', 'image_url',
+    'product_url', 'tags', 'first_seen_date', 'last_seen_date', 'closing_date'
+]
+
+def parse_price(price) -> Optional[int]:
+    """
+    Parse a scraped price like '1,200' or '₪900' to whole shekels
+    """
+    digits = re.sub(r'[^\d]', '', str(price or '').split('.')[0])
+    return int(digits) if digits else None
+
+def store_path_for(csv_path: str) -> str:
+    """
+    Database path for a yad2_collections_*.csv output file
+    """
+    return f"{os.path.splitext(csv_path)[0]}.db"
+
+class ListingStore:
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        columns = ', '.join(f'"{column}" TEXT' for column in LISTING_COLUMNS if column != 'product_id')
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS listings (product_id TEXT PRIMARY KEY, {columns})')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_listings_last_seen ON listings (last_seen_date)')
+        # Only the active listings, so closed listing detection never touches the closed history
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_listings_active ON listings (product_id) '
+                          'WHERE closing_date IS NULL')
+        # One row per price change, clustered by listing for fast trajectories
+        self.conn.execute('CREATE TABLE IF NOT EXISTS price_history ('
+                          'product_id TEXT NOT NULL, observed_date TEXT NOT NULL, price INTEGER NOT NULL, '
+                          'PRIMARY KEY (product_id, observed_date)) WITHOUT ROWID')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_price_history_date ON price_history (observed_date)')
+        self.conn.commit()
+        self.columns = self._table_columns()
+
+    def _table_columns(self) -> List[str]:
+        return [row[1] for row in self.conn.execute('PRAGMA table_info(listings)')]
+
+    def _ensure_columns(self, columns: List[str]):
+        """
+        Add any columns the listings carry that the table does not have yet
+        """
+        for column in columns:
+            if column not in self.columns:
+                self.conn.execute(f'ALTER TABLE listings ADD COLUMN "{column}" TEXT')
+                self.columns.append(column)
+
+    def upsert_listings(self, listings: List[Dict]) -> Tuple[int, int]:
+        """
+        Insert new listings and update last_seen_date/current_price of known ones in one transaction
+        Returns the number of (updated, inserted) listings
+        """
+        if not listings:
+            return 0, 0
+
+        columns = list(dict.fromkeys(column for listing in listings for column in listing))
+        self._ensure_columns(columns)
+        rows = [tuple(None if listing.get(column) is None else str(listing.get(column)) for column in columns)
+                for listing in listings]
+
+        quoted = ', '.join(f'"{column}"' for column in columns)
+        placeholders = ', '.join('?' for _ in columns)
+        product_ids = {str(listing['product_id']) for listing in listings}
+        with self.conn:
+            self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS batch_ids (product_id TEXT PRIMARY KEY)')
+            self.conn.execute('DELETE FROM batch_ids')
+            self.conn.executemany('INSERT INTO batch_ids VALUES (?)', [(product_id,) for product_id in product_ids])
+            known = self.conn.execute(
+                'SELECT COUNT(*) FROM batch_ids JOIN listings USING (product_id)').fetchone()[0]
+            self.conn.executemany(
+                f'INSERT INTO listings ({quoted}) VALUES ({placeholders}) '
+                'ON CONFLICT(product_id) DO UPDATE SET '
+                'last_seen_date = excluded.last_seen_date, current_price = excluded.current_price, '
+                'closing_date = NULL',
+                rows)
+            self._record_prices(listings)
+        inserted = len(product_ids) - known
+        logging.info(f"Upserted {known} known listings and {inserted} new listings into {self.db_path}")
+        return known, inserted
+
+    def _record_prices(self, listings: List[Dict]):
+        """
+        Append a price observation for every listing whose price differs from its last recorded one
+        """
+        observations = {}
+        for listing in listings:
+            price = parse_price(listing.get('current_price'))
+            if price is not None and listing.get('last_seen_date'):
+                observations[str(listing['product_id'])] = (listing['last_seen_date'], price)
+        if not observations:
+            return
+
+        self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS batch_prices '
+                          '(product_id TEXT PRIMARY KEY, observed_date TEXT, price INTEGER)')
+        self.conn.execute('DELETE FROM batch_prices')
+        self.conn.executemany('INSERT INTO batch_prices VALUES (?, ?, ?)',
+                              [(product_id, date, price) for product_id, (date, price) in observations.items()])
+        # A second change on the same day replaces that day's observation
+        self.conn.execute(
+            'INSERT OR REPLACE INTO price_history (product_id, observed_date, price) '
+            'SELECT b.product_id, b.observed_date, b.price FROM batch_prices b '
+            'WHERE b.price IS NOT (SELECT h.price FROM price_history h '
+            'WHERE h.product_id = b.product_id AND h.observed_date <= b.observed_date '
+            'ORDER BY h.observed_date DESC LIMIT 1)')
+
+    def price_trajectory(self, product_id: str) -> pd.DataFrame:
+        """
+        All recorded prices of one listing, oldest first
+        """
+        return pd.read_sql_query(
+            'SELECT observed_date, price FROM price_history WHERE product_id = ? ORDER BY observed_date',
+            self.conn, params=(str(product_id),))
+
+    def price_drops(self, days: int = 7, as_of: str = None) -> pd.DataFrame:
+        """
+        All price drops recorded in the last `days` days, biggest drop first
+        """
+        as_of = pd.Timestamp(as_of) if as_of else pd.Timestamp.now()
+        since = (as_of - pd.Timedelta(days=days)).strftime('%Y-%m-%d')
+        return pd.read_sql_query(
+            'SELECT d.product_id, l.title, d.observed_date, d.previous_price, d.price, '
+            'd.previous_price - d.price AS drop_amount FROM ('
+            '  SELECT product_id, observed_date, price, '
+            '         LAG(price) OVER (PARTITION BY product_id ORDER BY observed_date) AS previous_price '
+            '  FROM price_history '
+            '  WHERE product_id IN (SELECT product_id FROM price_history WHERE observed_date >= ?)'
+            ') d LEFT JOIN listings l USING (product_id) '
+            'WHERE d.observed_date >= ? AND d.price < d.previous_price '
+            'ORDER BY drop_amount DESC',
+            self.conn, params=(since, since))
+
+    def _fill_ids_table(self, product_ids):
+        self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS query_ids (product_id TEXT PRIMARY KEY)')
+        self.conn.execute('DELETE FROM query_ids')
+        self.conn.executemany('INSERT OR IGNORE INTO query_ids VALUES (?)', ((str(p),) for p in product_ids))
+
+    def max_first_seen_date(self, product_ids: List[str]) -> Optional[str]:
+        """
+        The newest first_seen_date among the given listings
+        """
+        with self.conn:
+            self._fill_ids_table(product_ids)
+            return self.conn.execute('SELECT MAX(first_seen_date) FROM listings '
+                                     'WHERE product_id IN (SELECT product_id FROM query_ids)').fetchone()[0]
+
+    def mark_closed(self, seen_ids: Set[str], closing_date: str, first_seen_after: str = None) -> int:
+        """
+        Set closing_date on active listings not in seen_ids, in a single UPDATE.
+        With first_seen_after, only listings first seen after that date are considered
+        Returns the number of listings closed
+        """
+        query = ("UPDATE listings SET closing_date = ? WHERE closing_date IS NULL "
+                 "AND product_id NOT IN (SELECT product_id FROM query_ids)")
+        params = [closing_date]
+        if first_seen_after is not None:
+            query += ' AND first_seen_date > ?'
+            params.append(first_seen_after)
+        with self.conn:
+            self._fill_ids_table(seen_ids)
+            return self.conn.execute(query, params).rowcount
+
+    def load_product_ids(self) -> Set[str]:
+        """
+        Load only the product_id column
+        """
+        return {row[0] for row in self.conn.execute('SELECT product_id FROM listings')}
+
+    def load(self, columns: List[str] = None) -> pd.DataFrame:
+        """
+        Load the listings, reading only the requested columns
+        """
+        columns = [column for column in (columns or self.columns) if column in self.columns]
+        quoted = ', '.join(f'"{column}"' for column in columns)
+        return pd.read_sql_query(f'SELECT {quoted} FROM listings', self.conn, dtype=str)
+
+    def count(self) -> int:
+        return self.conn.execute('SELECT COUNT(*) FROM listings').fetchone()[0]
+
+    def export_csv(self, csv_path: str, chunksize: int = 50_000):
+        """
+        Export the listings to CSV, sorted like the CSV files used to be, streamed in chunks
+        """
+        quoted = ', '.join(f'"{column}"' for column in self.columns)
+        query = f'SELECT {quoted} FROM listings ORDER BY last_seen_date DESC, product_id ASC'
+        temp_filename = f"{csv_path}.temp"
+        first_chunk = True
+        for chunk in pd.read_sql_query(query, self.conn, chunksize=chunksize, dtype=str):
+            chunk.to_csv(temp_filename, mode='w' if first_chunk else 'a', header=first_chunk,
+                         index=False, encoding='utf-8-sig' if first_chunk else 'utf-8')
+            first_chunk = False
+        if first_chunk:
+            pd.DataFrame(columns=self.columns).to_csv(temp_filename, index=False, encoding='utf-8-sig')
+        os.replace(temp_filename, csv_path)
+        logging.info(f"Exported {self.count()} listings from {self.db_path} to {csv_path}")
+
+    def close(self):
+        self.conn.close()
+
+def migrate_csv(csv_path: str, db_path: str = None) -> ListingStore:
+    """
+    Import a yad2_collections_*.csv file into its SQLite store, keeping the CSV in place
+    """
+    db_path = db_path or store_path_for(csv_path)
+    store = ListingStore(db_path)
+    df = pd.read_csv(csv_path, dtype=str)
+    df = df.dropna(subset=['product_id']).drop_duplicates(subset=['product_id'], keep='first')
+    store._ensure_columns(list(df.columns))
+
+    # Plain inserts, the first row per product_id in the CSV wins like a fresh import
+    quoted = ', '.join(f'"{column}"' for column in df.columns)
+    placeholders = ', '.join('?' for _ in df.columns)
+    rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+    with store.conn:
+        store.conn.executemany(f'INSERT OR IGNORE INTO listings ({quoted}) VALUES ({placeholders})', rows)
+        # Seed the price history with the last price seen in the CSV
+        store._record_prices(df[['product_id', 'current_price', 'last_seen_date']].to_dict('records'))
+    logging.info(f"Migrated {len(df)} listings from {csv_path} to {db_path}")
+    return store
+
+def load_listings(path: str, columns: List[str] = None) -> pd.DataFrame:
+    """
+    Load listings from either a CSV file or a SQLite store
+    """
+    if path.endswith('.db'):
+        store = ListingStore(path)
+        try:
+            return store.load(columns)
+        finally:
+            store.close()
+    return pd.read_csv(path, dtype=str, usecols=lambda column: columns is None or column in columns)
+
+def main():
+    # Migrate every collections CSV that does not have a store yet
+    for csv_path in glob.glob('yad2_collections_*.csv'):
+        if not os.path.exists(store_path_for(csv_path)):
+            migrate_csv(csv_path).close()
+
+if __name__ == "__main__":
+    main()
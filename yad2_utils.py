@@ -1,14 +1,456 @@
 import requests
 import logging
 import os
-import uuid
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
 from urllib.parse import urlparse
 import pandas as pd
-from typing import List, Dict
+from yad2_phash import PHASH_AVAILABLE, PHashIndex, dhash, get_shared_index
+from typing import Iterator, List, Dict, Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # No cross-process locking on Windows
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Embedded page data of the Next.js frontend
+NEXT_DATA_RE = re.compile(r'<script[^>]*id="__NEXT_DATA__"[^>]*>(.*?)</script>', re.S)
+
+# Headers for fetching HTML pages with the session, which defaults to JSON API headers
+PAGE_HEADERS = {
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Sec-Fetch-Dest': 'document',
+    'Sec-Fetch-Mode': 'navigate',
+}
+
+POLITENESS_STATE_FILE = "yad2_politeness.json"
+
+# Requests per second each host gets when it is healthy, shared by every script
+DEFAULT_HOST_RATES = {
+    'www.yad2.co.il': 2.0,
+    'img.yad2.co.il': 3.0,
+    'cdn.shopify.com': 3.0,
+}
+
+# Responses that mean we are going too fast
+THROTTLE_STATUS_CODES = {403, 429, 503}
+
+class PolitenessScheduler:
+    """
+    Central politeness for every fetch: a token bucket per host (kept as its next free send time),
+    with adaptive rates. 429s, captchas and latency spikes cut a host's rate in half, healthy
+    responses add it back step by step up to the configured rate. With a state_path the schedule
+    lives in a locked JSON file, so scripts running side by side share one budget per host
+    """
+    def __init__(self, rate: float = 1.0, host_rates: Dict[str, float] = None, capacity: float = 1.0,
+                 min_rate: float = 0.05, increase: float = 0.05, decrease: float = 0.5,
+                 latency_spike: float = 3.0, cooldown: float = 30.0,
+                 state_path: Optional[str] = POLITENESS_STATE_FILE):
+        self.rate = rate
+        self.host_rates = dict(DEFAULT_HOST_RATES if host_rates is None else host_rates)
+        self.capacity = capacity
+        self.min_rate = min_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_spike = latency_spike
+        self.cooldown = cooldown
+        self.state_path = state_path
+        self.lock = threading.Lock()
+        self.hosts: Dict[str, Dict] = {}
+
+    def base_rate(self, host: str) -> float:
+        return self.host_rates.get(host, self.rate)
+
+    @contextmanager
+    def _host_state(self, host: str):
+        """
+        Read-modify-write one host's state, under a file lock when the state is shared
+        """
+        with self.lock:
+            if not self.state_path:
+                yield self.hosts.setdefault(host, {'rate': self.base_rate(host), 'next_free': 0.0, 'latency': {}})
+                return
+            with open(f"{self.state_path}.lock", 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    try:
+                        with open(self.state_path, encoding='utf-8') as f:
+                            hosts = json.load(f)
+                    except (OSError, ValueError):
+                        hosts = {}
+                    yield hosts.setdefault(host, {'rate': self.base_rate(host), 'next_free': 0.0, 'latency': {}})
+                    temp_path = f"{self.state_path}.{os.getpid()}.temp"
+                    with open(temp_path, 'w', encoding='utf-8') as f:
+                        json.dump(hosts, f)
+                    os.replace(temp_path, self.state_path)
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def reserve(self, url: str) -> float:
+        """
+        Take the host's next send slot and return how many seconds to wait for it
+        """
+        host = urlparse(url).netloc
+        now = time.time()
+        with self._host_state(host) as state:
+            interval = 1 / min(state['rate'], self.base_rate(host))
+            # Up to `capacity` requests may go out back to back after an idle period
+            send_at = max(now, state['next_free'] - (self.capacity - 1) * interval)
+            state['next_free'] = max(state['next_free'], send_at) + interval
+        return send_at - now
+
+    def wait(self, url: str):
+        """
+        Block until the host's next send slot
+        """
+        time.sleep(self.reserve(url))
+
+    def record(self, url: str, status: int = None, latency: float = None, blocked: bool = False,
+               retry_after: float = None, request_class: str = 'http'):
+        """
+        Adapt the host's rate to a response: back off on throttling, captchas, errors and
+        latency spikes, speed back up on healthy responses. Latency is averaged per request_class,
+        so a full browser page load is only compared with other browser page loads
+        """
+        host = urlparse(url).netloc
+        base = self.base_rate(host)
+        with self._host_state(host) as state:
+            throttled = blocked or status in THROTTLE_STATUS_CODES
+            failed = (status is None and latency is None) or (status or 0) >= 500
+            if not isinstance(state.get('latency'), dict):
+                state['latency'] = {}  # State written before latency was kept per request class
+            average = state['latency'].get(request_class)
+            spike = latency is not None and average is not None and latency > self.latency_spike * average
+            rate = min(state['rate'], base)
+            if throttled or failed or spike:
+                state['rate'] = max(self.min_rate, rate * self.decrease)
+                if throttled:
+                    # Nobody sends to this host until the cooldown is over
+                    state['next_free'] = max(state['next_free'], time.time() + (retry_after or self.cooldown))
+            else:
+                state['rate'] = min(base, rate + self.increase * base)
+            if latency is not None and not throttled:
+                state['latency'][request_class] = latency if average is None else 0.8 * average + 0.2 * latency
+            new_rate = state['rate']
+        if throttled or failed or spike:
+            reason = 'blocked' if throttled else 'error' if failed else f"latency spike {latency:.1f}s"
+            logging.warning(f"Backing off {host} ({reason}, status {status}): {new_rate:.2f} requests/s")
+
+    def get(self, session, url: str, **kwargs) -> requests.Response:
+        """
+        GET with the session in the host's next send slot, and adapt to the response
+        """
+        self.wait(url)
+        start = time.time()
+        try:
+            response = session.get(url, **kwargs)
+        except requests.exceptions.RequestException:
+            self.record(url)
+            raise
+        retry_after = response.headers.get('Retry-After', '')
+        self.record(url, status=response.status_code, latency=time.time() - start,
+                    blocked=is_captcha_response(response),
+                    retry_after=float(retry_after) if retry_after.isdigit() else None)
+        return response
+
+# The challenge page's wrapper, the same element the Selenium path looks for (div.captcha-wrapper)
+CAPTCHA_CLASS = 'captcha-wrapper'
+CAPTCHA_RE = re.compile(r'<div[^>]*class="[^"]*\b' + CAPTCHA_CLASS + r'\b')
+
+def is_captcha_response(response: requests.Response) -> bool:
+    """
+    Whether an HTML response is a CAPTCHA challenge. Pages that merely load a CAPTCHA
+    script or mention the word are not
+    """
+    return 'html' in response.headers.get('Content-Type', '') and CAPTCHA_RE.search(response.text) is not None
+
+_shared_scheduler = None
+_shared_scheduler_lock = threading.Lock()
+
+def get_shared_scheduler() -> PolitenessScheduler:
+    """
+    The scheduler shared by every scraper in this process, and through its state file with other processes
+    """
+    global _shared_scheduler
+    with _shared_scheduler_lock:
+        if _shared_scheduler is None:
+            _shared_scheduler = PolitenessScheduler()
+        return _shared_scheduler
+
+class JsonlJournal:
+    """
+    Append-only JSONL journal, every record is flushed to disk as soon as it is written
+    """
+    def __init__(self, path: str, fsync: bool = True):
+        self.path = path
+        self.fsync = fsync
+        # Start on a fresh line if a crash left a torn last record
+        torn = False
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                torn = f.read(1) != b'\n'
+        self.file = open(path, 'a', encoding='utf-8')
+        if torn:
+            self.file.write('\n')
+
+    def append(self, record: Dict):
+        self.append_many([record])
+
+    def append_many(self, records: List[Dict]):
+        """
+        Append a batch of records with a single write and flush
+        """
+        self.file.write(''.join(json.dumps(record, ensure_ascii=False, default=str) + '\n' for record in records))
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+    @staticmethod
+    def iter_records(path: str) -> Iterator[Dict]:
+        """
+        Stream the records of a journal, skipping a torn last line left by a crash
+        """
+        if not os.path.exists(path):
+            return
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    logging.warning(f"Skipping corrupt line in {path}")
+
+    @staticmethod
+    def read_keys(path: str, key: str) -> Set[str]:
+        """
+        Read only one key of every record
+        """
+        return {record[key] for record in JsonlJournal.iter_records(path) if record.get(key)}
+
+def read_csv_column(path: str, column: str) -> Set[str]:
+    """
+    Read only one column of a CSV file, an empty set if the file or column does not exist
+    """
+    if not os.path.exists(path):
+        return set()
+    try:
+        return set(pd.read_csv(path, dtype=str, usecols=[column])[column].dropna())
+    except ValueError:
+        return set()
+
+def compact_journal_to_csv(journal_path: str, csv_path: str, chunksize: int = 10_000, merge_existing: bool = True):
+    """
+    Merge a JSONL journal into a CSV file with constant memory: both are streamed in chunks
+    into a temporary file that atomically replaces the CSV, then the journal is removed.
+    Without merge_existing the CSV is replaced by the journal records alone
+    """
+    if not os.path.exists(journal_path):
+        return
+
+    # Union of the CSV header and the journal keys, in order of first appearance
+    merge_existing = merge_existing and os.path.exists(csv_path)
+    columns = list(pd.read_csv(csv_path, dtype=str, nrows=0).columns) if merge_existing else []
+    for record in JsonlJournal.iter_records(journal_path):
+        columns.extend(key for key in record if key not in columns)
+
+    temp_filename = f"{csv_path}.temp"
+    first_chunk = True
+    def write_chunk(df: pd.DataFrame):
+        nonlocal first_chunk
+        df.reindex(columns=columns).to_csv(temp_filename, mode='w' if first_chunk else 'a', header=first_chunk,
+                                           index=False, encoding='utf-8-sig' if first_chunk else 'utf-8')
+        first_chunk = False
+
+    n_records = 0
+    try:
+        if merge_existing:
+            for chunk in pd.read_csv(csv_path, dtype=str, chunksize=chunksize):
+                write_chunk(chunk)
+        batch = []
+        for record in JsonlJournal.iter_records(journal_path):
+            batch.append(record)
+            if len(batch) >= chunksize:
+                write_chunk(pd.DataFrame(batch))
+                n_records += len(batch)
+                batch = []
+        if batch or first_chunk:
+            write_chunk(pd.DataFrame(batch))
+            n_records += len(batch)
+        os.replace(temp_filename, csv_path)
+    except Exception:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
+    os.remove(journal_path)
+    logging.info(f"Compacted {n_records} journal records into {csv_path}")
+
+class ImageDownloader:
+    """
+    Background image downloads on a bounded thread pool sharing one pooled session.
+    Images are stored once under their sha256 in sharded directories (images/ab/cd/<sha256>.jpg),
+    and an SQLite index maps image URLs and product_ids to their hash, so a known image is never fetched again.
+    With a phash_index, every listing's image is also checked for reposts in the background
+    """
+    def __init__(self, images_dir: str = 'images', headers: Dict = None, max_workers: int = 4,
+                 phash_index: PHashIndex = None, scheduler: PolitenessScheduler = None):
+        self.images_dir = images_dir
+        self.scheduler = scheduler
+        self.phash_index = phash_index
+        os.makedirs(images_dir, exist_ok=True)
+        self.session = requests.Session()
+        self.session.headers.update(headers or {})
+        adapter = requests.adapters.HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='image-download')
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(images_dir, 'index.db'), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute('CREATE TABLE IF NOT EXISTS image_urls (image_url TEXT PRIMARY KEY, '
+                          'image_hash TEXT NOT NULL, path TEXT NOT NULL)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS product_images (product_id TEXT PRIMARY KEY, '
+                          'image_hash TEXT NOT NULL)')
+        self.conn.commit()
+        # Downloads in progress by URL, so cards sharing an image wait on the same download
+        self.in_flight: Dict[str, Future] = {}
+        self.stats = {'downloaded': 0, 'known_url': 0, 'duplicate_content': 0, 'failed': 0, 'bytes': 0}
+
+    def image_path(self, image_hash: str, image_url: str) -> str:
+        file_extension = os.path.splitext(urlparse(image_url).path)[1] or '.jpg'  # Default to jpg
+        return os.path.join(self.images_dir, image_hash[:2], image_hash[2:4], f"{image_hash}{file_extension}")
+
+    def submit(self, product_id: Optional[str], image_url: str) -> Future:
+        """
+        Queue an image for download without waiting on it
+        Returns a future of (image_hash, path), or None if the download failed
+        """
+        with self.lock:
+            known = self.conn.execute('SELECT image_hash, path FROM image_urls WHERE image_url = ?',
+                                      (image_url,)).fetchone()
+            if known:
+                self.stats['known_url'] += 1
+                future = Future()
+                future.set_result(known)
+            else:
+                future = self.in_flight.get(image_url)
+                if future is None:
+                    future = self.pool.submit(self._download, image_url)
+                    self.in_flight[image_url] = future
+        if product_id:
+            if known:
+                # Still hashed on the pool, so the caller never waits on image decoding
+                self.pool.submit(self._map_product, product_id, image_url, known)
+            else:
+                future.add_done_callback(lambda f: self._map_product(product_id, image_url, f.result()))
+        return future
+
+    def _download(self, image_url: str) -> Optional[Tuple[str, str]]:
+        try:
+            if self.scheduler is not None:
+                response = self.scheduler.get(self.session, image_url, timeout=30)
+            else:
+                response = self.session.get(image_url, timeout=30)
+            response.raise_for_status()
+            image_hash = hashlib.sha256(response.content).hexdigest()
+            path = self.image_path(image_hash, image_url)
+            if os.path.exists(path):
+                duplicate = True
+            else:
+                duplicate = False
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temp_path = f"{path}.{threading.get_ident()}.temp"
+                with open(temp_path, 'wb') as f:
+                    f.write(response.content)
+                os.replace(temp_path, path)
+        except Exception as e:
+            logging.error(f"Error downloading image {image_url}: {e}")
+            with self.lock:
+                self.stats['failed'] += 1
+                self.in_flight.pop(image_url, None)
+            return None
+
+        with self.lock:
+            with self.conn:
+                self.conn.execute('INSERT OR REPLACE INTO image_urls VALUES (?, ?, ?)', (image_url, image_hash, path))
+            self.in_flight.pop(image_url, None)
+            if duplicate:
+                self.stats['duplicate_content'] += 1
+            else:
+                self.stats['downloaded'] += 1
+                self.stats['bytes'] += len(response.content)
+        logging.debug(f"Downloaded image {image_url} to {path}")
+        return image_hash, path
+
+    def _map_product(self, product_id: str, image_url: str, result: Optional[Tuple[str, str]]):
+        if result is None:
+            return
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO product_images VALUES (?, ?)', (str(product_id), result[0]))
+        if self.phash_index is not None:
+            try:
+                self.phash_index.add_image(product_id, result[0], result[1], image_url)
+            except Exception as e:
+                logging.error(f"Error hashing image {result[1]}: {e}")
+
+    def submit_hash(self, product_id: str, image_url: str) -> Future:
+        """
+        Check a listing's image for reposts without storing it: the image is fetched and hashed
+        in memory, listings already in the index are only checked again, never fetched
+        Returns a future of the (product_id, distance) the listing duplicates, if any
+        """
+        phash = self.phash_index.hash_of(product_id)
+        if phash is not None:
+            return self.pool.submit(self.phash_index.add, product_id, phash, image_url)
+        return self.pool.submit(self._hash_image, product_id, image_url)
+
+    def _hash_image(self, product_id: str, image_url: str) -> Optional[Tuple[str, int]]:
+        try:
+            if self.scheduler is not None:
+                response = self.scheduler.get(self.session, image_url, timeout=30)
+            else:
+                response = self.session.get(image_url, timeout=30)
+            response.raise_for_status()
+            return self.phash_index.add(product_id, dhash(response.content), image_url)
+        except Exception as e:
+            logging.error(f"Error hashing image {image_url}: {e}")
+            with self.lock:
+                self.stats['failed'] += 1
+            return None
+
+    def image_hash_for(self, product_id: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute('SELECT image_hash FROM product_images WHERE product_id = ?',
+                                    (str(product_id),)).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        """
+        Wait for the queued downloads and log what was fetched
+        """
+        self.pool.shutdown(wait=True)
+        stats = self.stats
+        if any(stats.values()):
+            logging.info(f"Images: {stats['downloaded']} downloaded ({stats['bytes'] / 1024 / 1024:.1f} MB), "
+                         f"{stats['known_url']} already stored, {stats['duplicate_content']} duplicate content, "
+                         f"{stats['failed']} failed")
+        self.session.close()
+        self.conn.close()
+
 class Yad2BaseScraper:
     def __init__(self, download_images: bool = False):
         self.headers = {
@@ -32,33 +474,78 @@ class Yad2BaseScraper:
         # Create a session object
         self.session = requests.Session()
         self.session.headers.update(self.headers)
+        # Every request waits for its host's politeness slot
+        self.scheduler = get_shared_scheduler()
+        # Images are downloaded in the background, started on first use
+        self._image_downloader = None
+
+    @property
+    def image_downloader(self) -> ImageDownloader:
+        if self._image_downloader is None:
+            # Repost detection needs Pillow, images are still downloaded without it
+            phash_index = get_shared_index(os.path.join(self.images_dir, 'phash.db')) if PHASH_AVAILABLE else None
+            self._image_downloader = ImageDownloader(self.images_dir, self.headers, phash_index=phash_index,
+                                                     scheduler=self.scheduler)
+        return self._image_downloader
+
+    def queue_image_download(self, product_id: str, image_url: str) -> Future:
+        """
+        Download an image in the background, the caller never waits on image I/O
+        """
+        return self.image_downloader.submit(product_id, image_url)
+
+    def queue_image_hash(self, product_id: str, image_url: str) -> Optional[Future]:
+        """
+        Check a listing's image for reposts in the background without keeping the image,
+        None when Pillow is not installed
+        """
+        if not PHASH_AVAILABLE:
+            return None
+        return self.image_downloader.submit_hash(product_id, image_url)
 
-    def download_image(self, image_url: str) -> str:
+    def download_image(self, image_url: str, product_id: str = None) -> str:
         """
-        Download an image and save it with a UUID filename
+        Download an image into the content-addressed image store and wait for it
         Returns the local path to the saved image
         """
+        result = self.queue_image_download(product_id, image_url).result()
+        return result[1] if result else ""
+
+    def close_image_downloader(self):
+        """
+        Wait for queued image downloads, safe to call more than once
+        """
+        if self._image_downloader is not None:
+            self._image_downloader.close()
+            self._image_downloader = None
+
+    def fetch_embedded_data(self, url: str, params: Dict = None, timeout: int = 15) -> Optional[Dict]:
+        """
+        Fetch a page with the pooled session and decode its embedded __NEXT_DATA__ JSON
+        Returns None when blocked, on a CAPTCHA, or when the page has no embedded data
+        """
         try:
-            # Generate a unique filename with the original extension
-            file_extension = os.path.splitext(urlparse(image_url).path)[1]
-            if not file_extension:
-                file_extension = '.jpg'  # Default to jpg if no extension found
-            filename = f"{uuid.uuid4()}{file_extension}"
-            filepath = os.path.join(self.images_dir, filename)
-
-            # Download and save the image
-            response = requests.get(image_url, headers=self.headers)
-            response.raise_for_status()
-            
-            with open(filepath, 'wb') as f:
-                f.write(response.content)
-            
-            logging.info(f"Downloaded image: {filename}")
-            return filepath
+            response = self.scheduler.get(self.session, url, params=params, headers=PAGE_HEADERS, timeout=timeout)
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Error fetching {url}: {e}")
+            return None
 
-        except Exception as e:
-            logging.error(f"Error downloading image {image_url}: {e}")
-            return ""
+        if response.status_code in (403, 429) or is_captcha_response(response):
+            logging.warning(f"Blocked fetching {response.url} (status {response.status_code})")
+            return None
+        if not response.ok:
+            logging.error(f"Error fetching {response.url}: status {response.status_code}")
+            return None
+
+        match = NEXT_DATA_RE.search(response.text)
+        if not match:
+            logging.info(f"No embedded data found in {response.url}")
+            return None
+        try:
+            return json.loads(match.group(1))
+        except ValueError as e:
+            logging.error(f"Error decoding embedded data from {response.url}: {e}")
+            return None
 
     def save_to_csv(self, listings: List[Dict], filename: str):
         """